@@ -2,15 +2,31 @@
 ASGI config for bitcoinExchange project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections are served by the exchange market data application and the HTTP requests under
+the async API prefix by the async API application. The other HTTP requests are served by the Django
+WSGI application, run in a thread by the asgiref adapter: Django 2.2 has no ASGI handler.
 
 For more information on this file, see
-https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+https://asgi.readthedocs.io/en/latest/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bitcoinExchange.settings')
 
-application = get_asgi_application()
+django_application = WsgiToAsgi(get_wsgi_application())
+
+from exchange.async_api import ASYNC_API_PREFIX, async_api_application  # noqa: E402  Apps must be loaded first
+from exchange.websocket import market_data_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await market_data_application(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'].startswith(ASYNC_API_PREFIX):
+        await async_api_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -61,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'exchange.middleware.InstrumentationMiddleware',
 ]
 
 ROOT_URLCONF = 'bitcoinExchange.urls'
@@ -95,6 +96,18 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The file-based cache is shared by all the workers of the host
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -152,10 +165,66 @@ ACCOUNT_EMAIL_REQUIRED = (True)
 # Authentication settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'exchange.api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'exchange.api.throttling.TokenBucketThrottle',
+    ),
 }
+
+
+# Exchange settings
+# Partially fill orders across several price levels, otherwise only orders with the same quantity are matched
+EXCHANGE_PARTIAL_FILLS = True
+
+# Match the orders in the 'run_matching_engine' process instead of the web workers
+EXCHANGE_MATCHING_ENGINE = False
+EXCHANGE_QUEUE_PATH = os.path.join(BASE_DIR, 'matching_queue.sqlite3')
+# Fills kept in the queue file for the readers, the older ones are pruned by the matching engine
+EXCHANGE_QUEUE_FILLS_KEPT = 10000
+# Matching engine processes, the books are sharded by symbol, see 'run_matching_engine --shard'
+EXCHANGE_MATCHING_SHARDS = 1
+
+# Seconds the profile statistics are cached, they are also discarded on every wallet or order change
+EXCHANGE_PROFILE_CACHE_TIMEOUT = 300
+
+# Seconds a depth snapshot is cached, a new snapshot is built as soon as the book changes
+EXCHANGE_DEPTH_CACHE_TIMEOUT = 300
+
+# Maximum number of orders submitted in one batch
+EXCHANGE_MAX_BATCH_SIZE = 100
+
+# Measure queries and timings of each request, see 'exchange.middleware.InstrumentationMiddleware'
+EXCHANGE_INSTRUMENTATION = False
+
+# Append the order and wallet events to a binary log, see the 'snapshot_event_log' and 'replay_event_log' commands
+EXCHANGE_EVENT_LOG = False
+EXCHANGE_EVENT_LOG_PATH = os.path.join(BASE_DIR, 'events.log')
+EXCHANGE_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots')
+
+# Tokens whose user, profile and wallet ids are cached by each process, and seconds they are cached.
+# The revocations are shared through the cache above.
+EXCHANGE_TOKEN_CACHE_SIZE = 10000
+EXCHANGE_TOKEN_CACHE_TIMEOUT = 300
+
+# Maximum number of active orders of a profile, stop orders included
+EXCHANGE_MAX_OPEN_ORDERS = 1000
+
+# Throttle the requests of each user and admit the new orders through a queue shared by the workers of the host
+EXCHANGE_ADMISSION_CONTROL = False
+EXCHANGE_ADMISSION_PATH = os.path.join(BASE_DIR, 'admission.sqlite3')
+# Scope of the views -> (requests per second, burst) of each user and endpoint
+EXCHANGE_THROTTLE_RATES = {'orders': (10, 20), 'reads': (20, 40)}
+# Orders placed at the same time, requests waiting for a slot and seconds they wait
+EXCHANGE_ADMISSION_SLOTS = 8
+EXCHANGE_ADMISSION_QUEUE_SIZE = 64
+EXCHANGE_ADMISSION_TIMEOUT = 2
+# Seconds after which the slot of a crashed worker is released
+EXCHANGE_ADMISSION_LEASE = 30
+
+# Profiles in each leaderboard, see the 'compute_leaderboards' command
+EXCHANGE_LEADERBOARD_SIZE = 100
@@ -15,6 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
+from exchange.views import metrics
 
 urlpatterns = [
     # Administrator panel
@@ -29,4 +30,7 @@ urlpatterns = [
 
     # Exchange endpoints
     path('api/', include('exchange.api.urls')),
+
+    # Prometheus metrics, see EXCHANGE_INSTRUMENTATION
+    path('metrics/', metrics, name='metrics'),
 ]
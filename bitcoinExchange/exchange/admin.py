@@ -1,7 +1,12 @@
 from django.contrib import admin
-from exchange.models import Order, Profile, Transaction, Wallet
+from exchange.models import Balance, Candle, Fill, Leaderboards, Order, Profile, TraderStatistics, Transaction, Wallet
 
+admin.site.register(Balance)
+admin.site.register(Candle)
+admin.site.register(Fill)
+admin.site.register(Leaderboards)
 admin.site.register(Order)
 admin.site.register(Profile)
+admin.site.register(TraderStatistics)
 admin.site.register(Transaction)
 admin.site.register(Wallet)
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from exchange.models import Profile, Wallet
+from exchange.utils.token_cache import get_token_cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication resolving a token to its user, profile and wallet with one query, then from
+    'exchange.utils.token_cache' until the token is deleted or the entry expires.
+
+    'request.user.profile' and 'request.user.profile.wallet' are loaded with their ids only, any other
+    field is read from the database when it is accessed.
+    """
+
+    def authenticate_credentials(self, key):
+        token_cache = get_token_cache()
+        entry = token_cache.get(key)
+        if entry is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user__profile__wallet').get(key=key)
+            except model.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise AuthenticationFailed(_('User inactive or deleted.'))
+            profile = token.user.profile
+            token_cache.set(key, token.user, profile.pk, profile.wallet.pk)
+            return token.user, token
+
+        user = User.from_db(DEFAULT_DB_ALIAS, entry.user_fields, entry.user_values)
+        profile = Profile.from_db(DEFAULT_DB_ALIAS, ['id', 'user_id'], [entry.profile_id, user.pk])
+        profile.wallet = Wallet.from_db(DEFAULT_DB_ALIAS, ['id', 'profile_id'], [entry.wallet_id, entry.profile_id])
+        user.profile = profile
+        token = self.get_model()(key=key, user=user)
+        return user, token
@@ -0,0 +1,76 @@
+from decimal import Decimal, InvalidOperation
+from exchange.utils.amounts import to_fixed_point
+from exchange.utils.instruments import get_price_scale
+from rest_framework import serializers
+
+
+class FixedPointField(serializers.Field):
+    """
+    Decimal amount in the APIs, integer amount of the given scale in the database.
+
+    :argument
+    - scale: Integer units in one decimal unit, e.g. 'SATOSHI' or 'CENT'.
+    - positive: Reject the values that are not greater than 0 once converted to the scale.
+    """
+
+    default_error_messages = {
+        'invalid': 'A valid number is required.',
+        'positive': 'Ensure this value is greater than 0 at the precision of the field.',
+    }
+
+    def __init__(self, scale, positive=False, **kwargs):
+        self.scale = scale
+        self.positive = positive
+        super().__init__(**kwargs)
+
+    def to_decimal(self, data):
+        try:
+            value = Decimal(str(data).strip())
+        except InvalidOperation:
+            self.fail('invalid')
+        if not value.is_finite():
+            self.fail('invalid')
+        return value
+
+    def to_internal_value(self, data):
+        return self.check_positive(to_fixed_point(self.to_decimal(data), self.scale))
+
+    def check_positive(self, value):
+        if self.positive and value <= 0:
+            self.fail('positive')
+        return value
+
+    def to_representation(self, value):
+        return value / self.scale
+
+
+class PriceField(FixedPointField):
+    """
+    Decimal price in the APIs, integer amount of the quote asset of the instrument in the database,
+    e.g. cents for 'BTC-USD' and satoshis for 'ETH-BTC'.
+    The input is kept as a 'Decimal', the serializer converts it once the symbol is validated,
+    see 'to_price()', and checks it with 'check_positive()'.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(scale=None, **kwargs)
+
+    def get_attribute(self, instance):
+        # The scale depends on the symbol of the instance
+        value = super().get_attribute(instance)
+        return None if value is None else (value, get_price_scale(instance.symbol))
+
+    def to_internal_value(self, data):
+        return self.to_decimal(data)
+
+    def to_representation(self, value):
+        price, scale = value
+        return price / scale
+
+
+def to_price(value, symbol):
+    """
+    Convert a decimal price validated by 'PriceField' to the integer amount of the quote asset of a symbol.
+    """
+
+    return to_fixed_point(value, get_price_scale(symbol))
@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Cursor pagination for OrderViewSet.
+    Pages are keyed on created_at only, so every page costs the same index range scan. DRF cursors hold a
+    single position: orders created at the same instant as the last order of a page are skipped by an
+    offset within that instant, 'id' only makes their order stable.
+
+    :params
+    - cursor: Opaque cursor returned in the 'next'/'previous' links.
+    - page_size: Orders in each page, at most 'max_page_size'.
+    """
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created_at', '-id')
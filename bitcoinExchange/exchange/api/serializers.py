@@ -1,5 +1,9 @@
-from django.shortcuts import get_object_or_404
-from exchange.models import Order, Profile, Wallet
+from exchange.api.fields import FixedPointField, PriceField, to_price
+from exchange.models import Candle, Order, Profile
+from exchange.utils.aggregations import get_market_price
+from exchange.utils.amounts import CENT, SATOSHI, from_cents, from_satoshi
+from exchange.utils.formatting import format_datetime
+from exchange.utils.instruments import ASSET_SCALES, DEFAULT_SYMBOL, SYMBOLS
 from rest_framework import serializers
 
 
@@ -9,15 +13,25 @@ class OrderSerializer(serializers.ModelSerializer):
 
     :fields
     - profile
-    - price
-    - quantity
+    - symbol: BTC-USD (default)/ETH-USD/ETH-BTC.
+    - price: Quote asset for one base asset, e.g. dollars for one bitcoin, the limit price. Computed from
+             the book if not given for market buy orders, required as the highest price for stop buy orders.
+    - quantity: Base asset, e.g. bitcoins.
+    - filled_quantity: Base asset already executed.
     - type: Buy/Sell.
+    - kind: limit/market/stop/stop_limit.
+    - time_in_force: GTC/IOC/FOK, market orders are never GTC.
+    - stop_price: Quote asset for one base asset, required for stop and stop-limit orders.
     - status: False=executed, True=active.
     - created_at: Date format '31/12/2021, 23:59:59'.
     - executed_at: Date format '31/12/2021, 23:59:59'.
     """
 
     profile = serializers.StringRelatedField(read_only=True)
+    price = PriceField(required=False, positive=True)
+    quantity = FixedPointField(scale=SATOSHI, positive=True)
+    stop_price = PriceField(required=False, allow_null=True, positive=True)
+    filled_quantity = FixedPointField(scale=SATOSHI, read_only=True)
     status = serializers.BooleanField(read_only=True)
     created_at = serializers.SerializerMethodField(read_only=True)
     executed_at = serializers.SerializerMethodField(read_only=True)
@@ -26,31 +40,69 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         exclude = ['transaction']
 
+    def validate(self, data):
+        symbol = data.get('symbol', DEFAULT_SYMBOL)
+        for name in ('price', 'stop_price'):
+            if data.get(name) is not None:
+                try:
+                    data[name] = self.fields[name].check_positive(to_price(data[name], symbol))
+                except serializers.ValidationError as error:
+                    raise serializers.ValidationError({name: error.detail})
+
+        kind = data.get('kind', Order.LIMIT)
+        if kind in Order.STOP_KINDS and data.get('stop_price') is None:
+            raise serializers.ValidationError({'stop_price': ['This field is required for stop orders.']})
+        if kind not in Order.STOP_KINDS:
+            data['stop_price'] = None
+
+        if kind == Order.MARKET:
+            if data.get('time_in_force', Order.GOOD_TILL_CANCELED) == Order.GOOD_TILL_CANCELED:
+                data['time_in_force'] = Order.IMMEDIATE_OR_CANCEL
+            if data['type'] == 'S':
+                # Sell to any bid
+                data['price'] = 0
+            elif 'price' not in data:
+                # Freeze the quote asset needed at the worst price of the asks that fill the quantity
+                data['price'] = get_market_price('B', data['quantity'], symbol)
+                if data['price'] is None:
+                    raise serializers.ValidationError('no sell orders in the book')
+        elif kind == Order.STOP and data['type'] == 'S':
+            data['price'] = 0
+        elif 'price' not in data:
+            raise serializers.ValidationError({'price': ['This field is required.']})
+        return data
+
     def get_created_at(self, instance):
-        return instance.created_at.strftime("%d/%m/%Y, %H:%M:%S")
+        return format_datetime(instance.created_at)
 
     def get_executed_at(self, instance):
-        if instance.transaction:
-            return instance.transaction.executed_at.strftime("%d/%m/%Y, %H:%M:%S")
-        return None
+        # Joined by the views, see 'select_related('transaction')'
+        if instance.transaction_id is None:
+            return None
+        return format_datetime(instance.transaction.executed_at)
 
-    def validate(self, data):
-        # Validate the new order only if the amount needed to fulfill the order is available
 
-        request_user = self.context.get('request').user
-        user_wallet = get_object_or_404(Wallet, profile=request_user.profile)
+class OrderCancelSerializer(serializers.Serializer):
+    """
+    Filters of the active orders to cancel for OrderViewSet, every order is canceled if no filter is given.
 
-        if data['type'] == 'B':
-            # Check the dollar balance if it is a buy order
-            required_dollar = data['price'] * data['quantity']
-            if (user_wallet.available_dollar - required_dollar) < 0:
-                raise serializers.ValidationError('insufficient balance')
+    :fields
+    - symbol
+    - type: Buy/Sell.
+    - min_price: Quote asset of the symbol (BTC-USD by default) for one base asset.
+    - max_price: Quote asset of the symbol (BTC-USD by default) for one base asset.
+    """
 
-        elif data['type'] == 'S':
-            # Check the bitcoin balance if it is a sell order
-            if (user_wallet.available_bitcoin - data['quantity']) < 0:
-                raise serializers.ValidationError('insufficient balance')
+    symbol = serializers.ChoiceField(choices=SYMBOLS, required=False)
+    type = serializers.ChoiceField(choices=Order.ORDER_TYPES, required=False)
+    min_price = PriceField(required=False)
+    max_price = PriceField(required=False)
 
+    def validate(self, data):
+        symbol = data.get('symbol', DEFAULT_SYMBOL)
+        for name in ('min_price', 'max_price'):
+            if name in data:
+                data[name] = to_price(data[name], symbol)
         return data
 
 
@@ -59,23 +111,26 @@ class LatestOrdersSerializer(serializers.ModelSerializer):
     Order serializer for LatestOrdersListAPIView.
 
     :fields
-    - price
-    - quantity
+    - symbol
+    - price: Quote asset for one base asset.
+    - quantity: Base asset.
+    - filled_quantity: Base asset already executed.
     - type: Buy/Sell.
     - created_at: Date format '31/12/2021, 23:59:59'.
     """
 
-    price = serializers.FloatField(read_only=True)
-    quantity = serializers.FloatField(read_only=True)
+    price = PriceField(read_only=True)
+    quantity = FixedPointField(scale=SATOSHI, read_only=True)
+    filled_quantity = FixedPointField(scale=SATOSHI, read_only=True)
     type = serializers.CharField(read_only=True)
     created_at = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Order
-        exclude = ['profile', 'status', 'transaction']
+        exclude = ['profile', 'status', 'transaction', 'stop_price']
 
     def get_created_at(self, instance):
-        return instance.created_at.strftime("%d/%m/%Y, %H:%M:%S")
+        return format_datetime(instance.created_at)
 
 
 class ProfileSerializer(serializers.ModelSerializer):
@@ -89,36 +144,141 @@ class ProfileSerializer(serializers.ModelSerializer):
     - dollar_balance
     - bitcoin_balance
     - bitcoin_profit_percent: Percentage profits based on bitcoin.
+    - balances: Dict {asset: balance} of the assets that are not dollars or bitcoins, e.g. {"ETH": 1.5}.
     """
 
     user = serializers.StringRelatedField(read_only=True)
-    active_orders = serializers.SerializerMethodField(read_only=True)
-    executed_orders = serializers.SerializerMethodField(read_only=True)
+    active_orders = serializers.IntegerField(read_only=True)
+    executed_orders = serializers.IntegerField(read_only=True)
     dollar_balance = serializers.SerializerMethodField(read_only=True)
     bitcoin_balance = serializers.SerializerMethodField(read_only=True)
     bitcoin_profit_percent = serializers.SerializerMethodField(read_only=True)
+    balances = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Profile
         fields = '__all__'
 
-    def get_active_orders(self, instance):
-        return instance.orders.filter(status=True).count()
-
-    def get_executed_orders(self, instance):
-        return instance.orders.filter(status=False).count()
-
     def get_dollar_balance(self, instance):
-        return instance.wallet.available_dollar + instance.wallet.frozen_dollar
+        return from_cents(instance.wallet.available_dollar + instance.wallet.frozen_dollar)
 
     def get_bitcoin_balance(self, instance):
-        return instance.wallet.available_bitcoin + instance.wallet.frozen_bitcoin
+        return from_satoshi(instance.wallet.available_bitcoin + instance.wallet.frozen_bitcoin)
 
     def get_bitcoin_profit_percent(self, instance):
         delta_percent = 0
-        if instance.wallet.bitcoin_net_balance:
-            net_bitcoin = instance.wallet.bitcoin_net_balance
-            total_bitcoin = instance.wallet.available_bitcoin + instance.wallet.frozen_bitcoin
+        wallet = instance.wallet
+        if wallet.bitcoin_net_balance:
+            net_bitcoin = wallet.bitcoin_net_balance
+            total_bitcoin = wallet.available_bitcoin + wallet.frozen_bitcoin
             delta_percent = ((total_bitcoin - net_bitcoin) / net_bitcoin) * 100
 
         return round(delta_percent, 2)
+
+    def get_balances(self, instance):
+        # Prefetched by the views, see 'prefetch_related('balances')'
+        return {
+            balance.asset: (balance.available + balance.frozen) / ASSET_SCALES[balance.asset]
+            for balance in instance.balances.all()
+        }
+
+
+class CandleSerializer(serializers.ModelSerializer):
+    """
+    Candle serializer for CandleListAPIView.
+
+    :fields
+    - interval: 1m/5m/1h/1d.
+    - opened_at: Datetime format '31/12/2021, 23:59:59', UTC.
+    - open/high/low/close: Dollars for one bitcoin.
+    - volume: Bitcoins.
+    - trades
+    """
+
+    opened_at = serializers.SerializerMethodField(read_only=True)
+    open = FixedPointField(scale=CENT, read_only=True)
+    high = FixedPointField(scale=CENT, read_only=True)
+    low = FixedPointField(scale=CENT, read_only=True)
+    close = FixedPointField(scale=CENT, read_only=True)
+    volume = FixedPointField(scale=SATOSHI, read_only=True)
+
+    class Meta:
+        model = Candle
+        exclude = ['id']
+
+    def get_opened_at(self, instance):
+        return format_datetime(instance.opened_at)
+
+
+class MarketStatisticsSerializer(serializers.Serializer):
+    """
+    Market statistics serializer for MarketStatisticsAPIView.
+
+    :fields
+    - trades: Number of fills in the last 24 hours.
+    - volume: Bitcoins executed in the last 24 hours.
+    - dollar_volume: Dollars executed in the last 24 hours.
+    - last_price: Dollars for one bitcoin.
+    - best_bid: Dollars for one bitcoin.
+    - best_ask: Dollars for one bitcoin.
+    - spread: Dollars.
+    """
+
+    trades = serializers.IntegerField(read_only=True)
+    volume = FixedPointField(scale=SATOSHI, source='quantity', read_only=True)
+    dollar_volume = FixedPointField(scale=CENT, source='dollar_amount', read_only=True)
+    last_price = FixedPointField(scale=CENT, read_only=True)
+    best_bid = FixedPointField(scale=CENT, read_only=True)
+    best_ask = FixedPointField(scale=CENT, read_only=True)
+    spread = FixedPointField(scale=CENT, read_only=True)
+
+
+class PortfolioDaySerializer(serializers.Serializer):
+    """
+    Daily figures of PortfolioAnalyticsSerializer.
+
+    :fields
+    - date: Format '31/12/2021', UTC.
+    - trades: Number of fills of the day.
+    - volume: Base asset executed.
+    - amount: Quote asset executed.
+    - equity: Quote asset, P&L of the instrument marked at the last fill of the day.
+    """
+
+    date = serializers.DateField(format='%d/%m/%Y', read_only=True)
+    trades = serializers.IntegerField(read_only=True)
+    volume = FixedPointField(scale=SATOSHI, source='quantity', read_only=True)
+    amount = PriceField(read_only=True)
+    equity = PriceField(read_only=True)
+
+
+class PortfolioAnalyticsSerializer(serializers.Serializer):
+    """
+    Portfolio analytics serializer for PortfolioAnalyticsAPIView.
+    Amounts are in the quote asset of the instrument, e.g. dollars for 'BTC-USD'.
+
+    :fields
+    - symbol
+    - trades: Number of fills of the profile.
+    - position: Base asset held from the trades, negative if more was sold than bought.
+    - average_entry_price: Average cost of the position, null if the position is closed.
+    - mark_price: Last price of the market, the position is valued at it.
+    - realized_pnl: P&L of the closed quantity.
+    - unrealized_pnl: P&L of the position at the mark price.
+    - total_pnl
+    - volume: Base asset executed.
+    - amount: Quote asset executed.
+    - days: Daily volume and equity curve, oldest first.
+    """
+
+    symbol = serializers.CharField(read_only=True)
+    trades = serializers.IntegerField(read_only=True)
+    position = FixedPointField(scale=SATOSHI, read_only=True)
+    average_entry_price = PriceField(read_only=True)
+    mark_price = PriceField(read_only=True)
+    realized_pnl = PriceField(read_only=True)
+    unrealized_pnl = PriceField(read_only=True)
+    total_pnl = PriceField(read_only=True)
+    volume = FixedPointField(scale=SATOSHI, source='quantity', read_only=True)
+    amount = PriceField(read_only=True)
+    days = PortfolioDaySerializer(many=True, read_only=True)
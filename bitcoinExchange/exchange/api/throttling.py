@@ -0,0 +1,31 @@
+from exchange.utils.admission import take_request
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+
+class ExchangeBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The exchange is busy, retry later.'
+    default_code = 'exchange_busy'
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket of each user and endpoint, shared by every worker of the host.
+    The rate of a view is set by its 'throttle_scope' in 'EXCHANGE_THROTTLE_RATES', each action of a
+    ViewSet has its own bucket.
+
+    * Only used if 'EXCHANGE_ADMISSION_CONTROL' is enabled.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is None or not request.user.is_authenticated:
+            return True
+        endpoint = '{}.{}'.format(view.__class__.__name__, getattr(view, 'action', None) or request.method.lower())
+        self.wait_time = take_request(request.user.pk, scope, endpoint)
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
@@ -1,5 +1,8 @@
 from django.urls import include, path
-from exchange.api.views import LatestOrdersListAPIView, OrderViewSet, ProfileAPIView
+from exchange.api.views import (
+    CandleListAPIView, LatestOrdersListAPIView, LeaderboardsAPIView, MarketStatisticsAPIView, OrderBookDepthAPIView,
+    OrderViewSet, PortfolioAnalyticsAPIView, ProfileAPIView
+)
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -8,5 +11,10 @@ router.register(r'orders', OrderViewSet, basename='orders')
 urlpatterns = [
     path('profile/', ProfileAPIView.as_view(), name='profile-detail'),
     path('orders/latest/', LatestOrdersListAPIView.as_view(), name='orders-latest'),
+    path('orders/depth/', OrderBookDepthAPIView.as_view(), name='orders-depth'),
+    path('candles/', CandleListAPIView.as_view(), name='candles-list'),
+    path('statistics/', MarketStatisticsAPIView.as_view(), name='market-statistics'),
+    path('analytics/', PortfolioAnalyticsAPIView.as_view(), name='portfolio-analytics'),
+    path('leaderboards/', LeaderboardsAPIView.as_view(), name='leaderboards'),
     path('', include(router.urls))
 ]
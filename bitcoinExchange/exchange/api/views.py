@@ -1,11 +1,38 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from exchange.api.pagination import OrderCursorPagination
 from exchange.api.permissions import IsActiveOrder, IsOwnerProfile
-from exchange.api.serializers import LatestOrdersSerializer, OrderSerializer, ProfileSerializer
-from exchange.models import Order, Profile
+from exchange.api.serializers import (
+    CandleSerializer, LatestOrdersSerializer, MarketStatisticsSerializer, OrderCancelSerializer, OrderSerializer,
+    PortfolioAnalyticsSerializer, ProfileSerializer
+)
+from exchange.api.throttling import ExchangeBusy
+from exchange.models import Candle, Order, Profile
+from exchange.utils.admission import AdmissionRejected, OpenOrdersLimit, admission, open_orders
+from exchange.utils.aggregations import get_book_orders, market_statistics
+from exchange.utils.analytics import portfolio_analytics
+from exchange.utils.batch import cancel_orders, create_orders
+from exchange.utils.depth import get_book_version, get_depth
+from exchange.utils.export import DATASETS, FORMATS, export_history
+from exchange.utils.instruments import DEFAULT_SYMBOL, SYMBOLS
+from exchange.utils.leaderboards import get_leaderboards
+from exchange.utils.ledger import InsufficientBalance
+from exchange.utils.profile_stats import get_cache_key
+from exchange.utils.sequencer import CANCEL_ORDER, get_symbol_queue
+from exchange.utils.trade import StaleOrder, cancel_order
 from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 
@@ -18,10 +45,13 @@ class OrderViewSet(mixins.CreateModelMixin,
     Order ViewSet.
 
     :actions
-    - list
+    - list: Cursor paginated, newest orders first.
     - create
     - retrieve
     - delete
+    - batch: Create several orders at once, none is created if the balance is not enough for all of them.
+    - cancel: Cancel the active orders, optionally filtered by symbol, type and price range.
+    - export: Stream the whole order or fill history as CSV or NDJSON, '?dataset=orders|fills&output=csv|ndjson'.
 
     * Each action can only be performed by authenticated users.
     * Users can only access their own data.
@@ -29,6 +59,8 @@ class OrderViewSet(mixins.CreateModelMixin,
 
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated, IsOwnerProfile, IsActiveOrder]
+    pagination_class = OrderCursorPagination
+    throttle_scope = 'orders'
 
     def get_queryset(self):
         """
@@ -37,15 +69,103 @@ class OrderViewSet(mixins.CreateModelMixin,
         - A specific user's order instance.
         """
 
-        queryset = Order.objects.filter(profile=self.request.user.profile)
+        # The username and the execution datetime of each order are joined by the same query
+        queryset = Order.objects.filter(profile=self.request.user.profile).select_related(
+            'profile__user', 'transaction'
+        )
         kwarg_pk = self.kwargs.get('pk', None)
         if kwarg_pk is not None:
             queryset = queryset.filter(pk=kwarg_pk)
         return queryset
 
     def perform_create(self, serializer):
+        # The amount needed to fulfill the order is frozen only if it is available
         user_profile = self.request.user.profile
-        serializer.save(profile=user_profile)
+        try:
+            with open_orders(user_profile), admission():
+                serializer.save(profile=user_profile)
+        except (InsufficientBalance, OpenOrdersLimit) as error:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [str(error)]})
+        except AdmissionRejected as error:
+            raise ExchangeBusy(str(error))
+
+    def destroy(self, request, *args, **kwargs):
+        if settings.EXCHANGE_MATCHING_ENGINE:
+            # The order is canceled by the matching engine, in sequence with the new orders
+            instance = self.get_object()
+            get_symbol_queue(instance.symbol).put(CANCEL_ORDER, instance.pk)
+            return Response(status=status.HTTP_202_ACCEPTED)
+        return super().destroy(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        try:
+            cancel_order(instance)
+        except (InsufficientBalance, StaleOrder) as error:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [str(error)]})
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if len(serializer.validated_data) > settings.EXCHANGE_MAX_BATCH_SIZE:
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'a batch can not have more than {} orders'.format(settings.EXCHANGE_MAX_BATCH_SIZE)
+                ]
+            })
+
+        # The amount needed to fulfill all the orders is frozen with one wallet update
+        try:
+            with open_orders(request.user.profile, len(serializer.validated_data)), admission():
+                orders = create_orders(request.user.profile, serializer.validated_data)
+        except (InsufficientBalance, OpenOrdersLimit) as error:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [str(error)]})
+        except AdmissionRejected as error:
+            raise ExchangeBusy(str(error))
+        return Response(self.get_serializer(orders, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def cancel(self, request):
+        serializer = OrderCancelSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        filters = serializer.validated_data
+
+        queryset = Order.objects.filter(profile=request.user.profile, status=True)
+        if 'symbol' in filters:
+            queryset = queryset.filter(symbol=filters['symbol'])
+        if 'type' in filters:
+            queryset = queryset.filter(type=filters['type'])
+        if 'min_price' in filters:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if 'max_price' in filters:
+            queryset = queryset.filter(price__lte=filters['max_price'])
+
+        try:
+            count = cancel_orders(request.user.profile, queryset)
+        except InsufficientBalance as error:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [str(error)]})
+        if settings.EXCHANGE_MATCHING_ENGINE:
+            # The orders are canceled by the matching engine, in sequence with the new orders
+            return Response({'count': count}, status=status.HTTP_202_ACCEPTED)
+        return Response({'count': count}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # 'format' is reserved by the content negotiation of REST framework
+        dataset = request.query_params.get('dataset', 'orders')
+        output = request.query_params.get('output', 'csv')
+        if dataset not in DATASETS:
+            raise ValidationError({'dataset': [f"One of {', '.join(DATASETS)} is required."]})
+        if output not in FORMATS:
+            raise ValidationError({'output': [f"One of {', '.join(FORMATS)} is required."]})
+
+        # Rows are read from the database while the response is sent
+        response = StreamingHttpResponse(
+            export_history(request.user.profile.pk, dataset, output),
+            content_type='text/csv' if output == 'csv' else 'application/x-ndjson'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{output}"'
+        return response
 
 
 class LatestOrdersListAPIView(ListAPIView):
@@ -61,9 +181,10 @@ class LatestOrdersListAPIView(ListAPIView):
 
     serializer_class = LatestOrdersSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
 
     def get_queryset(self):
-        queryset = Order.objects.filter(status=True).exclude(profile=self.request.user.profile)
+        queryset = get_book_orders().exclude(profile=self.request.user.profile)
         return queryset
 
 
@@ -80,8 +201,162 @@ class ProfileAPIView(APIView):
 
     serializer_class = ProfileSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
+
+    def get(self, request):
+        # Statistics are cached until the wallet or the orders of the profile change
+        cache_key = get_cache_key(request.user.profile.pk)
+        data = cache.get(cache_key)
+        if data is None:
+            profiles = Profile.objects.select_related('user', 'wallet').prefetch_related('balances')
+            profile = get_object_or_404(profiles, user=request.user)
+            data = self.serializer_class(profile).data
+            cache.set(cache_key, data, settings.EXCHANGE_PROFILE_CACHE_TIMEOUT)
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
+class OrderBookDepthAPIView(APIView):
+    """
+    Order book depth APIView.
+    Retrieve the remaining quantity of the active orders aggregated by price level.
+    The response is served from a snapshot rebuilt only when the book changes, clients sending
+    its ETag in the 'If-None-Match' header get a 304 response until then.
+
+    :actions
+    - retrieve
+
+    :params
+    - levels: Number of price levels returned for each side, all by default.
+
+    * Only authenticated users can perform any action.
+    """
+
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
+
+    def get(self, request):
+        levels = request.query_params.get('levels')
+        if levels is not None and (not levels.isdigit() or int(levels) < 1):
+            raise ValidationError({'levels': ['A positive integer is required.']})
+
+        version = get_book_version()
+        etag = f'"{version}-{levels or "all"}"'
+        # Whole entity tags are compared, weakly as If-None-Match requires
+        tags = parse_etags(request.headers.get('If-None-Match', ''))
+        tags = {tag[2:] if tag.startswith('W/') else tag for tag in tags}
+        if etag in tags or '*' in tags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        depth = get_depth(version)
+        if levels is not None:
+            depth = {side: depth[side][:int(levels)] for side in ('bids', 'asks')}
+        return Response(data=depth, status=status.HTTP_200_OK, headers={'ETag': etag})
+
+
+class CandleListAPIView(ListAPIView):
+    """
+    Candle ListAPIView.
+    Retrieve the precomputed OHLCV candles of an interval, oldest first.
+
+    :actions
+    - list
+
+    :params
+    - interval: 1m/5m/1h/1d, required.
+    - start: ISO 8601 datetime, candles opened from this datetime.
+    - end: ISO 8601 datetime, candles opened before this datetime.
+    - limit: Number of candles returned at most, 500 by default.
+
+    * Only authenticated users can perform any action.
+    """
+
+    serializer_class = CandleSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
+    max_limit = 1000
+
+    def get_queryset(self):
+        params = self.request.query_params
+        intervals = [name for name, seconds in Candle.INTERVALS]
+        if params.get('interval') not in intervals:
+            raise ValidationError({'interval': [f"One of {', '.join(intervals)} is required."]})
+
+        queryset = Candle.objects.filter(interval=params['interval'])
+        for param, lookup in (('start', 'opened_at__gte'), ('end', 'opened_at__lt')):
+            if param in params:
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: ['A valid ISO 8601 datetime is required.']})
+                queryset = queryset.filter(**{lookup: value})
+
+        limit = params.get('limit', '500')
+        if not limit.isdigit() or not 0 < int(limit) <= self.max_limit:
+            raise ValidationError({'limit': [f'An integer between 1 and {self.max_limit} is required.']})
+        return queryset.order_by('opened_at')[:int(limit)]
+
+
+class MarketStatisticsAPIView(APIView):
+    """
+    Market statistics APIView.
+    Retrieve the volume of the last 24 hours, the last price and the spread of the book,
+    computed by one aggregation pipeline.
+
+    :actions
+    - retrieve
+
+    * Only authenticated users can perform any action.
+    """
+
+    serializer_class = MarketStatisticsSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
+
+    def get(self, request):
+        statistics = market_statistics(since=timezone.now() - timedelta(days=1))
+        return Response(data=self.serializer_class(statistics).data, status=status.HTTP_200_OK)
+
+
+class PortfolioAnalyticsAPIView(APIView):
+    """
+    Portfolio analytics APIView.
+    Retrieve the P&L, the average entry price, the equity curve and the daily volume of the user on
+    an instrument, computed from the whole fill history loaded in one query.
+
+    :actions
+    - retrieve
+
+    :params
+    - symbol: BTC-USD (default)/ETH-USD/ETH-BTC.
+
+    * Only authenticated users can perform any action.
+    """
+
+    serializer_class = PortfolioAnalyticsSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
+
+    def get(self, request):
+        symbol = request.query_params.get('symbol', DEFAULT_SYMBOL)
+        if symbol not in SYMBOLS:
+            raise ValidationError({'symbol': [f"One of {', '.join(SYMBOLS)} is required."]})
+        portfolio = portfolio_analytics(request.user.profile.pk, symbol)
+        return Response(data=self.serializer_class(portfolio).data, status=status.HTTP_200_OK)
+
+
+class LeaderboardsAPIView(APIView):
+    """
+    Leaderboards APIView.
+    Retrieve the rankings of the users by bitcoin profit and by dollar volume, and the exchange
+    statistics, precomputed by the 'compute_leaderboards' command and read with one lookup.
+
+    :actions
+    - retrieve
+
+    * Only authenticated users can perform any action.
+    """
+
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'reads'
 
     def get(self, request):
-        profile = get_object_or_404(Profile, user=request.user)
-        serializer = self.serializer_class(profile)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return Response(data=get_leaderboards(), status=status.HTTP_200_OK)
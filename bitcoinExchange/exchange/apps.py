@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ExchangeConfig(AppConfig):
@@ -6,3 +7,8 @@ class ExchangeConfig(AppConfig):
 
     def ready(self):
         import exchange.signals
+        from exchange.utils.instrumentation import register_command_listener
+
+        if settings.EXCHANGE_INSTRUMENTATION:
+            # Count the operations sent directly to MongoDB, must be registered before the client is created
+            register_command_listener()
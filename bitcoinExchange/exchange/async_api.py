@@ -0,0 +1,149 @@
+import json
+import math
+from urllib.parse import parse_qsl
+from asgiref.sync import sync_to_async
+from exchange.api.serializers import LatestOrdersSerializer, OrderSerializer, ProfileSerializer
+from exchange.models import Profile
+from exchange.utils.admission import AdmissionRejected, OpenOrdersLimit, admission, open_orders, take_request
+from exchange.utils.async_data import get_latest_orders, get_profile, get_user_id
+from exchange.utils.ledger import InsufficientBalance
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+ASYNC_API_PREFIX = '/api/async/'
+
+
+async def send_response(send, status_code, data=None, headers=()):
+    body = JSONRenderer().render(data) if data is not None else b''
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive):
+    """
+    Return the body of the request, None if the client disconnected.
+    """
+
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def get_token_key(scope):
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin1').partition(' ')
+            return key.strip() if keyword == 'Token' else None
+    return None
+
+
+def parse_body(scope, body):
+    content_type = dict(scope['headers']).get(b'content-type', b'').decode('latin1')
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        return dict(parse_qsl(body.decode()))
+    return json.loads(body or b'{}')
+
+
+@sync_to_async
+def create_order(user_id, data):
+    # Orders are validated, limited and saved by the same code of OrderViewSet, matching included
+    wait = take_request(user_id, 'orders', 'async.create')
+    if wait:
+        return status.HTTP_429_TOO_MANY_REQUESTS, {
+            'detail': 'Request was throttled. Expected available in {} seconds.'.format(math.ceil(wait))
+        }
+    serializer = OrderSerializer(data=data)
+    if not serializer.is_valid():
+        return status.HTTP_400_BAD_REQUEST, serializer.errors
+    profile = Profile.objects.select_related('user').filter(user_id=user_id).first()
+    if profile is None:
+        return status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'}
+    try:
+        with open_orders(profile), admission():
+            serializer.save(profile=profile)
+    except (InsufficientBalance, OpenOrdersLimit) as error:
+        return status.HTTP_400_BAD_REQUEST, {api_settings.NON_FIELD_ERRORS_KEY: [str(error)]}
+    except AdmissionRejected as error:
+        return status.HTTP_503_SERVICE_UNAVAILABLE, {'detail': str(error)}
+    return status.HTTP_201_CREATED, serializer.data
+
+
+async def place_order(scope, receive, user_id):
+    body = await read_body(receive)
+    if body is None:
+        return None, None
+    try:
+        data = parse_body(scope, body)
+    except ValueError:
+        return status.HTTP_400_BAD_REQUEST, {'detail': 'JSON parse error.'}
+    return await create_order(user_id, data)
+
+
+async def retrieve_latest_orders(scope, receive, user_id):
+    orders = await get_latest_orders(user_id)
+    if orders is None:
+        return status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'}
+    return status.HTTP_200_OK, LatestOrdersSerializer(orders, many=True).data
+
+
+async def retrieve_profile(scope, receive, user_id):
+    profile = await get_profile(user_id)
+    if profile is None:
+        return status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'}
+    return status.HTTP_200_OK, ProfileSerializer(profile).data
+
+
+# Path under ASYNC_API_PREFIX -> {method: handler}
+ROUTES = {
+    'orders/': {'POST': place_order},
+    'orders/latest/': {'GET': retrieve_latest_orders},
+    'profile/': {'GET': retrieve_profile},
+}
+
+
+async def async_api_application(scope, receive, send):
+    """
+    HTTP ASGI application of the async API, served under ASYNC_API_PREFIX.
+    The requests are handled on the event loop with the Motor data layer, the independent reads of a
+    request are concurrent. Without Motor or MongoDB the reads run on the ORM in worker threads.
+
+    :actions
+    - orders/: Create an order, same fields and response of '/api/orders/'.
+    - orders/latest/: Same response of '/api/orders/latest/'.
+    - profile/: Same response of '/api/profile/'.
+
+    * Each action can only be performed by users authenticated by the 'Authorization: Token TOKEN' header.
+    """
+
+    routes = ROUTES.get(scope['path'][len(ASYNC_API_PREFIX):])
+    if routes is None:
+        await send_response(send, status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'})
+        return
+    handler = routes.get(scope['method'])
+    if handler is None:
+        await send_response(send, status.HTTP_405_METHOD_NOT_ALLOWED,
+                            {'detail': 'Method "{}" not allowed.'.format(scope['method'])},
+                            [(b'allow', ', '.join(routes).encode())])
+        return
+
+    token_key = get_token_key(scope)
+    user_id = await get_user_id(token_key) if token_key else None
+    if user_id is None:
+        await send_response(send, status.HTTP_401_UNAUTHORIZED,
+                            {'detail': 'Authentication credentials were not provided.'},
+                            [(b'www-authenticate', b'Token')])
+        return
+
+    status_code, data = await handler(scope, receive, user_id)
+    if status_code is not None:
+        await send_response(send, status_code, data)
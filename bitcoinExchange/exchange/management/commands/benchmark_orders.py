@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.utils import ConnectionHandler
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from exchange.utils.amounts import to_cents, to_satoshi
+from exchange.utils.benchmark import OrderFlow, run_benchmark
+from exchange.utils.instrumentation import register_command_listener
+from exchange.utils.order_book import order_book
+
+SQLITE_DATABASE = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of the order and matching path on synthetic order flow.
+    The benchmark runs in a throwaway test database of the configured backend, or of an in-memory
+    SQLite database with '--sqlite', the existing data is never touched.
+    """
+
+    help = 'Benchmark the order and matching path on synthetic order flow.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Number of orders measured.')
+        parser.add_argument('--mode', choices=['direct', 'api'], default='direct',
+                            help='Create the orders through the ORM or post them to the REST endpoint.')
+        parser.add_argument('--depth', type=int, default=50, help='Price levels on each side of the book.')
+        parser.add_argument('--match-ratio', type=float, default=0.3, help='Fraction of orders crossing the spread.')
+        parser.add_argument('--distribution', choices=['uniform', 'normal'], default='uniform',
+                            help='Distribution of the passive prices across the depth.')
+        parser.add_argument('--mid-price', type=float, default=50000, help='Dollars for one bitcoin.')
+        parser.add_argument('--traders', type=int, default=10, help='Number of traders.')
+        parser.add_argument('--exact', action='store_true',
+                            help='Only match orders with the same quantity (EXCHANGE_PARTIAL_FILLS = False).')
+        parser.add_argument('--seed', type=int, default=None, help='Seed of the order flow.')
+        parser.add_argument('--sqlite', action='store_true',
+                            help='Run on an in-memory SQLite database instead of the configured backend.')
+
+    def handle(self, *args, **options):
+        flow = OrderFlow(
+            mid_price=to_cents(options['mid_price']),
+            depth=options['depth'],
+            match_ratio=options['match_ratio'],
+            distribution=options['distribution'],
+            seed=options['seed']
+        )
+        if options['exact']:
+            # Same quantity for every order, otherwise almost nothing is matched
+            flow.min_quantity = flow.max_quantity = to_satoshi(0.1)
+
+        configured_connection = connections[DEFAULT_DB_ALIAS]
+        if options['sqlite']:
+            connections[DEFAULT_DB_ALIAS] = ConnectionHandler({DEFAULT_DB_ALIAS: SQLITE_DATABASE})[DEFAULT_DB_ALIAS]
+        else:
+            # Count the pymongo operations too, the client created before the registration would not notify it
+            register_command_listener()
+            connection.close()
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        order_book.reset()
+        try:
+            with override_settings(EXCHANGE_PARTIAL_FILLS=not options['exact'], EXCHANGE_MATCHING_ENGINE=False):
+                stats = run_benchmark(flow, options['orders'], options['mode'], options['traders'])
+        finally:
+            order_book.reset()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            vendor = connection.vendor
+            connections[DEFAULT_DB_ALIAS] = configured_connection
+
+        self.stdout.write(f"Backend: {vendor}, mode: {options['mode']}")
+        self.stdout.write(f"Orders: {stats['orders']} in {stats['seconds']:.2f}s ({stats['orders_per_second']:.1f} orders/s)")
+        self.stdout.write(f"Latency: p50 {stats['p50_ms']:.2f}ms, p99 {stats['p99_ms']:.2f}ms")
+        self.stdout.write(f"Queries per order: {stats['queries_per_order']:.1f}")
+        self.stdout.write(f"Executed orders: {stats['executed_orders']}")
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from exchange.utils.provisioning import bulk_create_users
+
+
+class Command(BaseCommand):
+    """
+    Create many users with their profiles and wallets, e.g. to seed load tests or migrations.
+    Usernames are the given prefix followed by a sequential number.
+    """
+
+    help = 'Create many users with their profiles and wallets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Number of users to create.')
+        parser.add_argument('--prefix', default='user', help='Prefix of the usernames.')
+        parser.add_argument('--start', type=int, default=1, help='Number of the first username.')
+        parser.add_argument('--password', default='Change_me_123!', help='Password of every user.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users created at once.')
+
+    def handle(self, *args, **options):
+        start = options['start']
+        usernames = [f"{options['prefix']}{number}" for number in range(start, start + options['count'])]
+        if User.objects.filter(username__in=usernames).exists():
+            raise CommandError('Some of the usernames already exist, choose another --prefix or --start.')
+
+        count = bulk_create_users(usernames, options['password'], options['batch_size'])
+        self.stdout.write(f'{count} users created.')
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from exchange.utils.leaderboards import compute_leaderboards
+
+
+class Command(BaseCommand):
+    """
+    Add the new fills to the running totals of the traders and rewrite the leaderboards and the
+    exchange statistics served by '/api/leaderboards/'.
+    """
+
+    help = 'Recompute the leaderboards and the exchange statistics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Recompute every given seconds instead of once.')
+
+    def handle(self, *args, **options):
+        while True:
+            count = compute_leaderboards()
+            self.stdout.write(f'Leaderboards computed: {count} new fills.')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from exchange.models import Fill, Order, Wallet
+from exchange.utils.amounts import CENT, SATOSHI
+from exchange.utils.bulk import get_collection
+
+# Fields stored as decimal amounts before the fixed-point representation
+FIXED_POINT_FIELDS = (
+    (Wallet, 'bitcoin_net_balance', SATOSHI),
+    (Wallet, 'available_dollar', CENT),
+    (Wallet, 'frozen_dollar', CENT),
+    (Wallet, 'available_bitcoin', SATOSHI),
+    (Wallet, 'frozen_bitcoin', SATOSHI),
+    (Order, 'price', CENT),
+    (Order, 'quantity', SATOSHI),
+    (Order, 'filled_quantity', SATOSHI),
+    (Fill, 'price', CENT),
+    (Fill, 'quantity', SATOSHI),
+)
+
+
+class Command(BaseCommand):
+    """
+    Convert the decimal amounts stored in MongoDB to integer satoshis and cents.
+    Only the values still stored as doubles are converted, so the command can be run again safely.
+    """
+
+    help = 'Convert the stored bitcoin and dollar amounts to satoshis and cents.'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'djongo':
+            raise CommandError('The conversion is only needed for the MongoDB database.')
+
+        for model, name, scale in FIXED_POINT_FIELDS:
+            result = get_collection(model).update_many(
+                {name: {'$type': 'double'}},
+                [{'$set': {name: {'$toLong': {'$round': [{'$multiply': [f'${name}', scale]}, 0]}}}}]
+            )
+            self.stdout.write(f'{model._meta.db_table}.{name}: {result.modified_count} converted.')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from exchange.models import Balance, Profile
+from exchange.utils.provisioning import new_balances
+
+
+class Command(BaseCommand):
+    """
+    Create the missing 'Balance' rows of every profile.
+    Needed once for the profiles created before the instrument was listed, trades only increment existing rows.
+    """
+
+    help = 'Create the missing asset balances of every profile.'
+
+    def handle(self, *args, **options):
+        existing = set(Balance.objects.values_list('profile_id', 'asset'))
+        balances = [
+            balance for balance in new_balances(Profile.objects.values_list('pk', flat=True))
+            if (balance.profile_id, balance.asset) not in existing
+        ]
+        Balance.objects.bulk_create(balances, batch_size=1000)
+        self.stdout.write(f'{len(balances)} asset balances created.')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from exchange.models import Profile
+from exchange.utils.export import DATASETS, FORMATS, export_history
+
+
+class Command(BaseCommand):
+    """
+    Write the order or fill history of a user as CSV or NDJSON, to a file or to the standard output.
+    Rows are streamed from the database, so the memory used does not depend on the size of the history.
+    """
+
+    help = 'Export the order or fill history of a user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User whose history is exported.')
+        parser.add_argument('--dataset', choices=DATASETS, default='orders', help='Orders or fills.')
+        parser.add_argument('--output', choices=FORMATS, default='csv', help='Format of the export.')
+        parser.add_argument('--file', default=None, help='Path of the file written, the standard output by default.')
+
+    def handle(self, *args, **options):
+        profile_id = Profile.objects.filter(user__username=options['username']).values_list('pk', flat=True).first()
+        if profile_id is None:
+            raise CommandError(f"User {options['username']} does not exist.")
+
+        chunks = export_history(profile_id, options['dataset'], options['output'])
+        if options['file'] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['file'], 'w', newline='') as export_file:
+            for chunk in chunks:
+                export_file.write(chunk)
+        self.stderr.write(f"History of {options['username']} written to {options['file']}.")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from exchange.models import Profile
+from exchange.utils.aggregations import order_counts
+from exchange.utils.bulk import bulk_update
+from exchange.utils.profile_stats import invalidate_profiles
+
+
+class Command(BaseCommand):
+    """
+    Recount the active and executed orders of every profile.
+    Needed once for the profiles created before the counters existed.
+    The counters are written in one batched operation.
+    """
+
+    help = 'Recount the active and executed orders of every profile.'
+
+    def handle(self, *args, **options):
+        counts = order_counts()
+        profile_ids = list(Profile.objects.values_list('pk', flat=True))
+        profiles = [
+            Profile(pk=profile_id, **counts.get(profile_id, {'active_orders': 0, 'executed_orders': 0}))
+            for profile_id in profile_ids
+        ]
+        bulk_update(Profile, profiles, ['active_orders', 'executed_orders'])
+        invalidate_profiles(profile_ids)
+        self.stdout.write(f'{len(profile_ids)} profile counters rebuilt.')
@@ -0,0 +1,64 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from exchange.utils.event_log import BALANCE_FIELDS, WALLET_FIELDS, ExchangeState, load_state
+from exchange.utils.instruments import ASSETS, SYMBOLS
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the active orders, the wallet and the asset balances from the latest snapshot and the tail
+    of the event log, optionally comparing them with the database.
+    """
+
+    help = 'Rebuild the exchange state from the event log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Compare the rebuilt state with the database.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        state, count = load_state(settings.EXCHANGE_EVENT_LOG_PATH, settings.EXCHANGE_SNAPSHOT_DIR)
+        seconds = time.perf_counter() - start
+        self.stdout.write(
+            f'{count} events replayed in {seconds:.2f}s: {state.order_count()} active orders, '
+            f'{len(state.wallets)} wallets, log offset {state.offset}.'
+        )
+
+        if options['verify']:
+            differences = self.compare(state, ExchangeState.from_database(state.offset))
+            for difference in differences:
+                self.stdout.write(difference)
+            if differences:
+                raise CommandError(f'{len(differences)} differences with the database.')
+            self.stdout.write('The rebuilt state matches the database.')
+
+    def compare(self, state, database_state):
+        differences = []
+        for symbol in SYMBOLS:
+            orders, database_orders = state.orders[symbol], database_state.orders[symbol]
+            for order_id in orders.keys() ^ database_orders.keys():
+                where = 'log' if order_id in orders else 'database'
+                differences.append(f'Order {order_id} is active only in the {where} {symbol} book.')
+            for order_id in orders.keys() & database_orders.keys():
+                if orders[order_id] != database_orders[order_id]:
+                    differences.append(f'Order {order_id}: {orders[order_id]} != {database_orders[order_id]}')
+
+        empty = [0] * len(WALLET_FIELDS)
+        for profile_id in state.wallets.keys() | database_state.wallets.keys():
+            balances = state.wallets.get(profile_id, empty)
+            database_balances = database_state.wallets.get(profile_id, empty)
+            for name, balance, database_balance in zip(WALLET_FIELDS, balances, database_balances):
+                if balance != database_balance:
+                    differences.append(f'Wallet {profile_id} {name}: {balance} != {database_balance}')
+
+        empty = [0] * len(BALANCE_FIELDS)
+        for profile_id, asset_index in state.balances.keys() | database_state.balances.keys():
+            balances = state.balances.get((profile_id, asset_index), empty)
+            database_balances = database_state.balances.get((profile_id, asset_index), empty)
+            for name, balance, database_balance in zip(BALANCE_FIELDS, balances, database_balances):
+                if balance != database_balance:
+                    differences.append(
+                        f'Balance {profile_id} {ASSETS[asset_index]} {name}: {balance} != {database_balance}'
+                    )
+        return differences
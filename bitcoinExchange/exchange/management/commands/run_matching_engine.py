@@ -0,0 +1,50 @@
+import time
+import traceback
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from exchange.utils.order_book import get_order_book
+from exchange.utils.sequencer import get_order_queue, get_shard_symbols, process_event
+
+
+class Command(BaseCommand):
+    """
+    Matching engine process.
+    Consume the queued order events in strict sequence, keep the order books in memory and
+    publish the fills back in the queue.
+    The books are sharded by symbol across 'EXCHANGE_MATCHING_SHARDS' processes, each one started
+    with its own '--shard'. Only one matching engine must run for each shard.
+    An event that fails is reported and acknowledged, so it never blocks the events after it.
+    """
+
+    help = 'Run the matching engine on the queued orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', type=int, default=0, help='Shard of the symbols matched by this process.')
+        parser.add_argument('--poll-interval', type=float, default=0.05, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Events read from the queue at once.')
+        parser.add_argument('--once', action='store_true', help='Process the pending events and exit.')
+
+    def handle(self, *args, **options):
+        shard = options['shard']
+        if not 0 <= shard < settings.EXCHANGE_MATCHING_SHARDS:
+            raise CommandError(f'The shard must be between 0 and {settings.EXCHANGE_MATCHING_SHARDS - 1}.')
+
+        queue = get_order_queue(shard)
+        for symbol in get_shard_symbols(shard):
+            book = get_order_book(symbol)
+            self.stdout.write(f'{symbol} order book loaded: {len(book.bids)} bids, {len(book.asks)} asks.')
+
+        while True:
+            events = queue.pending(options['batch_size'])
+            for seq, kind, order_id in events:
+                try:
+                    fills = process_event(kind, order_id)
+                except Exception:
+                    self.stderr.write(f'Event {seq} ({kind} order {order_id}) failed:\n{traceback.format_exc()}')
+                    fills = []
+                queue.ack(seq, fills)
+
+            if not events:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,42 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from exchange.utils.event_log import ExchangeState, get_event_log, load_state, remove_old_snapshots
+
+
+class Command(BaseCommand):
+    """
+    Compact the event log into a snapshot of the active orders and the wallet balances.
+    The new snapshot is the latest snapshot with the tail of the log applied, so replaying
+    the log starts from its offset.
+    """
+
+    help = 'Write a snapshot of the event log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Write a snapshot every given seconds instead of once.')
+        parser.add_argument('--keep', type=int, default=3, help='Number of snapshots kept.')
+        parser.add_argument('--from-database', action='store_true',
+                            help='Take the first snapshot from the database, while the log is not written.')
+
+    def handle(self, *args, **options):
+        log_path = settings.EXCHANGE_EVENT_LOG_PATH
+        directory = settings.EXCHANGE_SNAPSHOT_DIR
+
+        if options['from_database']:
+            state = ExchangeState.from_database(get_event_log().size())
+            path = state.save(directory)
+            self.stdout.write(f'Snapshot {path} taken from the database.')
+            return
+
+        while True:
+            state, count = load_state(log_path, directory)
+            if count:
+                path = state.save(directory)
+                self.stdout.write(f'Snapshot {path}: {count} events compacted.')
+                remove_old_snapshots(directory, options['keep'])
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
@@ -0,0 +1,37 @@
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from exchange.utils.instrumentation import get_server_timing, query_wrapper, registry, start_request, stop_request
+
+
+class InstrumentationMiddleware:
+    """
+    Measure the database round-trips, the database time, the signal handlers time and the
+    matching time of each request.
+    The timings are sent in the Server-Timing header and recorded in per-view histograms
+    exposed by the metrics endpoint.
+
+    * Only used if 'EXCHANGE_INSTRUMENTATION' is enabled.
+    """
+
+    def __init__(self, get_response):
+        if not settings.EXCHANGE_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = start_request()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(query_wrapper):
+                response = self.get_response(request)
+        finally:
+            stop_request()
+        duration = time.perf_counter() - start
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = resolver_match.view_name if resolver_match else 'unresolved'
+        registry.observe(view_name, request.method, duration, metrics)
+        response['Server-Timing'] = get_server_timing(duration, metrics)
+        return response
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import User
 from djongo import models
+from exchange.utils.amounts import from_cents, from_satoshi, to_satoshi
+from exchange.utils.instruments import ASSETS, DEFAULT_SYMBOL, SYMBOLS
 from random import uniform
 
 
@@ -7,9 +9,15 @@ class Profile(models.Model):
     """
     User profile.
     Extension of the default user model.
+
+    :fields
+    - active_orders: Number of active orders, kept up to date by the order signals.
+    - executed_orders: Number of executed orders, kept up to date by the order signals.
     """
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    active_orders = models.IntegerField(default=0)
+    executed_orders = models.IntegerField(default=0)
 
     class Meta:
         verbose_name = 'Profile'
@@ -20,21 +28,31 @@ class Profile(models.Model):
         return self.user.username
 
 
+def get_initial_bitcoin():
+    """
+    Return a random amount of satoshis between 1 and 10 bitcoins, given to every new wallet.
+    """
+
+    return to_satoshi(uniform(1, 10))
+
+
 class Wallet(models.Model):
     """
     Wallet associated with user instance.
     Each user has only one wallet.
 
     :fields
-    - bitcoin_net_balance: Bitcoin net balance in order to calculate profits.
+    - bitcoin_net_balance: Bitcoin net balance in order to calculate profits, the initial bitcoin amount.
+    - *_dollar: Cents.
+    - *_bitcoin: Satoshis.
     """
 
     profile = models.OneToOneField(Profile, on_delete=models.CASCADE)
-    bitcoin_net_balance = models.FloatField()
-    available_dollar = models.FloatField(default=0)
-    frozen_dollar = models.FloatField(default=0)
-    available_bitcoin = models.FloatField(default=uniform(1, 10))
-    frozen_bitcoin = models.FloatField(default=0)
+    bitcoin_net_balance = models.BigIntegerField()
+    available_dollar = models.BigIntegerField(default=0)
+    frozen_dollar = models.BigIntegerField(default=0)
+    available_bitcoin = models.BigIntegerField(default=get_initial_bitcoin)
+    frozen_bitcoin = models.BigIntegerField(default=0)
 
     class Meta:
         verbose_name = 'Wallet'
@@ -45,6 +63,31 @@ class Wallet(models.Model):
         return str(self.profile)
 
 
+class Balance(models.Model):
+    """
+    Balance of an asset that is not a column of the wallet, e.g. ETH.
+    Each profile has one balance for each of these assets, created with the wallet.
+
+    :fields
+    - asset: e.g. 'ETH'.
+    - available/frozen: Integer units of the asset, see 'exchange.utils.instruments.ASSET_SCALES'.
+    """
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='balances')
+    asset = models.CharField(max_length=8, choices=[(asset, asset) for asset in ASSETS])
+    available = models.BigIntegerField(default=0)
+    frozen = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Balance'
+        verbose_name_plural = 'Balances'
+        ordering = ['profile', 'asset']
+        unique_together = [['profile', 'asset']]
+
+    def __str__(self):
+        return f'{self.profile} {self.asset}'
+
+
 class Transaction(models.Model):
     """
     Transaction between 2 users.
@@ -70,8 +113,16 @@ class Order(models.Model):
     Each user can create multiple buy/sell orders.
 
     :fields
+    - symbol: Instrument traded, e.g. 'BTC-USD'.
+    - price: Quote asset units for one base asset, e.g. cents for one bitcoin.
+    - quantity: Base asset units, e.g. satoshis.
     - type: Buy/Sell.
+    - kind: Limit/Market/Stop/Stop-limit, stop orders become market/limit orders once triggered.
+    - time_in_force: GTC=rests in the book, IOC=the rest is canceled, FOK=filled entirely or canceled.
+    - stop_price: Cents, a trade print at or beyond this price triggers a stop order.
     - status: False=executed, True=active.
+    - filled_quantity: Satoshis already executed, the rest of the order stays in the book.
+    - transaction: Transaction that completed the order.
     - created_at: Date format '31/12/2021, 23:59:59'.
     """
 
@@ -81,10 +132,39 @@ class Order(models.Model):
         ('S', 'Sell')
     )
 
+    # Order kinds
+    LIMIT = 'limit'
+    MARKET = 'market'
+    STOP = 'stop'
+    STOP_LIMIT = 'stop_limit'
+    ORDER_KINDS = (
+        (LIMIT, 'Limit'),
+        (MARKET, 'Market'),
+        (STOP, 'Stop'),
+        (STOP_LIMIT, 'Stop-limit')
+    )
+    # Waiting for a trade print, not in the book yet
+    STOP_KINDS = (STOP, STOP_LIMIT)
+
+    # Time in force
+    GOOD_TILL_CANCELED = 'GTC'
+    IMMEDIATE_OR_CANCEL = 'IOC'
+    FILL_OR_KILL = 'FOK'
+    TIME_IN_FORCE = (
+        (GOOD_TILL_CANCELED, 'Good till canceled'),
+        (IMMEDIATE_OR_CANCEL, 'Immediate or cancel'),
+        (FILL_OR_KILL, 'Fill or kill')
+    )
+
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='orders')
-    price = models.FloatField()
-    quantity = models.FloatField()
+    symbol = models.CharField(max_length=16, choices=[(symbol, symbol) for symbol in SYMBOLS], default=DEFAULT_SYMBOL)
+    price = models.BigIntegerField()
+    quantity = models.BigIntegerField()
+    filled_quantity = models.BigIntegerField(default=0)
     type = models.CharField(max_length=20, choices=ORDER_TYPES)
+    kind = models.CharField(max_length=20, choices=ORDER_KINDS, default=LIMIT)
+    time_in_force = models.CharField(max_length=3, choices=TIME_IN_FORCE, default=GOOD_TILL_CANCELED)
+    stop_price = models.BigIntegerField(blank=True, null=True)
     status = models.BooleanField(default=True)
     transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='orders', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -93,6 +173,149 @@ class Order(models.Model):
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
         ordering = ['-created_at']
+        indexes = [
+            # User's orders, see OrderViewSet and OrderCursorPagination
+            models.Index(fields=['profile', 'status', 'created_at'], name='order_profile_status_idx'),
+            # Active orders of each book by price and time priority
+            models.Index(fields=['symbol', 'type', 'status', 'price', 'created_at'], name='order_book_idx'),
+        ]
 
     def __str__(self):
         return self.created_at.strftime("%d/%m/%Y, %H:%M:%S")
+
+    @property
+    def remaining_quantity(self):
+        return self.quantity - self.filled_quantity
+
+
+class Fill(models.Model):
+    """
+    Quantity executed between a buy order and a sell order, i.e. a trade print.
+    A transaction has one fill for each counterparty matched by the incoming order.
+
+    :fields
+    - symbol: Instrument of the orders.
+    - price: Execution price in quote asset units, equal to the price of the resting order.
+    - quantity: Base asset units.
+    - aggressor: Type of the incoming order that triggered the trade, Buy/Sell.
+    - executed_at: Datetime format '31/12/2021, 23:59:59'.
+    """
+
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='fills')
+    buy_order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='buy_fills')
+    sell_order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='sell_fills')
+    symbol = models.CharField(max_length=16, choices=[(symbol, symbol) for symbol in SYMBOLS], default=DEFAULT_SYMBOL)
+    price = models.BigIntegerField()
+    quantity = models.BigIntegerField()
+    aggressor = models.CharField(max_length=20, choices=Order.ORDER_TYPES)
+    executed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Fill'
+        verbose_name_plural = 'Fills'
+        ordering = ['-executed_at', '-pk']
+        indexes = [
+            # Prints of each market, see 'exchange.utils.aggregations.market_statistics()'
+            models.Index(fields=['symbol', 'executed_at'], name='fill_symbol_idx'),
+        ]
+
+    def __str__(self):
+        return f'{from_satoshi(self.quantity)} @ {from_cents(self.price)}'
+
+
+class Candle(models.Model):
+    """
+    OHLCV candle of the trades executed in a time interval.
+    Candles are updated incrementally on each trade, see 'exchange.utils.candles'.
+
+    :fields
+    - id: '<interval>:<opened_at timestamp>', so that a candle can be upserted.
+    - interval: 1m/5m/1h/1d.
+    - opened_at: Start of the interval, UTC.
+    - open/high/low/close: Cents.
+    - volume: Satoshis.
+    - trades: Number of fills.
+    """
+
+    # Candle intervals in seconds
+    INTERVALS = (
+        ('1m', 60),
+        ('5m', 5 * 60),
+        ('1h', 60 * 60),
+        ('1d', 24 * 60 * 60),
+    )
+
+    id = models.CharField(max_length=32, primary_key=True)
+    interval = models.CharField(max_length=3, choices=[(name, name) for name, seconds in INTERVALS])
+    opened_at = models.DateTimeField()
+    open = models.BigIntegerField()
+    high = models.BigIntegerField()
+    low = models.BigIntegerField()
+    close = models.BigIntegerField()
+    volume = models.BigIntegerField(default=0)
+    trades = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Candle'
+        verbose_name_plural = 'Candles'
+        ordering = ['interval', 'opened_at']
+        indexes = [
+            models.Index(fields=['interval', 'opened_at'], name='candle_interval_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.interval} {self.opened_at.strftime('%d/%m/%Y, %H:%M:%S')}"
+
+
+class TraderStatistics(models.Model):
+    """
+    Running totals of the fills of a profile, updated incrementally by 'compute_leaderboards'.
+
+    :fields
+    - trades: Number of fills, on every instrument.
+    - dollar_volume: Cents executed on the instruments quoted in dollars.
+    """
+
+    profile = models.OneToOneField(Profile, on_delete=models.CASCADE, primary_key=True, related_name='statistics')
+    trades = models.BigIntegerField(default=0)
+    dollar_volume = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Trader statistics'
+        verbose_name_plural = 'Trader statistics'
+        indexes = [
+            # Volume leaderboard, see 'exchange.utils.leaderboards.volume_leaderboard()'
+            models.Index(fields=['dollar_volume'], name='trader_volume_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.profile_id}: {self.trades} trades, {from_cents(self.dollar_volume)} $'
+
+
+class Leaderboards(models.Model):
+    """
+    Materialized leaderboards and exchange statistics, a single document read by LeaderboardsAPIView
+    with one lookup and rewritten by 'compute_leaderboards'.
+
+    :fields
+    - id: Always 'leaderboards'.
+    - data: JSON document, already in the format of the API.
+    - fill_cursor: Id of the last fill added to 'TraderStatistics', the next run only reads the newer fills.
+    - trades: Number of fills up to the cursor.
+    - dollar_volume: Cents executed up to the cursor on the instruments quoted in dollars.
+    - computed_at
+    """
+
+    id = models.CharField(max_length=32, primary_key=True)
+    data = models.TextField(default='{}')
+    fill_cursor = models.BigIntegerField(default=0)
+    trades = models.BigIntegerField(default=0)
+    dollar_volume = models.BigIntegerField(default=0)
+    computed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        verbose_name = 'Leaderboards'
+        verbose_name_plural = 'Leaderboards'
+
+    def __str__(self):
+        return f'{self.id} {self.computed_at}'
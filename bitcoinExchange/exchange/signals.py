@@ -1,99 +1,115 @@
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from django.shortcuts import get_object_or_404
-from exchange.models import Order, Profile, Wallet
-from exchange.utils.trade import perform_trade
+from exchange.models import Order, Wallet
+from exchange.utils.depth import touch_book
+from exchange.utils.event_log import order_accepted, record_events
+from exchange.utils.instrumentation import timed
+from exchange.utils.ledger import freeze_order
+from exchange.utils.profile_stats import invalidate_profiles, update_order_counters
+from exchange.utils.provisioning import create_account
+from exchange.utils.sequencer import NEW_ORDER, get_symbol_queue
+from exchange.utils.token_cache import get_token_cache
+from exchange.utils.trade import release_order, submit_order
+from rest_framework.authtoken.models import Token
 
 
 @receiver(post_save, sender=User)
+@timed('signals')
 def create_profile(sender, instance, created, **kwargs):
     """
-    Create a profile instance associated with the new user instance created.
+    Create the profile and the wallet associated with the new user instance created.
+    Users created in bulk are provisioned by 'bulk_create_users()' instead.
     """
 
     if created:
-        Profile.objects.create(user=instance)
+        create_account(instance)
 
 
-@receiver(post_save, sender=Profile)
-def create_wallet(sender, instance, created, **kwargs):
+@receiver(post_save, sender=User)
+@timed('signals')
+def invalidate_user_tokens(sender, instance, created, **kwargs):
     """
-    Create a wallet instance associated with the new profile instance created.
+    Discard the cached authentications of a changed user, e.g. deactivated or with a new password.
     """
 
-    if created:
-        Wallet.objects.create(profile=instance)
+    if not created:
+        get_token_cache().delete_user(instance.pk)
 
 
-@receiver(post_save, sender=Wallet)
-def set_bitcoin_net_balance(sender, instance, created, **kwargs):
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+@timed('signals')
+def invalidate_token(sender, instance, **kwargs):
     """
-    Save the initial bitcoin amount in the net balance in order to calculate profits.
+    Discard the cached authentication of a token deleted on logout or rotated.
     """
 
-    if created:
-        instance.bitcoin_net_balance = instance.available_bitcoin
-        instance.save()
+    get_token_cache().delete(instance.key)
+
+
+@receiver(pre_save, sender=Order)
+@timed('signals')
+def freeze_order_amount(sender, instance, **kwargs):
+    """
+    Freeze the amount needed to fulfill the order before it is created.
+    The order is not created if the available balance is not enough.
+    """
+
+    # Orders created by 'create_orders()' are frozen and matched all together
+    if instance._state.adding and not getattr(instance, '_batched', False):
+        freeze_order(instance)
 
 
 @receiver(post_save, sender=Order)
+@timed('signals')
 def new_order(sender, instance, created, **kwargs):
     """
-    Freeze the amount needed to fulfill the order when it is created.
-    Perform the trade if there are compatible orders to match.
+    Perform the trade if there are compatible orders to match, or queue the order for the
+    matching engine if it is enabled.
     """
 
-    if created:
-        instance_wallet = get_object_or_404(Wallet, profile=instance.profile)
-        if instance.type == 'B':
-            # Freeze the dollar amount if it is a buy order
-            amount = instance.quantity * instance.price
-            instance_wallet.available_dollar -= amount
-            instance_wallet.frozen_dollar += amount
-            instance_wallet.save()
-
-            # Check sell orders to match
-            sell_orders = Order.objects.filter(type='S', status=True).exclude(profile=instance.profile)
-            for sell_order in sell_orders:
-                if instance.price >= sell_order.price and instance.quantity == sell_order.quantity:
-                    sell_order_wallet = get_object_or_404(Wallet, profile=sell_order.profile)
-                    perform_trade(instance, instance_wallet, sell_order, sell_order_wallet)
-                    break
-
-        elif instance.type == 'S':
-            # Freeze the bitcoin amount if it is a sell order
-            amount = instance.quantity
-            instance_wallet.available_bitcoin -= amount
-            instance_wallet.frozen_bitcoin += amount
-            instance_wallet.save()
-
-            # Check buy orders to match
-            buy_orders = Order.objects.filter(type='B', status=True).exclude(profile=instance.profile)
-            for buy_order in buy_orders:
-                if buy_order.price >= instance.price and buy_order.quantity == instance.quantity:
-                    buy_order_wallet = get_object_or_404(Wallet, profile=buy_order.profile)
-                    perform_trade(buy_order, buy_order_wallet, instance, instance_wallet)
-                    break
+    if created and not getattr(instance, '_batched', False):
+        record_events([order_accepted(instance)])
+        update_order_counters({instance.profile_id: {'active_orders': 1}})
+        if settings.EXCHANGE_MATCHING_ENGINE:
+            # The order is matched in sequence by the matching engine shard of its symbol
+            get_symbol_queue(instance.symbol).put(NEW_ORDER, instance.pk)
+        else:
+            submit_order(instance)
 
 
 @receiver(pre_delete, sender=Order)
+@timed('signals')
 def delete_order(sender, instance, **kwargs):
     """
     Unfreeze the amount needed to fulfill the order when it is canceled.
+    The order is not deleted if another worker has filled or canceled it meanwhile.
+    """
+
+    # Orders canceled by 'cancel_order()' are already released
+    if instance.status and not getattr(instance, '_released', False):
+        release_order(instance)
+    counter = 'active_orders' if instance.status else 'executed_orders'
+    update_order_counters({instance.profile_id: {counter: -1}})
+
+
+@receiver(post_delete, sender=Order)
+@timed('signals')
+def deleted_order(sender, instance, **kwargs):
+    """
+    Rebuild the order book depth once the canceled order has been deleted.
+    """
+
+    touch_book()
+
+
+@receiver(post_save, sender=Wallet)
+@timed('signals')
+def invalidate_profile_cache(sender, instance, **kwargs):
+    """
+    Discard the cached profile statistics when the wallet changes.
     """
 
-    instance_wallet = get_object_or_404(Wallet, profile=instance.profile)
-    if instance.type == 'B':
-        # Unfreeze the dollar amount if it is a buy order
-        amount = instance.quantity * instance.price
-        instance_wallet.available_dollar += amount
-        instance_wallet.frozen_dollar -= amount
-        instance_wallet.save()
-
-    elif instance.type == 'S':
-        # Unfreeze the bitcoin amount if it is a sell order
-        amount = instance.quantity
-        instance_wallet.available_bitcoin += amount
-        instance_wallet.frozen_bitcoin -= amount
-        instance_wallet.save()
+    invalidate_profiles([instance.profile_id])
@@ -1,11 +1,42 @@
+import asyncio
+import csv
+import io
 import json
+import os
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipIf
+from bitcoinExchange.asgi import application
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from exchange.api.serializers import OrderSerializer, ProfileSerializer
-from exchange.models import Order
+from exchange.async_api import async_api_application
+from exchange.models import Balance, Fill, Order, Profile, TraderStatistics, Transaction, Wallet
+from exchange.utils import sequencer
+from exchange.utils.admission import AdmissionRejected, AdmissionStore, OpenOrdersLimit, open_orders
+from exchange.utils import analytics, leaderboards
+from exchange.utils.amounts import to_cents, to_satoshi
+from exchange.utils.batch import cancel_orders, create_orders
+from exchange.utils.benchmark import OrderFlow, percentile, run_benchmark
+from exchange.utils.broker import Broker
+from exchange.utils.event_log import ExchangeState, load_state
+from exchange.utils.instrumentation import registry
+from exchange.utils.ledger import InsufficientBalance, update_wallet, update_wallets
+from exchange.utils.instruments import get_shard
+from exchange.utils.order_book import OrderBook, order_book, order_books, reset_order_books
+from exchange.utils.token_cache import TokenCache, get_token_cache
+from exchange.utils.trade import StaleOrder, cancel_order
+from exchange.utils.triggers import trigger_book, trigger_books
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 
 class RESTAuthTestCase(APITestCase):
@@ -54,6 +85,8 @@ class OrderViewSetTestCase(APITestCase):
     - create
     - retrieve
     - delete
+    - batch
+    - cancel
     """
 
     def setUp(self):
@@ -62,7 +95,7 @@ class OrderViewSetTestCase(APITestCase):
         Create an order for tests and setup urls.
         """
         self.user = User.objects.create_user(username='testcase', password='Change_me_123!')
-        self.order = Order.objects.create(profile=self.user.profile, price=5.5, quantity=0.5, type='S')
+        self.order = Order.objects.create(profile=self.user.profile, price=to_cents(5.5), quantity=to_satoshi(0.5), type='S')
         self.list_url = reverse('orders-list')
         self.detail_url = reverse('orders-detail', kwargs={'pk': self.order.pk})
         self.token = Token.objects.create(user=self.user)
@@ -80,6 +113,40 @@ class OrderViewSetTestCase(APITestCase):
         response = self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/orders/
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_order_pages(self):
+        for price in (6, 7, 8):
+            Order.objects.create(profile=self.user.profile, price=to_cents(price), quantity=to_satoshi(0.1), type='S')
+        response = self.client.get(self.list_url, {'page_size': 3})  # Ex. URL: http://127.0.0.1/api/orders/?page_size=3
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([order['price'] for order in response.data['results']], [8, 7, 6])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([order['id'] for order in response.data['results']], [self.order.pk])
+        self.assertIsNone(response.data['next'])
+
+    def test_list_order_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/orders/
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries), response.data['results']
+
+        def create_executed_orders(count):
+            Order.objects.bulk_create([
+                Order(profile=self.user.profile, price=to_cents(7), quantity=to_satoshi(0.1), type='B', status=False,
+                      transaction=Transaction.objects.create())
+                for index in range(count)
+            ])
+
+        create_executed_orders(2)
+        count_queries()  # The token is cached by the first request
+        queries, results = count_queries()
+        create_executed_orders(20)
+        self.assertEqual(count_queries()[0], queries)
+        self.assertEqual(results[0]['profile'], 'testcase')
+        executed_at = Order.objects.get(pk=results[0]['id']).transaction.executed_at
+        self.assertEqual(results[0]['executed_at'], executed_at.strftime("%d/%m/%Y, %H:%M:%S"))
+
     def test_create_order_by_not_authenticated_user(self):
         data = {'price': 10.5, 'quantity': 0.5, 'type': 'S'}
         self.client.force_authenticate(user=None)
@@ -101,6 +168,15 @@ class OrderViewSetTestCase(APITestCase):
         json_response = json.loads(response.content)
         self.assertEqual(json_response['non_field_errors'], ['insufficient balance'])  # Checking the fully rendered response
 
+    def test_create_order_not_positive(self):
+        for name, value in (('quantity', '0'), ('quantity', '0.000000001'), ('quantity', '-0.5'),
+                            ('price', '0'), ('price', '0.001'), ('price', '-10.5')):
+            data = dict({'price': 10.5, 'quantity': 0.5, 'type': 'S'}, **{name: value})
+            response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(name, response.data)
+        self.assertEqual(Order.objects.count(), 1)
+
     def test_retrieve_order_by_not_authenticated_user(self):
         self.client.force_authenticate(user=None)
         response = self.client.get(self.detail_url)  # Ex. URL: http://127.0.0.1/api/orders/1/
@@ -136,6 +212,80 @@ class OrderViewSetTestCase(APITestCase):
         response = self.client.get(self.detail_url)  # Ex. URL: http://127.0.0.1/api/orders/1/
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_batch_orders(self):
+        Wallet.objects.filter(profile=self.user.profile).update(available_bitcoin=to_satoshi(2))
+        data = [{'price': 10, 'quantity': 0.5, 'type': 'S'}, {'price': 11, 'quantity': 1, 'type': 'S'}]
+        url = reverse('orders-batch')
+        response = self.client.post(url, data=data, format='json')  # Ex. URL: http://127.0.0.1/api/orders/batch/
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([order['price'] for order in response.data], [10, 11])
+        wallet = Wallet.objects.get(profile=self.user.profile)
+        self.assertEqual(wallet.available_bitcoin, to_satoshi(0.5))
+        self.assertEqual(wallet.frozen_bitcoin, self.order.quantity + to_satoshi(1.5))
+
+    def test_batch_orders_invalid(self):
+        Wallet.objects.filter(profile=self.user.profile).update(available_bitcoin=to_satoshi(1))
+        data = [{'price': 10, 'quantity': 0.5, 'type': 'S'}, {'price': 11, 'quantity': 1, 'type': 'S'}]
+        url = reverse('orders-batch')
+        response = self.client.post(url, data=data, format='json')  # Ex. URL: http://127.0.0.1/api/orders/batch/
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['non_field_errors'], ['insufficient balance'])
+        self.assertEqual(Order.objects.filter(profile=self.user.profile).count(), 1)
+        self.assertEqual(Wallet.objects.get(profile=self.user.profile).available_bitcoin, to_satoshi(1))
+
+    def test_batch_orders_partially_saved(self):
+        Wallet.objects.filter(profile=self.user.profile).update(available_bitcoin=to_satoshi(2))
+        data = [{'price': to_cents(10), 'quantity': to_satoshi(0.5), 'type': 'S'},
+                {'price': to_cents(11), 'quantity': to_satoshi(1), 'type': 'S'}]
+        save = Order.save
+
+        def failing_save(order, *args, **kwargs):
+            if order.price == to_cents(11):
+                raise RuntimeError('save failed')
+            save(order, *args, **kwargs)
+
+        with mock.patch.object(Order, 'save', failing_save), \
+                mock.patch('exchange.utils.batch.submit_order') as submit_order:
+            with self.assertRaises(RuntimeError):
+                create_orders(self.user.profile, data)
+        self.assertEqual([call[0][0].price for call in submit_order.call_args_list], [to_cents(10)])
+        wallet = Wallet.objects.get(profile=self.user.profile)
+        self.assertEqual(wallet.available_bitcoin, to_satoshi(1.5))
+
+    def test_cancel_orders(self):
+        Wallet.objects.filter(profile=self.user.profile).update(available_dollar=to_cents(100))
+        for price in (6, 7):
+            Order.objects.create(profile=self.user.profile, price=to_cents(price), quantity=to_satoshi(1), type='B')
+        url = reverse('orders-cancel')
+        response = self.client.post(url, data={'type': 'B', 'min_price': 6.5})  # Ex. URL: http://127.0.0.1/api/orders/cancel/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(Wallet.objects.get(profile=self.user.profile).frozen_dollar, to_cents(6))
+        response = self.client.post(url)  # Ex. URL: http://127.0.0.1/api/orders/cancel/
+        self.assertEqual(response.data['count'], 2)
+        self.assertFalse(Order.objects.filter(profile=self.user.profile).exists())
+        wallet = Wallet.objects.get(profile=self.user.profile)
+        self.assertEqual((wallet.available_dollar, wallet.frozen_dollar), (to_cents(100), 0))
+        self.assertEqual(wallet.frozen_bitcoin, 0)
+
+    def test_cancel_orders_not_refunded(self):
+        Wallet.objects.filter(profile=self.user.profile).update(frozen_bitcoin=0)
+        response = self.client.post(reverse('orders-cancel'))  # Ex. URL: http://127.0.0.1/api/orders/cancel/
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['non_field_errors'], ['insufficient balance'])
+        self.assertTrue(Order.objects.filter(pk=self.order.pk, status=True).exists())
+        self.assertIn(self.order.pk, [order.pk for order in order_book.asks])
+
+    def test_cancel_stale_order(self):
+        # Partially filled by another worker after it has been read
+        Order.objects.filter(pk=self.order.pk).update(filled_quantity=to_satoshi(0.2))
+        frozen_bitcoin = Wallet.objects.get(profile=self.user.profile).frozen_bitcoin
+        with self.assertRaises(StaleOrder):
+            cancel_order(self.order)
+        self.assertEqual(cancel_orders(self.user.profile, [self.order]), 0)
+        self.assertTrue(Order.objects.filter(pk=self.order.pk, status=True).exists())
+        self.assertEqual(Wallet.objects.get(profile=self.user.profile).frozen_bitcoin, frozen_bitcoin)
+
 
 class LatestOrdersListAPIViewTestCase(APITestCase):
     """
@@ -151,7 +301,7 @@ class LatestOrdersListAPIViewTestCase(APITestCase):
         Create an order for tests and setup url.
         """
         self.user = User.objects.create_user(username='testcase1', password='Change_me_123!')
-        self.order = Order.objects.create(profile=self.user.profile, price=5.5, quantity=0.5, type='S')
+        self.order = Order.objects.create(profile=self.user.profile, price=to_cents(5.5), quantity=to_satoshi(0.5), type='S')
         self.list_url = reverse('orders-latest')
         self.token = Token.objects.create(user=self.user)
         self.api_authentication()
@@ -166,13 +316,438 @@ class LatestOrdersListAPIViewTestCase(APITestCase):
 
     def test_list_latest_orders_by_authenticated_user(self):
         user = User.objects.create_user(username='testcase2', password='Change_me_123!')
-        Order.objects.create(profile=user.profile, price=10.5, quantity=0.5, type='S')
+        Order.objects.create(profile=user.profile, price=to_cents(10.5), quantity=to_satoshi(0.5), type='S')
         response = self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/orders/latest/
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         json_response = json.loads(response.content)
         self.assertEqual(json_response[0]['id'], 2)  # Checking the fully rendered response
         self.assertEqual(json_response[0]['price'], 10.5)  # Checking the fully rendered response
 
+    def test_list_latest_orders_queries(self):
+        user = User.objects.create_user(username='testcase2', password='Change_me_123!')
+        Wallet.objects.filter(profile=user.profile).update(available_bitcoin=to_satoshi(10))
+        Order.objects.create(profile=user.profile, price=to_cents(10), quantity=to_satoshi(0.1), type='S')
+        self.client.get(self.list_url)  # The token is cached by the first request
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/orders/latest/
+        for price in range(11, 31):
+            Order.objects.create(profile=user.profile, price=to_cents(price), quantity=to_satoshi(0.1), type='S')
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/orders/latest/
+        self.assertEqual(len(response.data), 21)
+        self.assertEqual(len(more_queries), len(queries))
+
+
+class OrderBookDepthAPIViewTestCase(APITestCase):
+    """
+    OrderBookDepthAPIView test case.
+
+    :actions
+    - retrieve
+    """
+
+    def setUp(self):
+        """
+        Create new user, get an authentication token and authenticate with it.
+        Create some orders for tests and setup url.
+        """
+        cache.clear()
+        order_book.reset()
+        self.user = User.objects.create_user(username='testcase1', password='Change_me_123!')
+        self.user.profile.wallet.available_bitcoin = to_satoshi(10)
+        self.user.profile.wallet.save()
+        for price, quantity in ((11, 0.5), (10, 0.25), (10, 0.5), (12, 1)):
+            Order.objects.create(profile=self.user.profile, price=to_cents(price), quantity=to_satoshi(quantity), type='S')
+        self.detail_url = reverse('orders-depth')
+        self.token = Token.objects.create(user=self.user)
+        self.api_authentication()
+
+    def tearDown(self):
+        order_book.reset()
+
+    def api_authentication(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_retrieve_depth_by_not_authenticated_user(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.detail_url)  # Ex. URL: http://127.0.0.1/api/orders/depth/
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_retrieve_depth_by_authenticated_user(self):
+        response = self.client.get(self.detail_url, {'levels': 2})  # Ex. URL: http://127.0.0.1/api/orders/depth/?levels=2
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        json_response = json.loads(response.content)
+        self.assertEqual(json_response['bids'], [])
+        self.assertEqual(json_response['asks'], [
+            {'price': 10.0, 'quantity': 0.75, 'orders': 2},
+            {'price': 11.0, 'quantity': 0.5, 'orders': 1},
+        ])
+
+    def test_retrieve_depth_not_modified(self):
+        response = self.client.get(self.detail_url)  # Ex. URL: http://127.0.0.1/api/orders/depth/
+        etag = response['ETag']
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Order.objects.create(profile=self.user.profile, price=to_cents(9), quantity=to_satoshi(0.5), type='S')
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['asks'][0]['price'], 9.0)
+
+    def test_retrieve_depth_if_none_match_list(self):
+        etag = self.client.get(self.detail_url)['ETag']  # Ex. URL: http://127.0.0.1/api/orders/depth/
+        version = etag.strip('"').split('-')[0]
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=f'"1{version}-all", W/"0-all"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=f'"0-all", W/{etag}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class CandleListAPIViewTestCase(APITestCase):
+    """
+    CandleListAPIView test case.
+
+    :actions
+    - list
+    """
+
+    def setUp(self):
+        """
+        Create new users, get an authentication token and authenticate with it.
+        Execute some trades for tests and setup url.
+        """
+        order_book.reset()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        Wallet.objects.filter(profile=self.seller.profile).update(available_bitcoin=to_satoshi(10))
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_dollar=to_cents(1000))
+        for price, quantity in ((10, 0.5), (12, 0.25), (11, 1)):
+            Order.objects.create(profile=self.seller.profile, price=to_cents(price), quantity=to_satoshi(quantity), type='S')
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(2), type='B')
+        self.list_url = reverse('candles-list')
+        self.token = Token.objects.create(user=self.buyer)
+        self.api_authentication()
+
+    def tearDown(self):
+        order_book.reset()
+
+    def api_authentication(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_list_candles_by_not_authenticated_user(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.list_url, {'interval': '1m'})  # Ex. URL: http://127.0.0.1/api/candles/?interval=1m
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_list_candles_by_authenticated_user(self):
+        response = self.client.get(self.list_url, {'interval': '1d'})  # Ex. URL: http://127.0.0.1/api/candles/?interval=1d
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        json_response = json.loads(response.content)
+        self.assertEqual(len(json_response), 1)
+        candle = json_response[0]
+        self.assertEqual((candle['open'], candle['high'], candle['low'], candle['close']), (10, 12, 10, 12))
+        self.assertEqual(candle['volume'], 1.75)
+        self.assertEqual(candle['trades'], 3)
+        self.assertEqual(Fill.objects.filter(aggressor='B').count(), 3)
+
+    def test_list_candles_invalid_interval(self):
+        response = self.client.get(self.list_url, {'interval': '2m'})  # Ex. URL: http://127.0.0.1/api/candles/?interval=2m
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MarketStatisticsAPIViewTestCase(APITestCase):
+    """
+    MarketStatisticsAPIView test case.
+
+    :actions
+    - retrieve
+    """
+
+    def setUp(self):
+        """
+        Create new users, get an authentication token and authenticate with it.
+        Execute some trades, leave an order on each side of the book and setup url.
+        """
+        order_book.reset()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        Wallet.objects.filter(profile=self.seller.profile).update(available_bitcoin=to_satoshi(10))
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_dollar=to_cents(1000))
+        for price, quantity in ((10, 0.5), (12, 0.25), (11, 1), (15, 1)):
+            Order.objects.create(profile=self.seller.profile, price=to_cents(price), quantity=to_satoshi(quantity), type='S')
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(2), type='B')
+        self.detail_url = reverse('market-statistics')
+        self.token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        order_book.reset()
+
+    def test_retrieve_statistics_by_not_authenticated_user(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.detail_url)  # Ex. URL: http://127.0.0.1/api/statistics/
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_retrieve_statistics_by_authenticated_user(self):
+        response = self.client.get(self.detail_url)  # Ex. URL: http://127.0.0.1/api/statistics/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        json_response = json.loads(response.content)
+        self.assertEqual(json_response['trades'], 3)
+        self.assertEqual(json_response['volume'], 1.75)
+        self.assertEqual(json_response['dollar_volume'], 19)
+        self.assertEqual(json_response['last_price'], 12)
+        self.assertEqual((json_response['best_bid'], json_response['best_ask']), (12, 15))
+        self.assertEqual(json_response['spread'], 3)
+
+
+class PortfolioAnalyticsAPIViewTestCase(APITestCase):
+    """
+    PortfolioAnalyticsAPIView test case.
+
+    :actions
+    - retrieve
+
+    :tests
+    - test_iterative_analytics(): The loop used without NumPy returns the same figures.
+    - test_vectorized_matches_iterative(): Both implementations agree on a long random fill history.
+    """
+
+    def setUp(self):
+        reset_order_books()
+        self.user = User.objects.create_user(username='testcase', password='Change_me_123!')
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.trader = User.objects.create_user(username='trader', password='Change_me_123!')
+        Wallet.objects.filter(profile=self.user.profile).update(available_dollar=to_cents(100), available_bitcoin=0)
+        Wallet.objects.filter(profile=self.seller.profile).update(available_bitcoin=to_satoshi(10))
+        Wallet.objects.filter(profile=self.trader.profile).update(available_dollar=to_cents(100))
+        self.url = reverse('portfolio-analytics')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        reset_order_books()
+
+    def trade(self):
+        # Buy 1 at 10 and 1 at 20, then sell 1 at 30: average entry 15, realized 15, unrealized 15
+        for price in (10, 20):
+            Order.objects.create(profile=self.seller.profile, price=to_cents(price), quantity=to_satoshi(1), type='S')
+            Order.objects.create(profile=self.user.profile, price=to_cents(price), quantity=to_satoshi(1), type='B')
+        Order.objects.create(profile=self.trader.profile, price=to_cents(30), quantity=to_satoshi(1), type='B')
+        Order.objects.create(profile=self.user.profile, price=to_cents(30), quantity=to_satoshi(1), type='S')
+
+    def assertPortfolio(self, data):
+        self.assertEqual((data['trades'], data['position'], data['average_entry_price']), (3, 1, 15))
+        self.assertEqual((data['mark_price'], data['realized_pnl'], data['unrealized_pnl']), (30, 15, 15))
+        self.assertEqual((data['total_pnl'], data['volume'], data['amount']), (30, 3, 60))
+        self.assertEqual(len(data['days']), 1)
+        self.assertEqual((data['days'][0]['trades'], data['days'][0]['equity']), (3, 30))
+
+    def test_retrieve_analytics_by_not_authenticated_user(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)  # Ex. URL: http://127.0.0.1/api/analytics/
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_retrieve_analytics(self):
+        self.trade()
+        response = self.client.get(self.url)  # Ex. URL: http://127.0.0.1/api/analytics/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertPortfolio(response.data)
+
+    def test_retrieve_analytics_without_fills(self):
+        response = self.client.get(self.url, {'symbol': 'ETH-USD'})  # Ex. URL: http://127.0.0.1/api/analytics/?symbol=ETH-USD
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['trades'], response.data['average_entry_price']), (0, None))
+        self.assertEqual(response.data['days'], [])
+
+    def test_retrieve_analytics_invalid_symbol(self):
+        response = self.client.get(self.url, {'symbol': 'DOGE-USD'})  # Ex. URL: http://127.0.0.1/api/analytics/?symbol=DOGE-USD
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_iterative_analytics(self):
+        self.trade()
+        with mock.patch.object(analytics, 'np', None):
+            response = self.client.get(self.url)  # Ex. URL: http://127.0.0.1/api/analytics/
+        self.assertPortfolio(response.data)
+
+    @skipIf(analytics.np is None, 'NumPy is not installed')
+    def test_vectorized_matches_iterative(self):
+        generator = random.Random(0)
+        columns = ([], [], [], [])
+        for index in range(2000):
+            columns[0].append(1600000000 + index * 600)
+            columns[1].append(generator.randint(to_cents(9000), to_cents(11000)))
+            columns[2].append(generator.randint(1, to_satoshi(2)))
+            columns[3].append(generator.choice((1, 1, -1, -1, 0)))
+        vectorized = analytics.vectorized_analytics(*columns)
+        iterative = analytics.iterative_analytics(*columns)
+        for vectorized_value, iterative_value in zip(vectorized[:3], iterative[:3]):
+            self.assertAlmostEqual(vectorized_value / iterative_value, 1, places=6)
+        self.assertEqual(len(vectorized[3]), len(iterative[3]))
+        for vectorized_day, iterative_day in zip(vectorized[3], iterative[3]):
+            self.assertEqual(vectorized_day[:3], iterative_day[:3])
+            self.assertAlmostEqual(vectorized_day[4] / iterative_day[4], 1, places=6)
+
+
+class LeaderboardsAPIViewTestCase(APITestCase):
+    """
+    LeaderboardsAPIView test case.
+
+    :actions
+    - retrieve
+
+    :tests
+    - test_incremental_totals(): Each run only adds the fills executed since the previous one.
+    - test_settle_delay(): The fills after a gap in the ids are left to the next run until the settle delay.
+    - test_read_one_query(): The document is read with one query.
+    """
+
+    def setUp(self):
+        reset_order_books()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        Wallet.objects.filter(profile=self.seller.profile).update(available_bitcoin=to_satoshi(10), bitcoin_net_balance=to_satoshi(10))
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_dollar=to_cents(1000), available_bitcoin=to_satoshi(1),
+                                                                 bitcoin_net_balance=to_satoshi(1))
+        Balance.objects.filter(profile=self.seller.profile, asset='ETH').update(available=to_satoshi(10))
+        self.url = reverse('leaderboards')
+        self.token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.settle_delay = mock.patch.object(leaderboards, 'FILL_SETTLE_DELAY', timedelta(0))
+        self.settle_delay.start()
+
+    def tearDown(self):
+        self.settle_delay.stop()
+        reset_order_books()
+
+    def trade(self, price, quantity, symbol='BTC-USD'):
+        Order.objects.create(profile=self.seller.profile, symbol=symbol, price=to_cents(price), quantity=to_satoshi(quantity), type='S')
+        Order.objects.create(profile=self.buyer.profile, symbol=symbol, price=to_cents(price), quantity=to_satoshi(quantity), type='B')
+
+    def test_retrieve_leaderboards_not_computed(self):
+        response = self.client.get(self.url)  # Ex. URL: http://127.0.0.1/api/leaderboards/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'computed_at': None, 'profit': [], 'volume': [], 'exchange': None})
+
+    def test_retrieve_leaderboards(self):
+        self.trade(100, 1)
+        self.trade(50, 2, symbol='ETH-USD')
+        call_command('compute_leaderboards', stdout=io.StringIO())
+        response = self.client.get(self.url)  # Ex. URL: http://127.0.0.1/api/leaderboards/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['username'] for row in response.data['profit']], ['buyer', 'seller'])
+        self.assertEqual(response.data['profit'][0]['bitcoin_profit_percent'], 100)
+        self.assertEqual(response.data['profit'][1]['bitcoin_profit_percent'], -10)
+        self.assertEqual(response.data['volume'][0], {'rank': 1, 'username': 'seller', 'trades': 2, 'dollar_volume': 200})
+        self.assertEqual(response.data['volume'][1]['username'], 'buyer')  # Same volume, the first profile ranks first
+        exchange = response.data['exchange']
+        self.assertEqual((exchange['users'], exchange['trades'], exchange['dollar_volume']), (2, 2, 200))
+        self.assertEqual(exchange['markets']['ETH-USD']['volume'], 2)
+        self.assertEqual(exchange['markets']['BTC-USD']['last_price'], 100)
+        self.assertEqual(exchange['markets']['ETH-BTC']['trades'], 0)
+
+    def test_incremental_totals(self):
+        self.trade(100, 1)
+        self.assertEqual(leaderboards.compute_leaderboards(), 1)
+        self.trade(200, 1)
+        self.assertEqual(leaderboards.compute_leaderboards(), 1)
+        self.assertEqual(leaderboards.compute_leaderboards(), 0)
+        statistics = TraderStatistics.objects.get(profile=self.seller.profile)
+        self.assertEqual((statistics.trades, statistics.dollar_volume), (2, to_cents(300)))
+        self.assertEqual(leaderboards.get_leaderboards()['exchange']['dollar_volume'], 300)
+
+    def test_settle_delay(self):
+        self.trade(100, 1)
+        self.assertEqual(leaderboards.compute_leaderboards(), 1)
+        with mock.patch.object(leaderboards, 'FILL_SETTLE_DELAY', timedelta(minutes=1)):
+            self.trade(200, 1)
+            self.assertEqual(leaderboards.compute_leaderboards(), 1)  # Next id after the cursor
+            self.trade(300, 1)
+            self.trade(400, 1)
+            Fill.objects.filter(price=to_cents(300)).delete()  # Id of a trade not committed yet
+            self.assertEqual(leaderboards.compute_leaderboards(), 0)
+        self.assertEqual(leaderboards.compute_leaderboards(), 1)
+
+    def test_read_one_query(self):
+        leaderboards.compute_leaderboards()
+        with CaptureQueriesContext(connection) as queries:
+            leaderboards.get_leaderboards()
+        self.assertEqual(len(queries), 1)
+
+
+class ExportTestCase(APITestCase):
+    """
+    Order and fill history export test case.
+
+    :tests
+    - test_export_orders_csv(): The orders are streamed as CSV with the execution datetime joined.
+    - test_export_fills_ndjson(): The fills are streamed as NDJSON, one object per side of the user.
+    - test_export_queries(): The number of queries does not depend on the number of orders.
+    - test_export_invalid_params(): Unknown datasets and formats are rejected.
+    - test_export_command(): The management command writes the same export to a file.
+    """
+
+    def setUp(self):
+        reset_order_books()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        Wallet.objects.filter(profile=self.seller.profile).update(available_bitcoin=to_satoshi(10))
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_dollar=to_cents(1000))
+        self.url = reverse('orders-export')
+        self.token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        reset_order_books()
+
+    def trade(self):
+        Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(1), type='S')
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(10), quantity=to_satoshi(1), type='B')
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(5), quantity=to_satoshi(0.5), type='B')
+
+    def test_export_orders_csv(self):
+        self.trade()
+        response = self.client.get(self.url)  # Ex. URL: http://127.0.0.1/api/orders/export/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row['price'], row['status']) for row in rows], [('10.0', 'False'), ('5.0', 'True')])
+        executed_at = Order.objects.get(price=to_cents(10), type='B').transaction.executed_at
+        self.assertEqual(rows[0]['executed_at'], executed_at.strftime("%d/%m/%Y, %H:%M:%S"))
+        self.assertEqual(rows[1]['executed_at'], '')
+
+    def test_export_fills_ndjson(self):
+        self.trade()
+        response = self.client.get(self.url, {'dataset': 'fills', 'output': 'ndjson'})  # Ex. URL: http://127.0.0.1/api/orders/export/?dataset=fills&output=ndjson
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['side'], rows[0]['price'], rows[0]['quantity']), ('B', 10, 1))
+
+    def test_export_queries(self):
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_dollar=to_cents(100000))
+        for price in range(1, 31):
+            Order.objects.create(profile=self.buyer.profile, price=to_cents(price), quantity=to_satoshi(0.1), type='B')
+        with CaptureQueriesContext(connection) as queries:
+            content = b''.join(self.client.get(self.url).streaming_content)
+        self.assertEqual(len(content.splitlines()), 31)
+        self.assertLess(len(queries), 10)
+
+    def test_export_invalid_params(self):
+        for params in ({'dataset': 'wallets'}, {'output': 'xml'}):
+            response = self.client.get(self.url, params)  # Ex. URL: http://127.0.0.1/api/orders/export/?output=xml
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        self.trade()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fills.csv')
+            call_command('export_history', 'seller', dataset='fills', file=path, stderr=io.StringIO())
+            with open(path, newline='') as export_file:
+                rows = list(csv.DictReader(export_file))
+        self.assertEqual([(row['side'], row['aggressor']) for row in rows], [('S', 'B')])
+
 
 class ProfileAPIViewTestCase(APITestCase):
     """
@@ -205,3 +780,1084 @@ class ProfileAPIViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         json_response = json.loads(response.content)
         self.assertEqual(json_response, serializer_data)  # Checking the fully rendered response
+
+    def test_retrieve_profile_after_order_changes(self):
+        response = self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/profile/
+        self.assertEqual(response.data['active_orders'], 0)
+        order = Order.objects.create(profile=self.user.profile, price=to_cents(5.5), quantity=to_satoshi(0.5), type='S')
+        response = self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/profile/
+        self.assertEqual(response.data['active_orders'], 1)
+        order.delete()
+        response = self.client.get(self.list_url)  # Ex. URL: http://127.0.0.1/api/profile/
+        self.assertEqual(response.data['active_orders'], 0)
+
+    def test_rebuild_profile_counters(self):
+        Order.objects.create(profile=self.user.profile, price=to_cents(5.5), quantity=to_satoshi(0.5), type='S')
+        other = User.objects.create_user(username='testcase2', password='Change_me_123!')
+        Profile.objects.update(active_orders=5, executed_orders=5)
+        with CaptureQueriesContext(connection) as queries:
+            call_command('rebuild_profile_counters', stdout=io.StringIO())
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(Profile.objects.values_list('active_orders', 'executed_orders').get(user=self.user), (1, 0))
+        self.assertEqual(Profile.objects.values_list('active_orders', 'executed_orders').get(user=other), (0, 0))
+
+
+class OrderBookTestCase(APITestCase):
+    """
+    In-memory order book test case.
+
+    :tests
+    - test_price_time_priority(): The best price is matched first, then the oldest order.
+    - test_same_profile_not_matched(): Orders of the same profile are never matched.
+    - test_new_order_matches_book(): A compatible order is executed against the book.
+    - test_stale_order_not_executed(): An order executed by another worker is not executed twice.
+    - test_order_of_other_worker_matched(): An order added to the book of another worker is matched.
+    - test_negative_frozen_balance(): A trade never makes a frozen balance negative.
+    - test_unbacked_resting_order_skipped(): A resting order whose frozen balance is missing is not matched.
+    - test_missing_balance_credited(): A credit creates a missing asset balance, a debit fails.
+    """
+
+    def setUp(self):
+        order_book.reset()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        self.seller.profile.wallet.available_bitcoin = to_satoshi(10)
+        self.seller.profile.wallet.save()
+
+    def tearDown(self):
+        order_book.reset()
+
+    def test_price_time_priority(self):
+        book = OrderBook()
+        book.add(Order(pk=1, profile=self.seller.profile, price=to_cents(11), quantity=to_satoshi(1), type='S'))
+        book.add(Order(pk=2, profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(1), type='S'))
+        book.add(Order(pk=3, profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(1), type='S'))
+        buy_order = Order(pk=4, profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(1), type='B')
+        self.assertEqual(book.best_match(buy_order).pk, 2)
+        book.remove(book.best_match(buy_order))
+        self.assertEqual(book.best_match(buy_order).pk, 3)
+        book.remove(book.best_match(buy_order))
+        self.assertEqual(book.best_match(buy_order).pk, 1)
+        buy_order.price = to_cents(10.5)
+        self.assertIsNone(book.best_match(buy_order))
+
+    def test_same_profile_not_matched(self):
+        book = OrderBook()
+        book.add(Order(pk=1, profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(1), type='S'))
+        buy_order = Order(pk=2, profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(1), type='B')
+        self.assertIsNone(book.best_match(buy_order))
+
+    def test_new_order_matches_book(self):
+        self.buyer.profile.wallet.available_dollar = to_cents(100)
+        self.buyer.profile.wallet.save()
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(0.5), type='B')
+        sell_order.refresh_from_db()
+        buy_order.refresh_from_db()
+        self.assertFalse(sell_order.status)
+        self.assertFalse(buy_order.status)
+        self.assertEqual(sell_order.transaction, buy_order.transaction)
+        self.assertEqual(len(order_book.bids) + len(order_book.asks), 0)
+
+    def test_stale_order_not_executed(self):
+        self.buyer.profile.wallet.available_dollar = to_cents(100)
+        self.buyer.profile.wallet.save()
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        # Executed by another worker, the book of this process still holds it
+        Order.objects.filter(pk=sell_order.pk).update(status=False, filled_quantity=sell_order.quantity)
+        Wallet.objects.filter(profile=self.seller.profile).update(frozen_bitcoin=0)
+        for partial_fills in (False, True):
+            with self.settings(EXCHANGE_PARTIAL_FILLS=partial_fills):
+                buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(0.5), type='B')
+                buy_order.refresh_from_db()
+                self.assertTrue(buy_order.status)
+                self.assertEqual(buy_order.filled_quantity, 0)
+        self.assertFalse(Fill.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(len(order_book.asks), 0)
+        self.assertEqual(len(order_book.bids), 2)
+        self.assertEqual(Wallet.objects.get(profile=self.seller.profile).frozen_bitcoin, 0)
+
+    def test_order_of_other_worker_matched(self):
+        self.buyer.profile.wallet.available_dollar = to_cents(100)
+        self.buyer.profile.wallet.save()
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        # Created by another worker, the book of this process does not hold it
+        order_book.remove(sell_order)
+        buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(0.5), type='B')
+        buy_order.refresh_from_db()
+        self.assertFalse(buy_order.status)
+        self.assertEqual(Fill.objects.get().sell_order_id, sell_order.pk)
+        self.assertEqual(len(order_book.bids) + len(order_book.asks), 0)
+
+    def test_unbacked_resting_order_skipped(self):
+        self.buyer.profile.wallet.available_dollar = to_cents(100)
+        self.buyer.profile.wallet.save()
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        Wallet.objects.filter(profile=self.seller.profile).update(frozen_bitcoin=0)
+        for partial_fills in (False, True):
+            with self.settings(EXCHANGE_PARTIAL_FILLS=partial_fills):
+                buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(0.5), type='B')
+                buy_order.refresh_from_db()
+                self.assertTrue(buy_order.status)
+                self.assertIn(buy_order.pk, [order.pk for order in order_book.bids])
+        self.assertTrue(Order.objects.filter(pk=sell_order.pk, status=True, filled_quantity=0).exists())
+        self.assertFalse(Fill.objects.exists())
+
+    def test_negative_frozen_balance(self):
+        available_bitcoin = Wallet.objects.get(profile=self.buyer.profile).available_bitcoin
+        with self.assertRaises(InsufficientBalance):
+            update_wallets({
+                self.buyer.profile.pk: {'available_bitcoin': to_satoshi(1)},
+                self.seller.profile.pk: {'frozen_bitcoin': -to_satoshi(1)},
+            })
+        self.assertEqual(Wallet.objects.get(profile=self.buyer.profile).available_bitcoin, available_bitcoin)
+        self.assertEqual(Wallet.objects.get(profile=self.seller.profile).frozen_bitcoin, 0)
+
+    def test_missing_balance_credited(self):
+        Balance.objects.filter(profile=self.buyer.profile, asset='ETH').delete()
+        with self.assertRaises(InsufficientBalance):
+            update_wallets({self.buyer.profile.pk: {'frozen_eth': -to_satoshi(1)}})
+        self.assertFalse(Balance.objects.filter(profile=self.buyer.profile, asset='ETH').exists())
+        update_wallets({self.buyer.profile.pk: {'available_eth': to_satoshi(1)}})
+        self.assertEqual(Balance.objects.get(profile=self.buyer.profile, asset='ETH').available, to_satoshi(1))
+
+
+class PartialFillTestCase(APITestCase):
+    """
+    Partial fills test case.
+
+    :tests
+    - test_sweep_price_levels(): A buy order sweeps several sell orders and rests with the remaining quantity.
+    - test_close_partially_filled_order(): Canceling a partially filled order keeps the executed quantity.
+    - test_amounts_conserved(): No cent is created or lost by rounding across partial fills.
+    - test_small_fills_rounded_up(): Splitting a buy order into small fills never lowers its cost.
+    """
+
+    def setUp(self):
+        order_book.reset()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        self.seller.profile.wallet.available_bitcoin = to_satoshi(10)
+        self.seller.profile.wallet.save()
+        self.buyer.profile.wallet.available_dollar = to_cents(100)
+        self.buyer.profile.wallet.save()
+        self.token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        order_book.reset()
+
+    def test_sweep_price_levels(self):
+        Order.objects.create(profile=self.seller.profile, price=to_cents(11), quantity=to_satoshi(1), type='S')
+        Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(12), quantity=to_satoshi(2), type='B')
+        buy_order.refresh_from_db()
+        self.assertTrue(buy_order.status)
+        self.assertEqual(buy_order.filled_quantity, to_satoshi(1.5))
+        self.assertEqual(Fill.objects.filter(buy_order=buy_order).count(), 2)
+        self.assertEqual(Order.objects.filter(type='S', status=True).count(), 0)
+        wallet = Wallet.objects.get(profile=self.buyer.profile)
+        self.assertEqual(wallet.frozen_dollar, to_cents(6))  # 0.5 still resting at 12
+        self.assertEqual(wallet.available_dollar, to_cents(100 - 6 - 0.5 * 10 - 1 * 11))
+        self.assertEqual(len(order_book.bids), 1)
+
+    def test_close_partially_filled_order(self):
+        Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(10), quantity=to_satoshi(2), type='B')
+        response = self.client.delete(reverse('orders-detail', kwargs={'pk': buy_order.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        buy_order.refresh_from_db()
+        self.assertFalse(buy_order.status)
+        self.assertEqual(buy_order.quantity, to_satoshi(0.5))
+        wallet = Wallet.objects.get(profile=self.buyer.profile)
+        self.assertEqual(wallet.frozen_dollar, 0)
+        self.assertEqual(wallet.available_dollar, to_cents(95))
+
+    def test_amounts_conserved(self):
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_bitcoin=0)
+        for price in (33.31, 33.32, 33.33):
+            Order.objects.create(profile=self.seller.profile, price=to_cents(price), quantity=to_satoshi(0.1111), type='S')
+        buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(33.33), quantity=to_satoshi(0.3333), type='B')
+        buy_order.refresh_from_db()
+        self.assertFalse(buy_order.status)
+        buyer_wallet = Wallet.objects.get(profile=self.buyer.profile)
+        seller_wallet = Wallet.objects.get(profile=self.seller.profile)
+        self.assertEqual(buyer_wallet.frozen_dollar, 0)
+        self.assertEqual(buyer_wallet.available_dollar + seller_wallet.available_dollar, to_cents(100))
+        self.assertEqual(buyer_wallet.available_bitcoin + seller_wallet.available_bitcoin, to_satoshi(10))
+
+    def test_small_fills_rounded_up(self):
+        Order.objects.create(profile=self.seller.profile, price=to_cents(50000), quantity=to_satoshi(1), type='S')
+        for index in range(100):
+            Order.objects.create(profile=self.buyer.profile, price=to_cents(50000), quantity=99, type='B')
+        wallet = Wallet.objects.get(profile=self.buyer.profile)
+        self.assertEqual(wallet.frozen_dollar, 0)
+        self.assertEqual(wallet.available_dollar, to_cents(100) - 500)  # 4.95 cents each, 4 if rounded down
+
+
+class OrderKindsTestCase(APITestCase):
+    """
+    Market, stop and stop-limit orders and time in force test case.
+
+    :tests
+    - test_market_order(): A market order sweeps the book without the quantity restriction.
+    - test_immediate_or_cancel(): The remaining quantity of an IOC order is canceled.
+    - test_fill_or_kill(): A FOK order that can not be filled entirely is canceled without fills.
+    - test_stop_order(): A trade print triggers a stop order, which is then matched as a market order.
+    - test_cancel_stop_order(): Canceling a waiting stop order unfreezes its amount.
+    """
+
+    def setUp(self):
+        order_book.reset()
+        trigger_book.reset()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        Wallet.objects.filter(profile=self.seller.profile).update(available_bitcoin=to_satoshi(10))
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_dollar=to_cents(100))
+        self.list_url = reverse('orders-list')
+        self.token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        order_book.reset()
+        trigger_book.reset()
+
+    def test_market_order(self):
+        Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        Order.objects.create(profile=self.seller.profile, price=to_cents(11), quantity=to_satoshi(1), type='S')
+        data = {'quantity': 1, 'type': 'B', 'kind': 'market'}
+        with self.settings(EXCHANGE_PARTIAL_FILLS=False):
+            response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        buy_order = Order.objects.get(profile=self.buyer.profile)
+        self.assertEqual((buy_order.status, buy_order.filled_quantity), (False, to_satoshi(1)))
+        self.assertEqual(list(Fill.objects.order_by('price').values_list('price', flat=True)), [to_cents(10), to_cents(11)])
+        wallet = Wallet.objects.get(profile=self.buyer.profile)
+        self.assertEqual((wallet.available_dollar, wallet.frozen_dollar), (to_cents(100 - 5 - 5.5), 0))
+
+    def test_immediate_or_cancel(self):
+        Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        data = {'price': 10, 'quantity': 1, 'type': 'B', 'time_in_force': 'IOC'}
+        response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        buy_order = Order.objects.get(profile=self.buyer.profile)
+        self.assertEqual((buy_order.status, buy_order.quantity), (False, to_satoshi(0.5)))
+        self.assertEqual(len(order_book.bids), 0)
+        self.assertEqual(Wallet.objects.get(profile=self.buyer.profile).frozen_dollar, 0)
+
+    def test_fill_or_kill(self):
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        data = {'price': 10, 'quantity': 1, 'type': 'B', 'time_in_force': 'FOK'}
+        response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Order.objects.filter(profile=self.buyer.profile).exists())
+        self.assertFalse(Fill.objects.exists())
+        self.assertTrue(Order.objects.get(pk=sell_order.pk).status)
+        wallet = Wallet.objects.get(profile=self.buyer.profile)
+        self.assertEqual((wallet.available_dollar, wallet.frozen_dollar), (to_cents(100), 0))
+
+    def test_stop_order(self):
+        trader = User.objects.create_user(username='trader', password='Change_me_123!')
+        Wallet.objects.filter(profile=trader.profile).update(available_bitcoin=to_satoshi(10))
+        stop_order = Order.objects.create(
+            profile=self.seller.profile, price=0, quantity=to_satoshi(1), type='S', kind='stop', stop_price=to_cents(9)
+        )
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(9), quantity=to_satoshi(0.5), type='B')
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(8), quantity=to_satoshi(1), type='B')
+        self.assertEqual(len(order_book.asks), 0)  # Waiting stop orders are not in the book
+        self.assertEqual(Order.objects.get(pk=stop_order.pk).filled_quantity, 0)
+
+        # The print at 9 triggers the stop order
+        Order.objects.create(profile=trader.profile, price=to_cents(9), quantity=to_satoshi(0.5), type='S')
+        stop_order.refresh_from_db()
+        self.assertEqual((stop_order.kind, stop_order.status), ('market', False))
+        self.assertEqual(stop_order.filled_quantity, to_satoshi(1))
+        self.assertEqual(Fill.objects.get(sell_order=stop_order).price, to_cents(8))
+
+    def test_cancel_stop_order(self):
+        data = {'price': 20, 'quantity': 1, 'type': 'B', 'kind': 'stop_limit', 'stop_price': 15}
+        response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Wallet.objects.get(profile=self.buyer.profile).frozen_dollar, to_cents(20))
+        response = self.client.delete(reverse('orders-detail', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Wallet.objects.get(profile=self.buyer.profile).frozen_dollar, 0)
+        self.assertEqual(len(trigger_book.buys), 0)
+
+
+class MultiMarketTestCase(APITestCase):
+    """
+    Instruments, asset balances and sharded matching test case.
+
+    :tests
+    - test_trade_asset_balances(): An ETH-USD trade moves the ETH balances and leaves the BTC-USD book untouched.
+    - test_quote_asset_prices(): ETH-BTC prices are in bitcoins and freeze bitcoins.
+    - test_insufficient_asset_balance(): Selling more ETH than available is rejected.
+    - test_cancel_symbol(): Canceling a price range only cancels the orders of the symbol.
+    - test_profile_balances(): The profile shows the balances of the other assets.
+    - test_sharded_queues(): The events of each symbol are queued for the shard that owns its book.
+    """
+
+    def setUp(self):
+        reset_order_books()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        Wallet.objects.filter(profile=self.buyer.profile).update(available_dollar=to_cents(1000), available_bitcoin=to_satoshi(1))
+        Balance.objects.filter(profile=self.seller.profile, asset='ETH').update(available=to_satoshi(10))
+        self.list_url = reverse('orders-list')
+        self.token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        reset_order_books()
+        for book in trigger_books.values():
+            book.reset()
+
+    def test_trade_asset_balances(self):
+        Order.objects.create(profile=self.seller.profile, symbol='ETH-USD', price=to_cents(100), quantity=to_satoshi(2), type='S')
+        Wallet.objects.filter(profile=self.seller.profile).update(available_bitcoin=to_satoshi(1))
+        Order.objects.create(profile=self.seller.profile, price=to_cents(90), quantity=to_satoshi(1), type='S')
+        data = {'symbol': 'ETH-USD', 'price': 100, 'quantity': 1.5, 'type': 'B'}
+        response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Fill.objects.get().symbol, 'ETH-USD')
+        seller_balance = Balance.objects.get(profile=self.seller.profile, asset='ETH')
+        buyer_balance = Balance.objects.get(profile=self.buyer.profile, asset='ETH')
+        self.assertEqual((seller_balance.available, seller_balance.frozen), (to_satoshi(8), to_satoshi(0.5)))
+        self.assertEqual((buyer_balance.available, buyer_balance.frozen), (to_satoshi(1.5), 0))
+        buyer_wallet = Wallet.objects.get(profile=self.buyer.profile)
+        self.assertEqual((buyer_wallet.available_dollar, buyer_wallet.available_bitcoin), (to_cents(850), to_satoshi(1)))
+        self.assertEqual(Wallet.objects.get(profile=self.seller.profile).available_dollar, to_cents(150))
+        self.assertEqual(len(order_books['ETH-USD'].asks), 1)
+        self.assertEqual(len(order_books['BTC-USD'].asks), 1)
+
+    def test_quote_asset_prices(self):
+        data = {'symbol': 'ETH-BTC', 'price': 0.05, 'quantity': 4, 'type': 'B'}
+        response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['price'], 0.05)
+        self.assertEqual(Order.objects.get(pk=response.data['id']).price, to_satoshi(0.05))
+        wallet = Wallet.objects.get(profile=self.buyer.profile)
+        self.assertEqual((wallet.available_bitcoin, wallet.frozen_bitcoin), (to_satoshi(0.8), to_satoshi(0.2)))
+        self.assertEqual(wallet.frozen_dollar, 0)
+
+    def test_insufficient_asset_balance(self):
+        token = Token.objects.create(user=self.seller)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        data = {'symbol': 'ETH-USD', 'price': 100, 'quantity': 11, 'type': 'S'}
+        response = self.client.post(self.list_url, data=data)  # Ex. URL: http://127.0.0.1/api/orders/
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Balance.objects.get(profile=self.seller.profile, asset='ETH').frozen, 0)
+
+    def test_cancel_symbol(self):
+        Order.objects.create(profile=self.buyer.profile, symbol='ETH-USD', price=to_cents(10), quantity=to_satoshi(1), type='B')
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(10), quantity=to_satoshi(1), type='B')
+        data = {'symbol': 'ETH-USD', 'type': 'B'}
+        response = self.client.post(reverse('orders-cancel'), data=data)  # Ex. URL: http://127.0.0.1/api/orders/cancel/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(Order.objects.values_list('symbol', flat=True)), ['BTC-USD'])
+        self.assertEqual(len(order_books['ETH-USD'].bids), 0)
+        self.assertEqual(len(order_books['BTC-USD'].bids), 1)
+
+    def test_profile_balances(self):
+        token = Token.objects.create(user=self.seller)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.get(reverse('profile-detail'))  # Ex. URL: http://127.0.0.1/api/profile/
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balances'], {'ETH': 10})
+
+    def test_sharded_queues(self):
+        queue_dir = tempfile.TemporaryDirectory()
+        queue_path = os.path.join(queue_dir.name, 'queue.sqlite3')
+        with self.settings(EXCHANGE_MATCHING_ENGINE=True, EXCHANGE_QUEUE_PATH=queue_path, EXCHANGE_MATCHING_SHARDS=2):
+            sequencer._order_queues.clear()
+            try:
+                btc_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(10), quantity=to_satoshi(1), type='B')
+                eth_order = Order.objects.create(profile=self.buyer.profile, symbol='ETH-USD', price=to_cents(10), quantity=to_satoshi(1), type='B')
+                self.assertNotEqual(get_shard('BTC-USD', 2), get_shard('ETH-USD', 2))
+                self.assertEqual([event[2] for event in sequencer.get_symbol_queue('BTC-USD').pending()], [btc_order.pk])
+                self.assertEqual([event[2] for event in sequencer.get_symbol_queue('ETH-USD').pending()], [eth_order.pk])
+                self.assertTrue(os.path.exists(queue_path[:-len('.sqlite3')] + '-1.sqlite3'))
+                call_command('run_matching_engine', once=True, shard=1, stdout=io.StringIO())
+                self.assertEqual(sequencer.get_symbol_queue('ETH-USD').pending(), [])
+                self.assertEqual(len(sequencer.get_symbol_queue('BTC-USD').pending()), 1)
+            finally:
+                sequencer._order_queues.clear()
+                queue_dir.cleanup()
+
+
+class MatchingEngineTestCase(APITestCase):
+    """
+    Matching engine test case.
+
+    :tests
+    - test_orders_matched_in_sequence(): Queued orders are matched only when the engine processes them.
+    - test_cancel_order_queued(): Canceling an order is queued and performed by the engine.
+    - test_fills_pruned(): Only the last published fills are kept in the queue file.
+    - test_failed_event_skipped(): A failing event is acknowledged, the funds of its order are released.
+    """
+
+    def setUp(self):
+        order_book.reset()
+        self.queue_dir = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(
+            EXCHANGE_MATCHING_ENGINE=True,
+            EXCHANGE_QUEUE_PATH=os.path.join(self.queue_dir.name, 'queue.sqlite3')
+        )
+        self.settings_override.enable()
+        sequencer._order_queues.clear()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        self.seller.profile.wallet.available_bitcoin = to_satoshi(10)
+        self.seller.profile.wallet.save()
+        self.buyer.profile.wallet.available_dollar = to_cents(100)
+        self.buyer.profile.wallet.save()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        sequencer._order_queues.clear()
+        self.queue_dir.cleanup()
+        order_book.reset()
+
+    def test_orders_matched_in_sequence(self):
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        buy_order = Order.objects.create(profile=self.buyer.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='B')
+        self.assertEqual(Order.objects.filter(status=True).count(), 2)
+        call_command('run_matching_engine', once=True, stdout=io.StringIO())
+        self.assertEqual(Order.objects.filter(status=True).count(), 0)
+        fills = sequencer.get_order_queue().fills()
+        self.assertEqual(len(fills), 1)
+        self.assertEqual(fills[0]['buy_order_id'], buy_order.pk)
+        self.assertEqual(fills[0]['sell_order_id'], sell_order.pk)
+
+    def test_cancel_order_queued(self):
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        token = Token.objects.create(user=self.seller)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.delete(reverse('orders-detail', kwargs={'pk': sell_order.pk}))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(Order.objects.filter(pk=sell_order.pk).exists())
+        call_command('run_matching_engine', once=True, stdout=io.StringIO())
+        self.assertFalse(Order.objects.filter(pk=sell_order.pk).exists())
+
+    def test_fills_pruned(self):
+        queue = sequencer.OrderQueue(os.path.join(self.queue_dir.name, 'pruned.sqlite3'), fills_kept=3)
+        for seq in range(1, 6):
+            fill = Fill(transaction_id=seq, buy_order_id=1, sell_order_id=2, price=to_cents(10), quantity=seq)
+            queue.ack(queue.put(sequencer.NEW_ORDER, seq), [fill, fill])
+        self.assertEqual([fill['quantity'] for fill in queue.fills()], [4, 5, 5])
+        self.assertEqual(queue.pending(), [])
+
+    def test_failed_event_skipped(self):
+        failed_order = Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        sell_order = Order.objects.create(profile=self.seller.profile, price=to_cents(11), quantity=to_satoshi(0.5), type='S')
+        submit_order = sequencer.submit_order
+
+        def failing_submit_order(order):
+            if order.pk == failed_order.pk:
+                raise InsufficientBalance('insufficient balance')
+            return submit_order(order)
+
+        stderr = io.StringIO()
+        with mock.patch.object(sequencer, 'submit_order', failing_submit_order):
+            call_command('run_matching_engine', once=True, stdout=io.StringIO(), stderr=stderr)
+        self.assertIn(f'new order {failed_order.pk}) failed', stderr.getvalue())
+        self.assertEqual(sequencer.get_order_queue().pending(), [])
+        self.assertFalse(Order.objects.filter(pk=failed_order.pk).exists())
+        self.assertEqual(Wallet.objects.get(profile=self.seller.profile).frozen_bitcoin, to_satoshi(0.5))
+        self.assertEqual([order.pk for order in order_book.asks], [sell_order.pk])
+
+
+class ProvisioningTestCase(APITestCase):
+    """
+    User provisioning test case.
+
+    :tests
+    - test_create_user(): A new user gets a profile and a wallet with the net balance set.
+    - test_bulk_create_users(): Users created in bulk get a profile and a wallet each.
+    """
+
+    def test_create_user(self):
+        user = User.objects.create_user(username='testcase', password='Change_me_123!')
+        wallet = Wallet.objects.get(profile__user=user)
+        self.assertEqual(wallet.bitcoin_net_balance, wallet.available_bitcoin)
+        self.assertTrue(to_satoshi(1) <= wallet.available_bitcoin <= to_satoshi(10))
+
+    def test_bulk_create_users(self):
+        call_command('bulk_create_users', 5, prefix='load', batch_size=2, stdout=io.StringIO())
+        users = User.objects.filter(username__startswith='load')
+        self.assertEqual(users.count(), 5)
+        self.assertTrue(self.client.login(username='load3', password='Change_me_123!'))
+        wallets = Wallet.objects.filter(profile__user__in=users)
+        self.assertEqual(wallets.count(), 5)
+        for wallet in wallets:
+            self.assertEqual(wallet.bitcoin_net_balance, wallet.available_bitcoin)
+
+
+class BenchmarkTestCase(APITestCase):
+    """
+    Benchmark harness test case.
+
+    :tests
+    - test_order_flow(): The same seed gives the same flow and passive orders do not cross the spread.
+    - test_run_benchmark(): Orders are submitted through the ORM and matched.
+    - test_run_benchmark_api(): Orders are submitted through the REST endpoint.
+    """
+
+    def setUp(self):
+        order_book.reset()
+
+    def tearDown(self):
+        order_book.reset()
+
+    def test_order_flow(self):
+        flow = OrderFlow(match_ratio=0, seed=1)
+        orders = list(flow.orders(100))
+        self.assertEqual(orders, list(OrderFlow(match_ratio=0, seed=1).orders(100)))
+        for order_type, price, quantity in orders:
+            if order_type == 'B':
+                self.assertLess(price, flow.mid_price)
+            else:
+                self.assertGreater(price, flow.mid_price)
+        self.assertEqual(percentile([3, 1, 2, 4], 50), 2)
+        self.assertEqual(percentile([3, 1, 2, 4], 99), 4)
+
+    def test_run_benchmark(self):
+        stats = run_benchmark(OrderFlow(depth=5, match_ratio=1, seed=1), 20, traders=2)
+        self.assertEqual(stats['orders'], 20)
+        self.assertGreater(stats['executed_orders'], 0)
+
+    def test_run_benchmark_api(self):
+        stats = run_benchmark(OrderFlow(depth=5, match_ratio=0, seed=1), 5, mode='api', traders=2)
+        self.assertEqual(stats['executed_orders'], 0)
+        self.assertGreater(stats['queries_per_order'], 0)
+
+
+class InstrumentationTestCase(APITestCase):
+    """
+    Request instrumentation test case.
+
+    :tests
+    - test_server_timing(): Instrumented responses have a Server-Timing header with the query count.
+    - test_metrics(): The metrics endpoint renders per-view histograms, only if the instrumentation is enabled.
+    """
+
+    def setUp(self):
+        order_book.reset()
+        registry.clear()
+        self.user = User.objects.create_user(username='testcase', password='Change_me_123!')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        order_book.reset()
+        registry.clear()
+
+    def get_client(self):
+        # The middleware is loaded by the first request of each client
+        client = self.client_class()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return client
+
+    def test_server_timing(self):
+        with self.settings(EXCHANGE_INSTRUMENTATION=True):
+            client = self.get_client()
+            response = client.post(reverse('orders-list'), data={'price': 10, 'quantity': 0.5, 'type': 'S'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+        self.assertIn('matching;dur=', response['Server-Timing'])
+        response = self.client.get(reverse('profile-detail'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_metrics(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        with self.settings(EXCHANGE_INSTRUMENTATION=True):
+            client = self.get_client()
+            client.get(reverse('profile-detail'))
+            response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode()
+        self.assertIn('# TYPE exchange_request_queries histogram', content)
+        self.assertIn('exchange_request_duration_seconds_count{view="profile-detail",method="GET"} 1', content)
+
+
+class EventLogTestCase(APITestCase):
+    """
+    Event log test case.
+
+    :tests
+    - test_replay(): The state rebuilt from the log matches the database after trades and cancellations.
+    - test_snapshot(): Only the tail of the log is replayed after a snapshot.
+    - test_torn_record(): An incomplete record at the tail of the log is ignored.
+    - test_replay_asset_balances(): The balances of the assets that are not in the wallet are replayed.
+    - test_replay_symbols(): The orders of each instrument are kept in their own book, in the snapshots too.
+    """
+
+    def setUp(self):
+        order_book.reset()
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.log_dir.name, 'events.log')
+        self.snapshot_dir = os.path.join(self.log_dir.name, 'snapshots')
+        self.settings_override = self.settings(
+            EXCHANGE_EVENT_LOG=True, EXCHANGE_EVENT_LOG_PATH=self.log_path, EXCHANGE_SNAPSHOT_DIR=self.snapshot_dir
+        )
+        self.settings_override.enable()
+        self.seller = User.objects.create_user(username='seller', password='Change_me_123!')
+        self.buyer = User.objects.create_user(username='buyer', password='Change_me_123!')
+        update_wallet(self.buyer.profile.pk, {'available_dollar': to_cents(1000)})
+        # The initial bitcoin balance is random, at least 1 bitcoin
+        update_wallet(self.seller.profile.pk, {'available_bitcoin': to_satoshi(5)})
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.log_dir.cleanup()
+        order_book.reset()
+
+    def assertStateMatchesDatabase(self):
+        state, count = load_state(self.log_path, self.snapshot_dir)
+        database_state = ExchangeState.from_database(state.offset)
+        self.assertEqual(state.orders, database_state.orders)
+        self.assertEqual(state.wallets, database_state.wallets)
+        self.assertEqual(state.balances, database_state.balances)
+        return state, count
+
+    def test_replay(self):
+        for price, quantity in ((10, 0.5), (11, 1), (12, 1)):
+            Order.objects.create(profile=self.seller.profile, price=to_cents(price), quantity=to_satoshi(quantity), type='S')
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(11), quantity=to_satoshi(1), type='B')
+        cancel_order(Order.objects.get(price=to_cents(11), type='S'))
+        state, count = self.assertStateMatchesDatabase()
+        self.assertEqual(list(state.orders['BTC-USD']), [Order.objects.get(price=to_cents(12)).pk])
+
+    def test_snapshot(self):
+        Order.objects.create(profile=self.seller.profile, price=to_cents(10), quantity=to_satoshi(0.5), type='S')
+        call_command('snapshot_event_log', stdout=io.StringIO())
+        Order.objects.create(profile=self.buyer.profile, price=to_cents(10), quantity=to_satoshi(0.2), type='B')
+        state, count = self.assertStateMatchesDatabase()
+        self.assertEqual(count, 8)  # Freeze, order, fill and the balances changed by the trade
+        self.assertEqual(state.offset, os.path.getsize(self.log_path))
+
+    def test_torn_record(self):
+        with open(self.log_path, 'ab') as log_file:
+            log_file.write(b'torn')
+        state, count = self.assertStateMatchesDatabase()
+        self.assertEqual(state.offset, os.path.getsize(self.log_path) - 4)
+
+    def test_replay_asset_balances(self):
+        update_wallet(self.seller.profile.pk, {'available_eth': to_satoshi(5)})
+        Order.objects.create(profile=self.seller.profile, symbol='ETH-USD', price=to_cents(100), quantity=to_satoshi(2), type='S')
+        Order.objects.create(profile=self.buyer.profile, symbol='ETH-USD', price=to_cents(100), quantity=to_satoshi(1), type='B')
+        state, count = self.assertStateMatchesDatabase()
+        self.assertEqual(len(state.balances), 2)  # ETH of the seller, ETH of the buyer
+
+    def test_replay_symbols(self):
+        update_wallet(self.seller.profile.pk, {'available_eth': to_satoshi(5)})
+        eth_order = Order.objects.create(profile=self.seller.profile, symbol='ETH-USD', price=to_cents(100), quantity=to_satoshi(2), type='S')
+        btc_order = Order.objects.create(profile=self.seller.profile, price=to_cents(100), quantity=to_satoshi(1), type='S')
+        call_command('snapshot_event_log', stdout=io.StringIO())
+        Order.objects.create(profile=self.buyer.profile, symbol='ETH-USD', price=to_cents(100), quantity=to_satoshi(1), type='B')
+        state, count = self.assertStateMatchesDatabase()
+        self.assertEqual(list(state.orders['BTC-USD']), [btc_order.pk])
+        self.assertEqual(list(state.orders['ETH-USD']), [eth_order.pk])
+        self.assertEqual(state.orders['ETH-USD'][eth_order.pk][4], to_satoshi(1))
+
+
+class AsyncAPITestCase(APITransactionTestCase):
+    """
+    Async API test case, the ASGI application is called directly.
+    The reads run in other threads, the data is committed.
+
+    :tests
+    - test_not_authenticated(): Requests without a valid token are rejected.
+    - test_inactive_user(): Requests of a deactivated user or of a user without profile are rejected.
+    - test_retrieve_profile(): Same response of ProfileAPIView.
+    - test_list_latest_orders(): Same response of LatestOrdersListAPIView.
+    - test_create_order(): The order is created and its amount frozen.
+    - test_create_order_insufficient_balance()
+    - test_unknown_path()
+    """
+
+    def setUp(self):
+        order_book.reset()
+        self.user = User.objects.create_user(username='testcase1', password='Change_me_123!')
+        self.token = Token.objects.create(user=self.user)
+
+    def tearDown(self):
+        order_book.reset()
+
+    def request(self, method, path, data=None, token=None):
+        """
+        Send a request to the async API.
+
+        :return
+        - Tuple (status code, decoded JSON body).
+        """
+
+        token = self.token.key if token is None else token
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': f'/api/async/{path}',
+            'headers': [(b'authorization', f'Token {token}'.encode()), (b'content-type', b'application/json')],
+        }
+        messages = [{'type': 'http.request', 'body': json.dumps(data).encode() if data is not None else b''}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(async_api_application(scope, receive, send))
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    def test_not_authenticated(self):
+        status_code, data = self.request('GET', 'profile/', token='invalid')
+        self.assertEqual(status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        status_code, data = self.request('GET', 'profile/')
+        self.assertEqual(status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_active = True
+        self.user.save()
+        status_code, data = self.request('GET', 'profile/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        Profile.objects.filter(user=self.user).delete()
+        # The authentication is cached
+        status_code, data = self.request('GET', 'profile/')
+        self.assertEqual(status_code, status.HTTP_404_NOT_FOUND)
+        get_token_cache().clear()
+        status_code, data = self.request('GET', 'orders/latest/')
+        self.assertEqual(status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_retrieve_profile(self):
+        Order.objects.create(profile=self.user.profile, price=to_cents(5.5), quantity=to_satoshi(0.5), type='S')
+        status_code, data = self.request('GET', 'profile/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        profile = Profile.objects.select_related('user', 'wallet').get(user=self.user)
+        self.assertEqual(data, json.loads(json.dumps(ProfileSerializer(profile).data)))
+        self.assertEqual(data['active_orders'], 1)
+
+    def test_list_latest_orders(self):
+        user = User.objects.create_user(username='testcase2', password='Change_me_123!')
+        Order.objects.create(profile=self.user.profile, price=to_cents(5.5), quantity=to_satoshi(0.5), type='S')
+        order = Order.objects.create(profile=user.profile, price=to_cents(10.5), quantity=to_satoshi(0.5), type='S')
+        status_code, data = self.request('GET', 'orders/latest/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['id'], order.pk)
+        self.assertEqual(data[0]['price'], 10.5)
+
+    def test_create_order(self):
+        status_code, data = self.request('POST', 'orders/', {'price': 5.5, 'quantity': 0.5, 'type': 'S'})
+        self.assertEqual(status_code, status.HTTP_201_CREATED)
+        self.assertEqual(data['price'], 5.5)
+        self.assertTrue(data['status'])
+        wallet = Wallet.objects.get(profile=self.user.profile)
+        self.assertEqual(wallet.frozen_bitcoin, to_satoshi(0.5))
+
+    def test_create_order_insufficient_balance(self):
+        status_code, data = self.request('POST', 'orders/', {'price': 5.5, 'quantity': 100, 'type': 'B'})
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', data)
+        self.assertFalse(Order.objects.exists())
+
+    def test_unknown_path(self):
+        status_code, data = self.request('GET', 'wallet/')
+        self.assertEqual(status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ASGIApplicationTestCase(APITransactionTestCase):
+    """
+    ASGI entry point test case, the application routes each scope to the application that serves it.
+
+    :tests
+    - test_http(): HTTP requests are served by Django.
+    - test_websocket(): WebSocket connections are served by the market data application.
+    - test_websocket_inactive_user(): WebSocket connections of inactive users are rejected.
+    - test_async_api(): HTTP requests under the async API prefix are served by the async API application.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testcase1', password='Change_me_123!')
+        self.token = Token.objects.create(user=self.user)
+
+    def call(self, scope, messages):
+        """
+        Run the ASGI application with the given incoming messages.
+
+        :return
+        - List of the messages sent by the application.
+        """
+
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(application(scope, receive, send))
+        return sent
+
+    def http_request(self, path):
+        """
+        Send a GET request to the ASGI application.
+
+        :return
+        - Tuple (status code, decoded JSON body).
+        """
+
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': 'GET',
+            'path': path,
+            'query_string': b'',
+            'headers': [(b'authorization', f'Token {self.token.key}'.encode())],
+        }
+        sent = self.call(scope, [{'type': 'http.request', 'body': b''}])
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        return sent[0]['status'], json.loads(body)
+
+    def test_http(self):
+        status_code, data = self.http_request(reverse('profile-detail'))  # Ex. URL: http://127.0.0.1/api/profile/
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(data['user'], 'testcase1')
+
+    def test_websocket(self):
+        scope = {'type': 'websocket', 'path': '/ws/market/', 'query_string': f'token={self.token.key}'.encode()}
+        sent = self.call(scope, [{'type': 'websocket.connect'}, {'type': 'websocket.disconnect', 'code': 1000}])
+        self.assertEqual(sent, [{'type': 'websocket.accept'}])
+        scope['query_string'] = b'token=invalid'
+        sent = self.call(scope, [{'type': 'websocket.connect'}])
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4001}])
+
+    def test_websocket_inactive_user(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        scope = {'type': 'websocket', 'path': '/ws/market/', 'query_string': f'token={self.token.key}'.encode()}
+        sent = self.call(scope, [{'type': 'websocket.connect'}])
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4001}])
+
+    def test_async_api(self):
+        Order.objects.create(profile=self.user.profile, price=to_cents(5.5), quantity=to_satoshi(0.5), type='S')
+        with mock.patch('exchange.api.views.ProfileAPIView.get') as django_view:
+            status_code, data = self.http_request('/api/async/profile/')
+            self.assertFalse(django_view.called)
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(data['active_orders'], 1)
+        status_code, data = self.http_request('/api/async/orders/latest/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(data, [])
+        status_code, data = self.http_request('/api/async/wallet/')
+        self.assertEqual(status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CachedTokenAuthenticationTestCase(APITestCase):
+    """
+    CachedTokenAuthentication test case.
+
+    :tests
+    - test_cached_authentication(): Only the first request of a token queries the user, profile and wallet.
+    - test_logout(): A deleted token is not authenticated anymore.
+    - test_inactive_user(): The token of a deactivated user is not authenticated anymore.
+    - test_cache_bounds(): The least recently used and the expired entries are discarded.
+    - test_revoked_in_other_process(): A token deleted or a user changed by another process is not authenticated anymore.
+    """
+
+    def setUp(self):
+        get_token_cache().clear()
+        order_book.reset()
+        self.user = User.objects.create_user(username='testcase1', password='Change_me_123!')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.list_url = reverse('orders-latest')
+
+    def test_cached_authentication(self):
+        with CaptureQueriesContext(connection) as first_queries:
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as cached_queries:
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(cached_queries), len(first_queries) - 1)
+
+        response = self.client.post(reverse('orders-list'), {'price': 5.5, 'quantity': 0.5, 'type': 'S'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['profile'], 'testcase1')
+        self.assertEqual(Order.objects.get().profile_id, self.user.profile.pk)
+
+    def test_logout(self):
+        self.client.get(self.list_url)
+        self.token.delete()
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_user(self):
+        self.client.get(self.list_url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cache_bounds(self):
+        token_cache = TokenCache(max_size=2, timeout=60)
+        for key in ('a', 'b', 'c'):
+            token_cache.set(key, self.user, 1, 1)
+        self.assertIsNone(token_cache.get('a'))
+        self.assertEqual(token_cache.get('c').user_id, self.user.pk)
+
+        token_cache = TokenCache(max_size=2, timeout=0)
+        token_cache.set('a', self.user, 1, 1)
+        self.assertIsNone(token_cache.get('a'))
+
+    def test_revoked_in_other_process(self):
+        # The cache of another process, only the Django cache is shared
+        token_cache = TokenCache(max_size=10, timeout=60)
+        token_cache.set(self.token.key, self.user, 1, 1)
+        token_cache.set('other', self.user, 1, 1)
+        self.assertIsNotNone(token_cache.get(self.token.key))
+        self.token.delete()
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertIsNotNone(token_cache.get('other'))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(token_cache.get('other'))
+        token_cache.set('other', self.user, 1, 1)
+        self.assertIsNotNone(token_cache.get('other'))
+
+
+class AdmissionControlTestCase(APITestCase):
+    """
+    Throttling, open orders limit and admission queue test case.
+
+    :tests
+    - test_throttle(): Requests beyond the burst of an endpoint are throttled, the other endpoints are not.
+    - test_open_orders_limit()
+    - test_open_orders_reserved(): The slots held by a request in progress count for the limit, and are released after it.
+    - test_admission_queue(): Requests wait in FIFO order and are rejected when the queue is full or they time out.
+    - test_exchange_busy(): New orders are rejected while every slot is taken.
+    """
+
+    def setUp(self):
+        order_book.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'admission.sqlite3')
+        self.settings_override = self.settings(
+            EXCHANGE_ADMISSION_CONTROL=True, EXCHANGE_ADMISSION_PATH=self.path,
+            EXCHANGE_THROTTLE_RATES={'orders': (0.01, 2)}, EXCHANGE_ADMISSION_TIMEOUT=0.05
+        )
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='testcase1', password='Change_me_123!')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.data = {'price': 5.5, 'quantity': 0.1, 'type': 'S'}
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.directory.cleanup()
+        order_book.reset()
+
+    def test_throttle(self):
+        for _ in range(2):
+            response = self.client.post(reverse('orders-list'), self.data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('orders-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        response = self.client.get(reverse('orders-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_open_orders_limit(self):
+        with self.settings(EXCHANGE_MAX_OPEN_ORDERS=1):
+            response = self.client.post(reverse('orders-list'), self.data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response = self.client.post(reverse('orders-list'), self.data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(Order.objects.count(), 1)
+
+    def test_open_orders_reserved(self):
+        profile = self.user.profile
+        with self.settings(EXCHANGE_MAX_OPEN_ORDERS=2):
+            with open_orders(profile):
+                with self.assertRaises(OpenOrdersLimit):
+                    with open_orders(profile, 2):
+                        pass
+                with self.assertRaises(ValueError):
+                    with open_orders(profile):
+                        raise ValueError
+                response = self.client.post(reverse('orders-list'), self.data)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                response = self.client.post(reverse('orders-list'), self.data)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        profile.refresh_from_db()
+        self.assertEqual(profile.active_orders, 1)
+
+    def test_admission_queue(self):
+        store = AdmissionStore(self.path)
+        ticket = store.acquire(slots=1, queue_size=1, timeout=0.05, lease=30)
+        with self.assertRaises(AdmissionRejected):
+            store.acquire(slots=1, queue_size=1, timeout=0.05, lease=30)
+        with self.assertRaises(AdmissionRejected):
+            store.acquire(slots=1, queue_size=0, timeout=1, lease=30)
+        store.release(ticket)
+        store.release(store.acquire(slots=1, queue_size=1, timeout=0.05, lease=30))
+
+    def test_exchange_busy(self):
+        store = AdmissionStore(self.path)
+        tickets = [store.acquire(slots=8, queue_size=1, timeout=0, lease=30) for _ in range(8)]
+        response = self.client.post(reverse('orders-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(Order.objects.exists())
+        for ticket in tickets:
+            store.release(ticket)
+        response = self.client.post(reverse('orders-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class BrokerTestCase(SimpleTestCase):
+    """
+    In-process broker test case.
+
+    :tests
+    - test_publish_from_thread(): Messages published from another thread reach the subscribers of the channel.
+    - test_slow_subscriber(): Publishing never blocks, messages are dropped for a full queue.
+    """
+
+    def test_publish_from_thread(self):
+        async def scenario():
+            broker = Broker()
+            subscription = broker.subscribe(['trades'])
+            other_subscription = broker.subscribe(['book'])
+            thread = threading.Thread(target=broker.publish, args=('trades', {'price': 10}))
+            thread.start()
+            thread.join()
+            message = await asyncio.wait_for(subscription.get(), timeout=1)
+            self.assertEqual(message, {'price': 10})
+            self.assertTrue(other_subscription.queue.empty())
+            broker.unsubscribe(subscription)
+            broker.unsubscribe(other_subscription)
+            self.assertFalse(broker.has_subscribers())
+
+        asyncio.run(scenario())
+
+    def test_slow_subscriber(self):
+        async def scenario():
+            broker = Broker(max_queue_size=2)
+            subscription = broker.subscribe(['trades'])
+            for price in range(5):
+                broker.publish('trades', {'price': price})
+            await asyncio.sleep(0)
+            self.assertEqual(subscription.queue.qsize(), 2)
+            self.assertEqual(subscription.dropped, 3)
+
+        asyncio.run(scenario())
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from exchange.models import Profile
+from exchange.utils.bulk import get_collection
+from exchange.utils.profile_stats import update_order_counters
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admissions (
+    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+    running INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Seconds between two polls of a request waiting in the admission queue
+POLL_INTERVAL = 0.01
+
+# Seconds after which an idle bucket is removed, it would be full again anyway
+BUCKET_IDLE_TIMEOUT = 3600
+PRUNE_EVERY = 1000
+
+
+class AdmissionRejected(Exception):
+    """
+    The admission queue is full, or the request waited too long for a slot.
+    """
+
+
+class OpenOrdersLimit(Exception):
+    """
+    The profile would have more active orders than 'EXCHANGE_MAX_OPEN_ORDERS'.
+    """
+
+
+class AdmissionStore:
+    """
+    File-backed token buckets and admission queue, shared by every process on the host.
+
+    :argument
+    - path: Path of the SQLite file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pid = None
+        self._takes = 0
+
+    @property
+    def connection(self):
+        # Each process, e.g. each gunicorn worker, needs its own connection
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def take(self, key, rate, capacity, cost=1):
+        """
+        Take tokens from a bucket refilled at a constant rate.
+
+        :argument
+        - key: Name of the bucket, e.g. a user and an endpoint.
+        - rate: Tokens added per second.
+        - capacity: Maximum tokens, the burst allowed after an idle period.
+        - cost: Tokens needed.
+
+        :return
+        - Tuple (True if the tokens were taken, seconds to wait for them otherwise).
+        """
+
+        now = time.time()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                                    (key, tokens, now))
+
+        self._takes += 1
+        if self._takes % PRUNE_EVERY == 0:
+            self.connection.execute('DELETE FROM buckets WHERE updated < ?', (now - BUCKET_IDLE_TIMEOUT,))
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def acquire(self, slots, queue_size, timeout, lease):
+        """
+        Wait in FIFO order for one of the slots shared by every process.
+
+        :argument
+        - slots: Maximum number of requests admitted at the same time.
+        - queue_size: Maximum number of requests waiting, the next ones are rejected at once.
+        - timeout: Seconds a request waits before being rejected.
+        - lease: Seconds after which the slot or the ticket of a crashed worker is released.
+
+        :return
+        - Ticket to release.
+
+        :raise
+        - AdmissionRejected
+        """
+
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('DELETE FROM admissions WHERE updated < ?', (time.time() - lease,))
+            waiting, = self.connection.execute('SELECT COUNT(*) FROM admissions WHERE running = 0').fetchone()
+            if waiting >= queue_size:
+                raise AdmissionRejected('the exchange is busy, retry later')
+            ticket = self.connection.execute('INSERT INTO admissions (running, updated) VALUES (0, ?)',
+                                             (time.time(),)).lastrowid
+
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.connection:
+                self.connection.execute('BEGIN IMMEDIATE')
+                now = time.time()
+                self.connection.execute('DELETE FROM admissions WHERE updated < ?', (now - lease,))
+                running, = self.connection.execute('SELECT COUNT(*) FROM admissions WHERE running = 1').fetchone()
+                ahead, = self.connection.execute(
+                    'SELECT COUNT(*) FROM admissions WHERE running = 0 AND ticket < ?', (ticket,)
+                ).fetchone()
+                admitted = running < slots and ahead == 0
+                self.connection.execute('UPDATE admissions SET running = ?, updated = ? WHERE ticket = ?',
+                                        (int(admitted), now, ticket))
+            if admitted:
+                return ticket
+            if time.monotonic() >= deadline:
+                self.release(ticket)
+                raise AdmissionRejected('the exchange is busy, retry later')
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, ticket):
+        self.connection.execute('DELETE FROM admissions WHERE ticket = ?', (ticket,))
+
+
+_admission_store = None
+
+
+def get_admission_store():
+    """
+    Return the admission store of the current process.
+    """
+
+    global _admission_store
+    if _admission_store is None or _admission_store.path != settings.EXCHANGE_ADMISSION_PATH:
+        _admission_store = AdmissionStore(settings.EXCHANGE_ADMISSION_PATH)
+    return _admission_store
+
+
+def take_request(user_id, scope, endpoint):
+    """
+    Take a token from the bucket of a user and an endpoint, if the admission control is enabled and
+    the scope has a rate in 'EXCHANGE_THROTTLE_RATES'.
+
+    :return
+    - Seconds to wait before the request is allowed, 0 if it is allowed.
+    """
+
+    rate = settings.EXCHANGE_THROTTLE_RATES.get(scope)
+    if not settings.EXCHANGE_ADMISSION_CONTROL or rate is None:
+        return 0
+    allowed, wait = get_admission_store().take(f'{scope}:{endpoint}:{user_id}', *rate)
+    return wait
+
+
+@contextmanager
+def admission():
+    """
+    Run a block in one of the 'EXCHANGE_ADMISSION_SLOTS', if the admission control is enabled.
+    Requests wait in a bounded queue, so the matching path of the host is never flooded.
+
+    :raise
+    - AdmissionRejected
+    """
+
+    if not settings.EXCHANGE_ADMISSION_CONTROL:
+        yield
+        return
+
+    store = get_admission_store()
+    ticket = store.acquire(settings.EXCHANGE_ADMISSION_SLOTS, settings.EXCHANGE_ADMISSION_QUEUE_SIZE,
+                           settings.EXCHANGE_ADMISSION_TIMEOUT, settings.EXCHANGE_ADMISSION_LEASE)
+    try:
+        yield
+    finally:
+        store.release(ticket)
+
+
+def reserve_active_orders(profile_id, count, limit):
+    """
+    Add to the active orders counter of a profile as a single atomic update, only if it stays within a limit.
+
+    :return
+    - True if the counter has been incremented.
+    """
+
+    if connection.vendor == 'djongo':
+        query = {'id': profile_id, 'active_orders': {'$lte': limit - count}}
+        return bool(get_collection(Profile).update_one(query, {'$inc': {'active_orders': count}}).matched_count)
+    return bool(Profile.objects.filter(pk=profile_id, active_orders__lte=limit - count).update(
+        active_orders=F('active_orders') + count
+    ))
+
+
+@contextmanager
+def open_orders(profile, count=1):
+    """
+    Run a block that opens orders of a profile, holding their slots of 'EXCHANGE_MAX_OPEN_ORDERS'.
+    The slots are reserved on the active orders counter before the block, so concurrent requests can not
+    exceed the limit together, and released after it: the saved orders are counted by the order signals.
+
+    :argument
+    - profile: 'Profile' object.
+    - count: Number of new orders.
+
+    :raise
+    - OpenOrdersLimit
+    """
+
+    if not reserve_active_orders(profile.pk, count, settings.EXCHANGE_MAX_OPEN_ORDERS):
+        raise OpenOrdersLimit(f'a profile can not have more than {settings.EXCHANGE_MAX_OPEN_ORDERS} active orders')
+    try:
+        yield
+    finally:
+        update_order_counters({profile.pk: {'active_orders': -count}})
@@ -0,0 +1,216 @@
+import heapq
+from django.db import connection
+from django.db.models import Count, F, Max, Min, Sum
+from exchange.models import Fill, Order
+from exchange.utils.amounts import SATOSHI
+from exchange.utils.bulk import get_collection
+from exchange.utils.instruments import DEFAULT_SYMBOL
+
+# Remaining quantity of an active order in the aggregation pipelines
+REMAINING_QUANTITY = {'$subtract': ['$quantity', '$filled_quantity']}
+
+# Active orders in the book, the stop orders waiting for a trigger are not
+BOOK_ORDERS = {'status': True, 'kind': {'$nin': list(Order.STOP_KINDS)}}
+
+
+def get_book_orders():
+    return Order.objects.filter(status=True).exclude(kind__in=Order.STOP_KINDS)
+
+
+def profile_fill_documents(profile_id, fields, symbol=None, **options):
+    """
+    Yield the fill documents of the orders of a profile on MongoDB, oldest first.
+    The fills of the buy orders and of the sell orders are joined to the orders of the profile by the server,
+    with one sorted pipeline for each side, and the two cursors are merged while they are read: the ids of
+    the orders are never loaded by the client.
+
+    :argument
+    - fields: Fill fields projected besides 'id' and 'executed_at'.
+    - symbol: Only the fills of this instrument, all of them if None.
+    - options: Options of 'aggregate()', e.g. batchSize.
+
+    :return
+    - Iterator of (side of the profile, fill document) tuples, a fill between two orders of the profile
+      once for each side, the buy side first.
+    """
+
+    def side_fills(side, order_field):
+        match = {'profile_id': profile_id, 'type': side}
+        if symbol is not None:
+            match['symbol'] = symbol
+        pipeline = [
+            {'$match': match},
+            {'$project': {'_id': 0, 'id': 1}},
+            {'$lookup': {'from': Fill._meta.db_table, 'localField': 'id', 'foreignField': order_field, 'as': 'fill'}},
+            {'$unwind': '$fill'},
+            {'$replaceRoot': {'newRoot': '$fill'}},
+            {'$sort': {'executed_at': 1, 'id': 1}},
+            {'$project': dict({'_id': 0, 'id': 1, 'executed_at': 1}, **{field: 1 for field in fields})},
+        ]
+        cursor = get_collection(Order).aggregate(pipeline, allowDiskUse=True, **options)
+        return ((fill['executed_at'], fill['id'], side, fill) for fill in cursor)
+
+    for executed_at, fill_id, side, fill in heapq.merge(side_fills('B', 'buy_order_id'),
+                                                         side_fills('S', 'sell_order_id')):
+        yield side, fill
+
+
+def active_book_levels(symbol=DEFAULT_SYMBOL):
+    """
+    Aggregate the remaining quantity of the active orders of an instrument by price level.
+    On MongoDB the levels are grouped by the server in one pipeline, without the SQL translation of djongo.
+
+    :return
+    - Dict {'B': [...], 'S': [...]} of (price, quantity, orders) tuples, the best price first.
+    """
+
+    if connection.vendor == 'djongo':
+        pipeline = [
+            {'$match': dict(BOOK_ORDERS, symbol=symbol)},
+            {'$group': {
+                '_id': {'type': '$type', 'price': '$price'},
+                'quantity': {'$sum': REMAINING_QUANTITY},
+                'orders': {'$sum': 1},
+            }},
+        ]
+        rows = [
+            (row['_id']['type'], row['_id']['price'], row['quantity'], row['orders'])
+            for row in get_collection(Order).aggregate(pipeline)
+        ]
+    else:
+        rows = get_book_orders().filter(symbol=symbol).values_list('type', 'price').annotate(
+            remaining=Sum(F('quantity') - F('filled_quantity')), orders=Count('id')
+        ).order_by()
+
+    levels = {'B': [], 'S': []}
+    for order_type, price, quantity, orders in rows:
+        levels[order_type].append((price, quantity, orders))
+    levels['B'].sort(reverse=True)
+    levels['S'].sort()
+    return levels
+
+
+def get_market_price(order_type, quantity, symbol=DEFAULT_SYMBOL):
+    """
+    Return the worst price of the opposite side of the book needed to fill a quantity, or the
+    deepest price if the book is not deep enough.
+
+    :argument
+    - order_type: Type of the incoming order, 'B' or 'S'.
+    - quantity: Base asset units.
+    - symbol: Instrument of the incoming order.
+
+    :return
+    - Quote asset units, None if the opposite side is empty.
+    """
+
+    price = None
+    for price, level_quantity, orders in active_book_levels(symbol)['S' if order_type == 'B' else 'B']:
+        quantity -= level_quantity
+        if quantity <= 0:
+            break
+    return price
+
+
+def order_counts():
+    """
+    Count the active and executed orders of every profile in one aggregation.
+
+    :return
+    - Dict {profile id: {'active_orders': n, 'executed_orders': n}}, only profiles with orders.
+    """
+
+    if connection.vendor == 'djongo':
+        pipeline = [{'$group': {'_id': {'profile_id': '$profile_id', 'status': '$status'}, 'count': {'$sum': 1}}}]
+        rows = [
+            (row['_id']['profile_id'], row['_id']['status'], row['count'])
+            for row in get_collection(Order).aggregate(pipeline)
+        ]
+    else:
+        rows = Order.objects.values_list('profile_id', 'status').annotate(count=Count('id')).order_by()
+
+    counts = {}
+    for profile_id, order_status, count in rows:
+        profile_counts = counts.setdefault(profile_id, {'active_orders': 0, 'executed_orders': 0})
+        profile_counts['active_orders' if order_status else 'executed_orders'] += count
+    return counts
+
+
+def volume_totals(since=None):
+    """
+    Sum the fills executed since a datetime, or all of them.
+
+    :return
+    - Dict with trades, quantity (satoshis) and dollar_amount (cents, rounded down once on the total).
+    """
+
+    if connection.vendor == 'djongo':
+        pipeline = [{'$match': {'executed_at': {'$gte': since}}}] if since is not None else []
+        pipeline.append({'$group': {
+            '_id': None,
+            'trades': {'$sum': 1},
+            'quantity': {'$sum': '$quantity'},
+            'amount': {'$sum': {'$multiply': ['$quantity', '$price']}},
+        }})
+        totals = next(get_collection(Fill).aggregate(pipeline), {})
+    else:
+        fills = Fill.objects.all() if since is None else Fill.objects.filter(executed_at__gte=since)
+        totals = fills.aggregate(trades=Count('id'), quantity=Sum('quantity'), amount=Sum(F('quantity') * F('price')))
+
+    return {
+        'trades': totals.get('trades') or 0,
+        'quantity': totals.get('quantity') or 0,
+        'dollar_amount': (totals.get('amount') or 0) // SATOSHI,
+    }
+
+
+def market_statistics(since, symbol=DEFAULT_SYMBOL):
+    """
+    Return the volume of an instrument since a datetime, the last price and the best prices of its book.
+    Each figure is read by one query on the index that serves it: the volume from the fills of the period
+    only, the last price from the newest fill of the instrument. On MongoDB the volume and the best prices
+    are computed by pipelines, without the SQL translation of djongo.
+
+    :return
+    - Dict with trades, quantity, dollar_amount, last_price, best_bid, best_ask and spread, the prices
+      are None if there are no fills or no active orders on that side.
+    """
+
+    if connection.vendor == 'djongo':
+        volume_pipeline = [
+            {'$match': {'symbol': symbol, 'executed_at': {'$gte': since}}},
+            {'$group': {
+                '_id': None,
+                'trades': {'$sum': 1},
+                'quantity': {'$sum': '$quantity'},
+                'amount': {'$sum': {'$multiply': ['$quantity', '$price']}},
+            }},
+        ]
+        totals = next(get_collection(Fill).aggregate(volume_pipeline), {})
+        book_pipeline = [
+            {'$match': dict(BOOK_ORDERS, symbol=symbol)},
+            {'$group': {'_id': '$type', 'best_bid': {'$max': '$price'}, 'best_ask': {'$min': '$price'}}},
+        ]
+        best = {side['_id']: side for side in get_collection(Order).aggregate(book_pipeline)}
+        best_bid = best['B']['best_bid'] if 'B' in best else None
+        best_ask = best['S']['best_ask'] if 'S' in best else None
+    else:
+        totals = Fill.objects.filter(symbol=symbol, executed_at__gte=since).aggregate(
+            trades=Count('id'), quantity=Sum('quantity'), amount=Sum(F('quantity') * F('price'))
+        )
+        active_orders = get_book_orders().filter(symbol=symbol)
+        best_bid = active_orders.filter(type='B').aggregate(price=Max('price'))['price']
+        best_ask = active_orders.filter(type='S').aggregate(price=Min('price'))['price']
+
+    # Sorted on executed_at only, the (symbol, executed_at) index returns the newest fill without sorting
+    last_price = Fill.objects.filter(symbol=symbol).order_by('-executed_at').values_list('price', flat=True).first()
+
+    return {
+        'trades': totals.get('trades') or 0,
+        'quantity': totals.get('quantity') or 0,
+        'dollar_amount': (totals.get('amount') or 0) // SATOSHI,
+        'last_price': last_price,
+        'best_bid': best_bid,
+        'best_ask': best_ask,
+        'spread': best_ask - best_bid if best_bid is not None and best_ask is not None else None,
+    }
@@ -0,0 +1,42 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Amounts are stored as integers: bitcoins in satoshis and dollars in cents
+SATOSHI = 10 ** 8  # Satoshis in one bitcoin
+CENT = 10 ** 2  # Cents in one dollar
+
+
+def to_fixed_point(value, scale):
+    """
+    Convert a decimal amount to the nearest integer amount of the given scale.
+    """
+
+    return int((Decimal(str(value)) * scale).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def to_satoshi(bitcoin):
+    return to_fixed_point(bitcoin, SATOSHI)
+
+
+def to_cents(dollar):
+    return to_fixed_point(dollar, CENT)
+
+
+def from_satoshi(satoshi):
+    return satoshi / SATOSHI
+
+
+def from_cents(cents):
+    return cents / CENT
+
+
+def quote_amount(quantity, price):
+    """
+    Return the quote asset units needed to buy a quantity of any instrument at a price, rounded up:
+    the buyer always pays at least the exact amount, however small the quantity.
+
+    :argument
+    - quantity: Base asset units, base assets have 8 decimals like bitcoin.
+    - price: Quote asset units for one base asset.
+    """
+
+    return -(-quantity * price // SATOSHI)
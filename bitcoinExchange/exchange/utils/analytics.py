@@ -0,0 +1,200 @@
+import math
+from collections import namedtuple
+from datetime import date, timezone
+from itertools import groupby
+from django.db import connection
+from django.db.models import Q
+from exchange.models import Fill
+from exchange.utils.aggregations import profile_fill_documents
+from exchange.utils.amounts import SATOSHI
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SECONDS_PER_DAY = 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Amounts are integers: quantities in base asset units, prices and P&L in quote asset units
+Portfolio = namedtuple('Portfolio', [
+    'symbol', 'trades', 'position', 'average_entry_price', 'mark_price', 'realized_pnl', 'unrealized_pnl',
+    'total_pnl', 'quantity', 'amount', 'days'
+])
+PortfolioDay = namedtuple('PortfolioDay', ['symbol', 'date', 'trades', 'quantity', 'amount', 'equity'])
+
+
+def to_timestamp(value):
+    # pymongo returns naive UTC datetimes
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def signed_fills(fills):
+    # A fill between two orders of the profile comes once for each side, in a row
+    for fill_id, items in groupby(fills, lambda item: item[1]['id']):
+        items = list(items)
+        sides = {side for side, fill in items}
+        fill = items[0][1]
+        yield fill['executed_at'], fill['price'], fill['quantity'], ('B' in sides) - ('S' in sides)
+
+
+def profile_fills(profile_id, symbol):
+    """
+    Load the fills of a profile on an instrument as columns, oldest first.
+    On MongoDB the fills are joined to the orders of the profile by the server and streamed, projecting
+    only the columns, without the SQL translation of djongo.
+
+    :return
+    - Tuple of lists (timestamps, prices, quantities, sides), the side is 1 for a buy, -1 for a sell
+      and 0 for a fill between two orders of the profile.
+    """
+
+    if connection.vendor == 'djongo':
+        rows = signed_fills(profile_fill_documents(profile_id, ['price', 'quantity'], symbol))
+    else:
+        fills = Fill.objects.filter(
+            Q(buy_order__profile_id=profile_id) | Q(sell_order__profile_id=profile_id), symbol=symbol
+        ).order_by('executed_at', 'pk').values_list(
+            'executed_at', 'price', 'quantity', 'buy_order__profile_id', 'sell_order__profile_id'
+        )
+        rows = (
+            (executed_at, price, quantity, (buyer_id == profile_id) - (seller_id == profile_id))
+            for executed_at, price, quantity, buyer_id, seller_id in fills.iterator()
+        )
+
+    columns = ([], [], [], [])
+    for executed_at, price, quantity, side in rows:
+        columns[0].append(to_timestamp(executed_at))
+        columns[1].append(price)
+        columns[2].append(quantity)
+        columns[3].append(side)
+    return columns
+
+
+def get_mark_price(symbol):
+    # Last price of the market, the unrealized P&L is valued at it
+    return Fill.objects.filter(symbol=symbol).values_list('price', flat=True).first()
+
+
+def vectorized_analytics(timestamps, prices, quantities, sides):
+    """
+    Compute the position, the cost basis and the daily figures of a fill history with NumPy.
+
+    The average cost basis follows the recurrence cost = ratio * previous cost + increment, where a fill
+    opening a position (from flat or across zero) restarts it at the new position times the price, a fill
+    adding to the position adds its amount, and a fill reducing it keeps the average, i.e. scales the cost
+    by the ratio of the positions. Each run of the recurrence between two openings is solved with
+    cumulative sums of the increments divided by the cumulative product of the ratios, kept in logs.
+
+    :return
+    - Tuple (position, cost, cash, days), cost and cash in quote asset units times base asset units,
+      days as a list of (day number, trades, quantity, amount, equity) tuples.
+    """
+
+    times = np.asarray(timestamps, dtype=np.float64)
+    price = np.asarray(prices, dtype=np.float64)
+    quantity = np.asarray(quantities, dtype=np.float64)
+    signed = quantity * np.asarray(sides, dtype=np.float64)
+
+    position = np.cumsum(signed)
+    previous = position - signed
+    cash = -np.cumsum(signed * price)
+
+    opening = (previous == 0) | (np.sign(previous) != np.sign(position))
+    adding = ~opening & (np.abs(position) > np.abs(previous))
+    reducing = ~opening & ~adding
+    log_ratio = np.zeros(len(position))
+    log_ratio[reducing] = np.log(position[reducing] / previous[reducing])
+    increment = np.where(opening, position * price, np.where(adding, signed * price, 0.0))
+
+    # Logs and sums relative to the opening fill of each run, which bounds their magnitude
+    run = np.cumsum(opening) - 1
+    starts = np.flatnonzero(opening)
+    logs = np.cumsum(log_ratio)
+    logs -= logs[starts][run]
+    scaled = increment * np.exp(-logs)
+    sums = np.cumsum(scaled)
+    sums -= (sums[starts] - scaled[starts])[run]
+    cost = np.exp(logs) * sums
+
+    # Daily volume, and the equity marked at the last fill of each day
+    day = (times // SECONDS_PER_DAY).astype(np.int64)
+    day_numbers, first = np.unique(day, return_index=True)
+    last = np.append(first[1:], len(day)) - 1
+    trades = np.diff(np.append(first, len(day)))
+    day_quantity = np.add.reduceat(quantity, first)
+    day_amount = np.add.reduceat(quantity * price, first)
+    equity = cash[last] + position[last] * price[last]
+    days = list(zip(
+        day_numbers.tolist(), trades.tolist(), day_quantity.tolist(), day_amount.tolist(), equity.tolist()
+    ))
+    return position[-1].item(), cost[-1].item(), cash[-1].item(), days
+
+
+def iterative_analytics(timestamps, prices, quantities, sides):
+    """
+    Same result of 'vectorized_analytics()' with a loop over the fills, used without NumPy.
+    """
+
+    position = cost = cash = 0
+    days = []
+    for timestamp, price, quantity, side in zip(timestamps, prices, quantities, sides):
+        signed = quantity * side
+        previous = position
+        position += signed
+        cash -= signed * price
+        if previous == 0 or (previous > 0) != (position > 0) or position == 0:
+            cost = position * price
+        elif abs(position) > abs(previous):
+            cost += signed * price
+        else:
+            cost = cost * position / previous
+
+        day = int(timestamp // SECONDS_PER_DAY)
+        if not days or days[-1][0] != day:
+            days.append([day, 0, 0, 0, 0])
+        days[-1][1:] = [days[-1][1] + 1, days[-1][2] + quantity, days[-1][3] + quantity * price,
+                        cash + position * price]
+    return position, cost, cash, [tuple(day) for day in days]
+
+
+def portfolio_analytics(profile_id, symbol):
+    """
+    Compute the P&L of a profile on an instrument from its whole fill history, loaded in one query.
+    The P&L uses the average cost method and the unrealized P&L is valued at the last price of the market.
+
+    :return
+    - 'Portfolio' namedtuple, the days oldest first.
+    """
+
+    timestamps, prices, quantities, sides = profile_fills(profile_id, symbol)
+    mark_price = get_mark_price(symbol)
+    if not timestamps:
+        return Portfolio(symbol, 0, 0, None, mark_price, 0, 0, 0, 0, 0, [])
+
+    analytics = vectorized_analytics if np is not None else iterative_analytics
+    position, cost, cash, days = analytics(timestamps, prices, quantities, sides)
+
+    # Amounts times base asset units are converted to quote asset units only once, on the totals
+    realized_pnl = (cash + cost) / SATOSHI
+    unrealized_pnl = (position * mark_price - cost) / SATOSHI
+    average_entry_price = round(cost / position) if position else None
+    return Portfolio(
+        symbol=symbol,
+        trades=len(timestamps),
+        position=int(position),
+        average_entry_price=average_entry_price,
+        mark_price=mark_price,
+        realized_pnl=round(realized_pnl),
+        unrealized_pnl=round(unrealized_pnl),
+        total_pnl=round(realized_pnl + unrealized_pnl),
+        quantity=sum(day[2] for day in days),
+        amount=math.floor(sum(day[3] for day in days) / SATOSHI),
+        days=[
+            PortfolioDay(symbol, date.fromordinal(EPOCH_ORDINAL + day), trades, int(quantity),
+                         math.floor(amount / SATOSHI), round(equity / SATOSHI))
+            for day, trades, quantity, amount, equity in days
+        ],
+    )
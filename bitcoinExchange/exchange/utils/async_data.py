@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from exchange.models import Balance, Order, Profile, Wallet
+from exchange.utils.aggregations import get_book_orders
+from exchange.utils.token_cache import get_token_cache
+from rest_framework.authtoken.models import Token
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+_databases = {}  # Event loop -> Motor database
+
+PROFILE_FIELDS = ['id', 'user_id', 'active_orders', 'executed_orders']
+WALLET_FIELDS = ['id', 'profile_id', 'bitcoin_net_balance', 'available_dollar', 'frozen_dollar', 'available_bitcoin',
+                 'frozen_bitcoin']
+BALANCE_FIELDS = ['id', 'profile_id', 'asset', 'available', 'frozen']
+ORDER_FIELDS = ['id', 'profile_id', 'symbol', 'price', 'quantity', 'filled_quantity', 'type', 'kind', 'time_in_force',
+                'stop_price', 'status', 'transaction_id', 'created_at']
+
+
+def get_database():
+    """
+    Return the Motor database of the running event loop.
+    None if Motor is not installed or the database is not MongoDB, the ORM is used in a thread instead.
+    """
+
+    options = settings.DATABASES['default']
+    if AsyncIOMotorClient is None or options['ENGINE'] != 'djongo':
+        return None
+    loop = asyncio.get_event_loop()
+    database = _databases.get(loop)
+    if database is None:
+        database = _databases[loop] = AsyncIOMotorClient(**options.get('CLIENT', {}))[options['NAME']]
+    return database
+
+
+def to_instance(model, fields, document):
+    return model(**{field: document.get(field) for field in fields})
+
+
+def to_user(document):
+    # Every field of the user, as read by the ORM: pymongo returns naive UTC datetimes
+    values = {}
+    for field in User._meta.concrete_fields:
+        value = document.get(field.column)
+        if isinstance(value, datetime) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.utc)
+        values[field.attname] = value
+    return User(**values)
+
+
+async def find_one(model, fields, query):
+    document = await get_database()[model._meta.db_table].find_one(query, {field: 1 for field in fields})
+    return to_instance(model, fields, document) if document else None
+
+
+@sync_to_async(thread_sensitive=False)
+def get_orm_token(key):
+    token = Token.objects.select_related('user__profile__wallet').filter(key=key).first()
+    if token is None:
+        return None
+    try:
+        return token.user, token.user.profile.pk, token.user.profile.wallet.pk
+    except ObjectDoesNotExist:
+        return None
+
+
+async def find_token(key):
+    # The user, its profile and its wallet are joined to the token by the server, in the same round-trip
+    pipeline = [
+        {'$match': {'key': key}},
+        {'$limit': 1},
+        {'$lookup': {'from': User._meta.db_table, 'localField': 'user_id', 'foreignField': 'id', 'as': 'user'}},
+        {'$lookup': {
+            'from': Profile._meta.db_table, 'localField': 'user_id', 'foreignField': 'user_id', 'as': 'profile'
+        }},
+        {'$lookup': {
+            'from': Wallet._meta.db_table, 'localField': 'profile.id', 'foreignField': 'profile_id', 'as': 'wallet'
+        }},
+    ]
+    async for document in get_database()[Token._meta.db_table].aggregate(pipeline):
+        if document['user'] and document['profile'] and document['wallet']:
+            return to_user(document['user'][0]), document['profile'][0]['id'], document['wallet'][0]['id']
+    return None
+
+
+async def get_user_id(token_key):
+    """
+    Return the primary key of the user authenticated by a token, None if the token is not valid, the user
+    is inactive or has no profile. The authentication is cached like by 'CachedTokenAuthentication'.
+    """
+
+    token_cache = get_token_cache()
+    entry = token_cache.get(token_key)
+    if entry is not None:
+        return entry.user_id
+    found = await (get_orm_token(token_key) if get_database() is None else find_token(token_key))
+    if found is None:
+        return None
+    user, profile_id, wallet_id = found
+    if not user.is_active:
+        return None
+    token_cache.set(token_key, user, profile_id, wallet_id)
+    return user.pk
+
+
+async def find_profile_and_wallet(user_id):
+    # The wallet is joined to the profile by the server, in the same round-trip
+    pipeline = [
+        {'$match': {'user_id': user_id}},
+        {'$limit': 1},
+        {'$lookup': {'from': Wallet._meta.db_table, 'localField': 'id', 'foreignField': 'profile_id', 'as': 'wallet'}},
+    ]
+    async for document in get_database()[Profile._meta.db_table].aggregate(pipeline):
+        if document['wallet']:
+            return to_instance(Profile, PROFILE_FIELDS, document), to_instance(Wallet, WALLET_FIELDS, document['wallet'][0])
+    return None, None
+
+
+async def find_balances(user_id):
+    profile = await find_one(Profile, ['id'], {'user_id': user_id})
+    if profile is None:
+        return []
+    cursor = get_database()[Balance._meta.db_table].find({'profile_id': profile.pk}, {field: 1 for field in BALANCE_FIELDS})
+    return [to_instance(Balance, BALANCE_FIELDS, document) async for document in cursor]
+
+
+@sync_to_async(thread_sensitive=False)
+def get_orm_user(user_id):
+    return User.objects.only('username').filter(pk=user_id).first()
+
+
+@sync_to_async(thread_sensitive=False)
+def get_orm_profile(user_id):
+    return Profile.objects.only(*PROFILE_FIELDS).filter(user_id=user_id).first()
+
+
+@sync_to_async(thread_sensitive=False)
+def get_orm_wallet(user_id):
+    return Wallet.objects.only(*WALLET_FIELDS).filter(profile__user_id=user_id).first()
+
+
+@sync_to_async(thread_sensitive=False)
+def get_orm_balances(user_id):
+    return list(Balance.objects.filter(profile__user_id=user_id))
+
+
+async def get_profile(user_id):
+    """
+    Return the profile of a user with its user, wallet and balances, ready for 'ProfileSerializer'.
+    The user, the profile counters, the wallet and the balances are read concurrently.
+    None if the user, its profile or its wallet does not exist anymore.
+    """
+
+    if get_database() is None:
+        user, profile, wallet, balances = await asyncio.gather(
+            get_orm_user(user_id), get_orm_profile(user_id), get_orm_wallet(user_id), get_orm_balances(user_id)
+        )
+    else:
+        user, (profile, wallet), balances = await asyncio.gather(
+            find_one(User, ['id', 'username'], {'id': user_id}), find_profile_and_wallet(user_id),
+            find_balances(user_id)
+        )
+    if user is None or profile is None or wallet is None:
+        return None
+    profile.user = user
+    profile.wallet = wallet
+    profile._prefetched_objects_cache = {'balances': balances}
+    return profile
+
+
+@sync_to_async(thread_sensitive=False)
+def get_orm_latest_orders(profile_id):
+    return list(get_book_orders().exclude(profile_id=profile_id))
+
+
+async def get_latest_orders(user_id):
+    """
+    Return the orders of the book that have not been published by a user, newest first.
+    None if the profile of the user does not exist anymore.
+    """
+
+    if get_database() is None:
+        profile = await get_orm_profile(user_id)
+        return await get_orm_latest_orders(profile.pk) if profile is not None else None
+
+    profile = await find_one(Profile, ['id'], {'user_id': user_id})
+    if profile is None:
+        return None
+    query = {'status': True, 'kind': {'$nin': list(Order.STOP_KINDS)}, 'profile_id': {'$ne': profile.pk}}
+    cursor = get_database()[Order._meta.db_table].find(query, {field: 1 for field in ORDER_FIELDS})
+    return [to_instance(Order, ORDER_FIELDS, document) async for document in cursor.sort('created_at', -1)]
@@ -0,0 +1,150 @@
+from collections import defaultdict
+from django.conf import settings
+from exchange.models import Order
+from exchange.utils.bulk import bulk_delete, bulk_update, update_where
+from exchange.utils.depth import touch_book
+from exchange.utils.event_log import order_accepted, order_cancelled, record_events
+from exchange.utils.ledger import InsufficientBalance, frozen_amount, order_deltas, update_wallet
+from exchange.utils.market_data import publish_book_levels
+from exchange.utils.order_book import get_order_book
+from exchange.utils.profile_stats import update_order_counters
+from exchange.utils.sequencer import CANCEL_ORDER, NEW_ORDER, put_orders
+from exchange.utils.trade import submit_order
+from exchange.utils.triggers import get_trigger_book
+
+
+def get_batch_deltas(orders, quantity_name):
+    """
+    Return the sum of the deltas that freeze the given quantity of several orders.
+
+    :argument
+    - orders: Iterable of 'Order' objects.
+    - quantity_name: 'quantity' to freeze new orders, 'remaining_quantity' to unfreeze active orders.
+    """
+
+    deltas = defaultdict(int)
+    for order in orders:
+        if quantity_name == 'quantity':
+            amount = frozen_amount(order, order.quantity)
+        else:
+            amount = frozen_amount(order, order.quantity) - frozen_amount(order, order.filled_quantity)
+        for name, delta in order_deltas(order, amount).items():
+            deltas[name] += delta
+    return deltas
+
+
+def create_orders(profile, orders_data):
+    """
+    Create several orders of a profile.
+    The amount needed to fulfill all the orders is frozen with one guarded update, then the
+    orders are matched in one pass, or queued together for the matching engine.
+    If an order can not be saved, the amount of the unsaved ones is unfrozen and the orders already
+    saved are still matched or queued before the error is raised.
+
+    :argument
+    - profile: Must be a 'Profile' object.
+    - orders_data: List of dicts with symbol, price, quantity and type of each order.
+
+    :return
+    - List of the 'Order' objects created.
+
+    :raise
+    - InsufficientBalance: No order has been created.
+    """
+
+    orders = [Order(profile=profile, **data) for data in orders_data]
+    update_wallet(profile.pk, get_batch_deltas(orders, 'quantity'))
+
+    saved_orders = []
+    try:
+        for order in orders:
+            # The amount has already been frozen, see the Order signals
+            order._batched = True
+            order.save()
+            saved_orders.append(order)
+    finally:
+        unsaved_orders = orders[len(saved_orders):]
+        if unsaved_orders:
+            deltas = get_batch_deltas(unsaved_orders, 'quantity')
+            update_wallet(profile.pk, {name: -delta for name, delta in deltas.items()})
+        if saved_orders:
+            record_events([order_accepted(order) for order in saved_orders])
+            update_order_counters({profile.pk: {'active_orders': len(saved_orders)}})
+            # Submitted even if a later order failed, they are active with their funds frozen
+            if settings.EXCHANGE_MATCHING_ENGINE:
+                put_orders(NEW_ORDER, saved_orders)
+            else:
+                for order in saved_orders:
+                    submit_order(order)
+    return orders
+
+
+def cancel_orders(profile, orders):
+    """
+    Cancel several active orders of a profile.
+    Each order is first marked inactive only if it is still active with the filled quantity read, the
+    orders filled or canceled meanwhile by another worker are skipped. The remaining amounts of the
+    others are unfrozen with one guarded update, then the orders that have not been filled are deleted
+    together and the partially filled ones are closed together.
+    With the matching engine the cancellations are queued instead.
+
+    :argument
+    - profile: Must be a 'Profile' object.
+    - orders: Iterable of active 'Order' objects of the profile.
+
+    :return
+    - Number of orders canceled or queued to be canceled.
+
+    :raise
+    - InsufficientBalance: No order has been canceled, they are active again.
+    """
+
+    orders = list(orders)
+    if not orders:
+        return 0
+
+    if settings.EXCHANGE_MATCHING_ENGINE:
+        put_orders(CANCEL_ORDER, orders)
+        return len(orders)
+
+    orders = [
+        order for order in orders
+        if update_where(Order, {'id': order.pk, 'status': True, 'filled_quantity': order.filled_quantity},
+                        {'status': False})
+    ]
+    if not orders:
+        return 0
+    deltas = get_batch_deltas(orders, 'remaining_quantity')
+    try:
+        update_wallet(profile.pk, {name: -delta for name, delta in deltas.items()})
+    except InsufficientBalance:
+        for order in orders:
+            update_where(Order, {'id': order.pk}, {'status': True})
+        raise
+
+    for order in orders:
+        get_order_book(order.symbol).remove(order)
+        get_trigger_book(order.symbol).remove(order)
+    record_events([order_cancelled(order) for order in orders])
+
+    closed_orders = []
+    deleted_orders = []
+    for order in orders:
+        if order.filled_quantity:
+            # Keep the executed part of a partially filled order
+            order.quantity = order.filled_quantity
+            order.status = False
+            closed_orders.append(order)
+        else:
+            deleted_orders.append(order)
+
+    bulk_update(Order, closed_orders, ['quantity', 'status'])
+    bulk_delete(Order, [order.pk for order in deleted_orders])
+    update_order_counters({
+        profile.pk: {'active_orders': -len(orders), 'executed_orders': len(closed_orders)}
+    })
+    touch_book()
+    for symbol in {order.symbol for order in orders}:
+        levels = [(order.type, order.price) for order in orders if order.symbol == symbol]
+        publish_book_levels(get_order_book(symbol), levels)
+    return len(orders)
@@ -0,0 +1,177 @@
+import random
+import time
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from exchange.models import Order, Profile, Wallet
+from exchange.utils.amounts import CENT, SATOSHI, from_cents, from_satoshi
+from exchange.utils.instrumentation import query_wrapper, start_request, stop_request
+from exchange.utils.provisioning import bulk_create_users
+from rest_framework.authtoken.models import Token
+
+# Balance of every benchmark trader, large enough to never run out of funds
+TRADER_DOLLARS = 10 ** 9 * CENT
+TRADER_BITCOINS = 10 ** 6 * SATOSHI
+
+
+class OrderFlow:
+    """
+    Synthetic order flow around a mid price.
+    Passive orders rest inside the book depth without crossing the spread, aggressive orders
+    cross the spread and are matched.
+
+    :argument
+    - mid_price: Cents.
+    - depth: Price levels on each side of the book.
+    - tick: Cents between two price levels.
+    - match_ratio: Fraction of aggressive orders, between 0 and 1.
+    - distribution: 'uniform' or 'normal', distribution of the passive prices across the depth.
+    - min_quantity: Satoshis.
+    - max_quantity: Satoshis.
+    - seed: Seed of the random generator, the same seed gives the same flow.
+    """
+
+    def __init__(self, mid_price=50000 * CENT, depth=50, tick=CENT, match_ratio=0.3, distribution='uniform',
+                 min_quantity=SATOSHI // 100, max_quantity=SATOSHI, seed=None):
+        self.mid_price = mid_price
+        self.depth = depth
+        self.tick = tick
+        self.match_ratio = match_ratio
+        self.distribution = distribution
+        self.min_quantity = min_quantity
+        self.max_quantity = max_quantity
+        self.random = random.Random(seed)
+
+    def level(self):
+        # Price level distance from the mid price, 1 is the best level
+        if self.distribution == 'normal':
+            level = int(abs(self.random.gauss(0, self.depth / 3))) + 1
+            return min(level, self.depth)
+        return self.random.randint(1, self.depth)
+
+    def quantity(self):
+        return self.random.randint(self.min_quantity, self.max_quantity)
+
+    def passive_order(self, order_type=None):
+        order_type = order_type or self.random.choice('BS')
+        distance = self.level() * self.tick
+        price = self.mid_price - distance if order_type == 'B' else self.mid_price + distance
+        return order_type, price, self.quantity()
+
+    def aggressive_order(self):
+        # Cross up to the whole depth of the opposite side
+        order_type = self.random.choice('BS')
+        distance = self.level() * self.tick
+        price = self.mid_price + distance if order_type == 'B' else self.mid_price - distance
+        return order_type, price, self.quantity()
+
+    def book(self):
+        """
+        Return the passive orders that fill every price level of both sides once.
+        """
+
+        orders = []
+        for level in range(1, self.depth + 1):
+            orders.append(('B', self.mid_price - level * self.tick, self.quantity()))
+            orders.append(('S', self.mid_price + level * self.tick, self.quantity()))
+        return orders
+
+    def orders(self, count):
+        """
+        Yield 'count' (type, price, quantity) tuples.
+        """
+
+        for _ in range(count):
+            if self.random.random() < self.match_ratio:
+                yield self.aggressive_order()
+            else:
+                yield self.passive_order()
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a list of values, None if the list is empty.
+    """
+
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def create_traders(count, prefix='benchmark'):
+    """
+    Create 'count' traders with large balances and return their profiles.
+    """
+
+    usernames = [f'{prefix}{number}' for number in range(count)]
+    bulk_create_users(usernames, password=prefix)
+    profiles = list(Profile.objects.filter(user__username__in=usernames).select_related('user'))
+    Wallet.objects.filter(profile__in=profiles).update(
+        available_dollar=TRADER_DOLLARS,
+        available_bitcoin=TRADER_BITCOINS,
+        bitcoin_net_balance=TRADER_BITCOINS
+    )
+    return profiles
+
+
+def run_benchmark(flow, count, mode='direct', traders=10):
+    """
+    Seed the book with the flow depth then submit 'count' orders of the flow, one at a time.
+
+    :argument
+    - flow: Must be an 'OrderFlow' object.
+    - count: Number of orders measured.
+    - mode: 'direct' to create the orders through the ORM (signals and matching),
+            'api' to post them to the REST endpoint through the Django test client.
+    - traders: Number of traders the orders are spread across.
+
+    :return
+    - Dict of statistics: orders, seconds, orders_per_second, p50_ms, p99_ms, queries_per_order and executed_orders.
+
+    * The queries are counted like the instrumented requests: the queries sent through the Django cursor, and
+      on MongoDB the pymongo operations sent directly to the collections, see 'register_command_listener()'.
+    """
+
+    profiles = create_traders(traders)
+    for order_type, price, quantity in flow.book():
+        Order.objects.create(profile=flow.random.choice(profiles), type=order_type, price=price, quantity=quantity)
+
+    if mode == 'api':
+        client = Client()
+        tokens = {profile.pk: Token.objects.create(user_id=profile.user_id).key for profile in profiles}
+        url = reverse('orders-list')
+
+    latencies = []
+    executed_orders = Order.objects.filter(status=False).count()
+    # The instrumentation middleware would replace the metrics of the benchmark with the ones of each request
+    with override_settings(EXCHANGE_INSTRUMENTATION=False), connection.execute_wrapper(query_wrapper):
+        metrics = start_request()
+        try:
+            start = time.perf_counter()
+            for order_type, price, quantity in flow.orders(count):
+                profile = flow.random.choice(profiles)
+                order_start = time.perf_counter()
+                if mode == 'api':
+                    data = {'type': order_type, 'price': from_cents(price), 'quantity': from_satoshi(quantity)}
+                    response = client.post(url, data=data, HTTP_AUTHORIZATION=f'Token {tokens[profile.pk]}')
+                    if response.status_code != 201:
+                        raise RuntimeError(f'Order rejected: {response.content}')
+                else:
+                    Order.objects.create(profile=profile, type=order_type, price=price, quantity=quantity)
+                latencies.append(time.perf_counter() - order_start)
+            seconds = time.perf_counter() - start
+        finally:
+            stop_request()
+
+    return {
+        'orders': count,
+        'seconds': seconds,
+        'orders_per_second': count / seconds if seconds else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        'queries_per_order': metrics.queries / count if count else None,
+        'executed_orders': Order.objects.filter(status=False).count() - executed_orders,
+    }
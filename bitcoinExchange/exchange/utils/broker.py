@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    """
+    Messages of some broker channels waiting to be consumed by one client.
+
+    :argument
+    - channels: Names of the channels.
+    - max_size: Messages kept at most, the newest ones are dropped when the client is too slow.
+    """
+
+    def __init__(self, channels, max_size):
+        self.channels = set(channels)
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.dropped = 0
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    """
+    In-process publish/subscribe broker between the exchange and the WebSocket clients.
+    Publishing never blocks the caller: each message is handed over once to the event loop
+    of the subscribers, which fans it out to their queues.
+    """
+
+    def __init__(self, max_queue_size=1000):
+        self.max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._loops = {}  # Event loop -> {channel: set(Subscription)}
+
+    def subscribe(self, channels):
+        """
+        Subscribe to some channels, must be called from the event loop of the client.
+        """
+
+        subscription = Subscription(channels, self.max_queue_size)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_channels = self._loops.setdefault(loop, defaultdict(set))
+        for channel in subscription.channels:
+            loop_channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        loop = asyncio.get_running_loop()
+        loop_channels = self._loops.get(loop, {})
+        for channel in subscription.channels:
+            subscribers = loop_channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del loop_channels[channel]
+        if not loop_channels:
+            with self._lock:
+                self._loops.pop(loop, None)
+
+    def publish(self, channel, message):
+        """
+        Publish a message on a channel, from any thread.
+        """
+
+        with self._lock:
+            loops = list(self._loops)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._deliver, loop, channel, message)
+            except RuntimeError:
+                # The event loop has been closed
+                with self._lock:
+                    self._loops.pop(loop, None)
+
+    def _deliver(self, loop, channel, message):
+        for subscription in list(self._loops.get(loop, {}).get(channel, ())):
+            subscription.put(message)
+
+    def has_subscribers(self):
+        return bool(self._loops)
+
+
+broker = Broker()
@@ -0,0 +1,112 @@
+from django.db import connection
+from django.db.models import F
+from pymongo import UpdateOne
+
+
+def get_collection(model):
+    """
+    Return the pymongo collection that stores the given model.
+    """
+
+    connection.ensure_connection()
+    return connection.connection[model._meta.db_table]
+
+
+def bulk_update(model, objs, fields):
+    """
+    Write the given fields of several model instances in one batched operation.
+
+    :argument
+    - model: Model class of the instances.
+    - objs: Iterable of model instances.
+    - fields: List of field names to write.
+    """
+
+    objs = list(objs)
+    if not objs:
+        return
+
+    if connection.vendor == 'djongo':
+        # djongo cannot translate the CASE statement generated by bulk_update()
+        model_fields = [model._meta.get_field(name) for name in fields]
+        requests = [
+            UpdateOne(
+                {model._meta.pk.column: obj.pk},
+                {'$set': {field.column: getattr(obj, field.attname) for field in model_fields}}
+            )
+            for obj in objs
+        ]
+        get_collection(model).bulk_write(requests, ordered=False)
+    else:
+        model.objects.bulk_update(objs, fields)
+
+
+def update_where(model, lookup, values):
+    """
+    Write fields of one model instance as a single atomic update, only if it still matches a lookup.
+
+    :argument
+    - model: Model class of the instance.
+    - lookup: Dict {field name: value} the instance must match, e.g. {'id': 1, 'status': True}.
+    - values: Dict {field name: value} to write, related instances as objects.
+
+    :return
+    - True if the instance has been updated.
+    """
+
+    if connection.vendor == 'djongo':
+        def columns(fields):
+            return {model._meta.get_field(name).column: getattr(value, 'pk', value) for name, value in fields.items()}
+
+        return bool(get_collection(model).update_one(columns(lookup), {'$set': columns(values)}).matched_count)
+    return bool(model.objects.filter(**lookup).update(**values))
+
+
+def bulk_increment(model, key, deltas):
+    """
+    Increment numeric fields of several model instances in one batched operation.
+
+    :argument
+    - model: Model class of the instances.
+    - key: Name of the field that identifies each instance, e.g. 'profile_id', or tuple of names.
+    - deltas: Dict {key value (tuple of values for a tuple of names): {field name: delta}}.
+    """
+
+    if not deltas:
+        return
+
+    def lookup(key_value):
+        if isinstance(key, tuple):
+            return dict(zip(key, key_value))
+        return {key: key_value}
+
+    if connection.vendor == 'djongo':
+        requests = [
+            UpdateOne(lookup(key_value), {'$inc': dict(field_deltas)})
+            for key_value, field_deltas in deltas.items()
+        ]
+        get_collection(model).bulk_write(requests, ordered=False)
+    else:
+        for key_value, field_deltas in deltas.items():
+            updates = {name: F(name) + delta for name, delta in field_deltas.items()}
+            model.objects.filter(**lookup(key_value)).update(**updates)
+
+
+def bulk_delete(model, pks):
+    """
+    Delete several model instances in one operation, without sending the delete signals.
+    The caller is responsible for what the signals would have done.
+
+    :argument
+    - model: Model class of the instances.
+    - pks: Primary keys of the instances.
+    """
+
+    pks = list(pks)
+    if not pks:
+        return
+
+    if connection.vendor == 'djongo':
+        get_collection(model).delete_many({model._meta.pk.column: {'$in': pks}})
+    else:
+        model.objects.filter(pk__in=pks)._raw_delete(connection.alias)
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from django.db import connection
+from exchange.models import Candle
+from exchange.utils.bulk import get_collection
+from exchange.utils.instruments import DEFAULT_SYMBOL
+from pymongo import UpdateOne
+
+
+def get_opened_at(executed_at, seconds):
+    """
+    Return the start of the interval of the given length that contains a datetime, UTC.
+    """
+
+    timestamp = int(executed_at.timestamp())
+    return datetime.fromtimestamp(timestamp - timestamp % seconds, tz=timezone.utc)
+
+
+def get_candle_id(interval, opened_at):
+    return f'{interval}:{int(opened_at.timestamp())}'
+
+
+def update_candles(fills):
+    """
+    Add the fills of a trade to the candles of every interval, in one batched operation.
+    Candles are kept for the default market only.
+
+    :argument
+    - fills: List of 'Fill' objects sorted by execution, already saved.
+    """
+
+    fills = [fill for fill in fills if fill.symbol == DEFAULT_SYMBOL]
+    if not fills:
+        return
+
+    # Aggregate the fills by candle first, a sweep usually fits in one candle for each interval
+    candles = {}
+    for fill in fills:
+        for interval, seconds in Candle.INTERVALS:
+            opened_at = get_opened_at(fill.executed_at, seconds)
+            candle_id = get_candle_id(interval, opened_at)
+            candle = candles.get(candle_id)
+            if candle is None:
+                candles[candle_id] = Candle(
+                    id=candle_id, interval=interval, opened_at=opened_at, open=fill.price, high=fill.price,
+                    low=fill.price, close=fill.price, volume=fill.quantity, trades=1
+                )
+            else:
+                candle.high = max(candle.high, fill.price)
+                candle.low = min(candle.low, fill.price)
+                candle.close = fill.price
+                candle.volume += fill.quantity
+                candle.trades += 1
+
+    if connection.vendor == 'djongo':
+        requests = [
+            UpdateOne(
+                {'id': candle.id},
+                {
+                    '$setOnInsert': {'interval': candle.interval, 'opened_at': candle.opened_at, 'open': candle.open},
+                    '$max': {'high': candle.high},
+                    '$min': {'low': candle.low},
+                    '$set': {'close': candle.close},
+                    '$inc': {'volume': candle.volume, 'trades': candle.trades},
+                },
+                upsert=True
+            )
+            for candle in candles.values()
+        ]
+        get_collection(Candle).bulk_write(requests, ordered=False)
+    else:
+        for candle in candles.values():
+            stored_candle, created = Candle.objects.get_or_create(id=candle.id, defaults={
+                'interval': candle.interval, 'opened_at': candle.opened_at, 'open': candle.open,
+                'high': candle.high, 'low': candle.low, 'close': candle.close,
+                'volume': candle.volume, 'trades': candle.trades,
+            })
+            if not created:
+                stored_candle.high = max(stored_candle.high, candle.high)
+                stored_candle.low = min(stored_candle.low, candle.low)
+                stored_candle.close = candle.close
+                stored_candle.volume += candle.volume
+                stored_candle.trades += candle.trades
+                stored_candle.save()
@@ -0,0 +1,58 @@
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from exchange.utils.aggregations import active_book_levels
+from exchange.utils.amounts import from_cents, from_satoshi
+
+BOOK_VERSION_KEY = 'exchange:book:version'
+
+
+def touch_book():
+    """
+    Mark the order book as changed, the depth snapshot will be rebuilt on the next request.
+    Must be called after the changes have been written to the database.
+    """
+
+    cache.set(BOOK_VERSION_KEY, uuid4().hex, None)
+
+
+def get_book_version():
+    version = cache.get(BOOK_VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        cache.add(BOOK_VERSION_KEY, version, None)
+        version = cache.get(BOOK_VERSION_KEY, version)
+    return version
+
+
+def build_depth():
+    """
+    Aggregate the remaining quantity of the active orders by price level.
+
+    :return
+    - Dict {'bids': [...], 'asks': [...]}, each level is a dict with price, quantity and number of orders,
+      the best price first.
+    """
+
+    levels = active_book_levels()
+
+    def serialize(side):
+        return [
+            {'price': from_cents(price), 'quantity': from_satoshi(quantity), 'orders': orders}
+            for price, quantity, orders in side
+        ]
+
+    return {'bids': serialize(levels['B']), 'asks': serialize(levels['S'])}
+
+
+def get_depth(version):
+    """
+    Return the depth snapshot of the given book version, building it only once for each version.
+    """
+
+    cache_key = f'exchange:book:depth:{version}'
+    depth = cache.get(cache_key)
+    if depth is None:
+        depth = build_depth()
+        cache.set(cache_key, depth, settings.EXCHANGE_DEPTH_CACHE_TIMEOUT)
+    return depth
@@ -0,0 +1,366 @@
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import namedtuple
+from django.conf import settings
+from exchange.models import Balance, Order, Wallet
+from exchange.utils.instruments import ASSETS, DEFAULT_SYMBOL, SYMBOLS, parse_balance_field
+
+# Event kinds
+ORDER_ACCEPTED = 1
+ORDER_CANCELLED = 2
+ORDER_FILLED = 3
+WALLET_DELTA = 4
+BALANCE_DELTA = 5
+
+# Balances of the wallet deltas, a delta stores the index of its field
+WALLET_FIELDS = ('available_dollar', 'frozen_dollar', 'available_bitcoin', 'frozen_bitcoin', 'bitcoin_net_balance')
+# Balances of the 'Balance' rows, a delta stores the index of its field and of its asset in ASSETS
+BALANCE_FIELDS = ('available', 'frozen')
+
+# Record: CRC32 of the payload, then kind, side and five integers.
+# The kind byte also stores the index of the symbol of the order events in SYMBOLS in its high 4 bits,
+# the records written before the symbols read as the first symbol, i.e. BTC-USD.
+#   ORDER_ACCEPTED: order id, profile id, price, quantity
+#   ORDER_CANCELLED: order id, profile id
+#   ORDER_FILLED: buy order id, sell order id, price, quantity, side of the aggressor
+#   WALLET_DELTA: profile id, field index, delta
+#   BALANCE_DELTA: profile id, field index, asset index, delta
+PAYLOAD = struct.Struct('<Bcqqqqq')
+RECORD_SIZE = 4 + PAYLOAD.size
+SYMBOL_SHIFT = 4
+assert len(SYMBOLS) <= 1 << (8 - SYMBOL_SHIFT)
+
+# Snapshot: header, then the active orders of each symbol, the wallets and the balances
+SNAPSHOT_MAGIC = b'EXSNAP03'
+SNAPSHOT_HEADER = struct.Struct('<8sQQIII')  # Magic, log offset, timestamp, orders, wallets, balances
+SNAPSHOT_ORDER = struct.Struct('<qqqqqcB')  # Id, profile id, price, quantity, filled quantity, side, symbol index
+SNAPSHOT_WALLET = struct.Struct('<q' + 'q' * len(WALLET_FIELDS))  # Profile id, balances
+SNAPSHOT_BALANCE = struct.Struct('<qq' + 'q' * len(BALANCE_FIELDS))  # Profile id, asset index, balances
+# Snapshots written before the balances, without the last count of the header and the symbols of the orders.
+# They only had BTC-USD orders.
+SNAPSHOT_V1_MAGIC = b'EXSNAP01'
+SNAPSHOT_V1_HEADER = struct.Struct('<8sQQII')
+SNAPSHOT_V1_ORDER = struct.Struct('<qqqqqc')
+# Snapshots written with the balances but without the symbols of the orders, the books of all the
+# instruments were merged so they cannot be loaded
+SNAPSHOT_V2_MAGIC = b'EXSNAP02'
+
+Event = namedtuple('Event', ['kind', 'symbol', 'side', 'a', 'b', 'c', 'd', 'timestamp'])
+
+
+def pack_event(kind, side=b' ', a=0, b=0, c=0, d=0, symbol=DEFAULT_SYMBOL):
+    payload = PAYLOAD.pack(SYMBOLS.index(symbol) << SYMBOL_SHIFT | kind, side, a, b, c, d, time.time_ns() // 1000)
+    return struct.pack('<I', zlib.crc32(payload)) + payload
+
+
+def unpack_event(payload):
+    kind, *fields = PAYLOAD.unpack(payload)
+    return Event(kind & ((1 << SYMBOL_SHIFT) - 1), SYMBOLS[kind >> SYMBOL_SHIFT], *fields)
+
+
+def order_accepted(order):
+    return pack_event(ORDER_ACCEPTED, order.type.encode(), order.pk, order.profile_id, order.price, order.quantity,
+                      symbol=order.symbol)
+
+
+def order_cancelled(order):
+    return pack_event(ORDER_CANCELLED, order.type.encode(), order.pk, order.profile_id, symbol=order.symbol)
+
+
+def order_filled(fill):
+    return pack_event(ORDER_FILLED, fill.aggressor.encode(), fill.buy_order_id, fill.sell_order_id, fill.price,
+                      fill.quantity, symbol=fill.symbol)
+
+
+def balance_delta(profile_id, name, delta):
+    balance_field = parse_balance_field(name)
+    if balance_field is None:
+        return pack_event(WALLET_DELTA, b' ', profile_id, WALLET_FIELDS.index(name), 0, delta)
+    state, asset = balance_field
+    return pack_event(BALANCE_DELTA, b' ', profile_id, BALANCE_FIELDS.index(state), ASSETS.index(asset), delta)
+
+
+def wallet_deltas(deltas):
+    """
+    Return the records of the balance deltas of several wallets.
+
+    :argument
+    - deltas: Dict {profile id: {field name: delta}}, the names of the 'Balance' rows included, e.g. 'available_eth'.
+    """
+
+    return [
+        balance_delta(profile_id, name, delta)
+        for profile_id, field_deltas in deltas.items()
+        for name, delta in field_deltas.items() if delta
+    ]
+
+
+class EventLog:
+    """
+    Append-only binary log of the exchange events.
+    The records of one operation are appended with a single write on a file opened in append mode,
+    so the records of concurrent processes are never interleaved.
+    The records are appended after the database writes of their operation, so the log is not a write-ahead
+    log: the records of an operation interrupted in between are missing, 'replay_event_log --verify'
+    reports the differences with the database.
+
+    :argument
+    - path: Path of the log file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.pid = None
+
+    def write(self, records):
+        if not records:
+            return
+        if self.pid != os.getpid():
+            # File descriptors are not shared with forked workers
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.pid = os.getpid()
+        os.write(self.fd, b''.join(records))
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+
+_event_log = None
+
+
+def get_event_log():
+    global _event_log
+    if _event_log is None or _event_log.path != settings.EXCHANGE_EVENT_LOG_PATH:
+        _event_log = EventLog(settings.EXCHANGE_EVENT_LOG_PATH)
+    return _event_log
+
+
+def record_events(records):
+    """
+    Append the records of one operation to the event log, if it is enabled.
+    Called once the operation is written to the database.
+    """
+
+    if settings.EXCHANGE_EVENT_LOG:
+        get_event_log().write(records)
+
+
+def read_events(path, offset=0):
+    """
+    Iterate the events of a log file from an offset, reading the file through mmap.
+    The iteration stops at the first incomplete or corrupted record, e.g. a torn write at the tail.
+
+    :return
+    - Iterator of (offset after the event, 'Event' object) tuples.
+    """
+
+    try:
+        log_file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        if size <= offset:
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while offset + RECORD_SIZE <= size:
+                crc, = struct.unpack_from('<I', data, offset)
+                payload = data[offset + 4:offset + RECORD_SIZE]
+                if zlib.crc32(payload) != crc:
+                    return
+                offset += RECORD_SIZE
+                yield offset, unpack_event(payload)
+
+
+class ExchangeState:
+    """
+    Active orders and wallet balances rebuilt from a snapshot and the event log.
+
+    :fields
+    - offset: Position of the event log already applied.
+    - orders: Dict {symbol: {order id: [profile id, side, price, quantity, filled quantity]}} of the active
+      orders, one book for each instrument.
+    - wallets: Dict {profile id: [balance of each field of WALLET_FIELDS]}.
+    - balances: Dict {(profile id, asset index): [balance of each field of BALANCE_FIELDS]}.
+    """
+
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.orders = {symbol: {} for symbol in SYMBOLS}
+        self.wallets = {}
+        self.balances = {}
+
+    def apply(self, event):
+        orders = self.orders[event.symbol]
+        if event.kind == ORDER_ACCEPTED:
+            orders[event.a] = [event.b, event.side, event.c, event.d, 0]
+        elif event.kind == ORDER_CANCELLED:
+            orders.pop(event.a, None)
+        elif event.kind == ORDER_FILLED:
+            for order_id in (event.a, event.b):
+                order = orders.get(order_id)
+                if order is not None:
+                    order[4] += event.d
+                    if order[4] >= order[3]:
+                        del orders[order_id]
+        elif event.kind == WALLET_DELTA:
+            wallet = self.wallets.setdefault(event.a, [0] * len(WALLET_FIELDS))
+            wallet[event.b] += event.d
+        elif event.kind == BALANCE_DELTA:
+            balance = self.balances.setdefault((event.a, event.c), [0] * len(BALANCE_FIELDS))
+            balance[event.b] += event.d
+            if not any(balance):
+                # Empty balances are not kept, like in 'from_database()'
+                del self.balances[(event.a, event.c)]
+
+    def order_count(self):
+        return sum(len(orders) for orders in self.orders.values())
+
+    def replay(self, path):
+        """
+        Apply the events of the log written after the current offset.
+
+        :return
+        - Number of events applied.
+        """
+
+        count = 0
+        for offset, event in read_events(path, self.offset):
+            self.apply(event)
+            self.offset = offset
+            count += 1
+        return count
+
+    def save(self, directory):
+        """
+        Write a snapshot of the state, named after its log offset.
+
+        :return
+        - Path of the snapshot.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'snapshot-{self.offset:020d}.bin')
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as snapshot:
+            snapshot.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, self.offset, int(time.time()), self.order_count(), len(self.wallets),
+                len(self.balances)
+            ))
+            snapshot.write(b''.join(
+                SNAPSHOT_ORDER.pack(order_id, profile_id, price, quantity, filled_quantity, side, symbol_index)
+                for symbol_index, symbol in enumerate(SYMBOLS)
+                for order_id, (profile_id, side, price, quantity, filled_quantity) in self.orders[symbol].items()
+            ))
+            snapshot.write(b''.join(
+                SNAPSHOT_WALLET.pack(profile_id, *balances) for profile_id, balances in self.wallets.items()
+            ))
+            snapshot.write(b''.join(
+                SNAPSHOT_BALANCE.pack(profile_id, asset_index, *balances)
+                for (profile_id, asset_index), balances in self.balances.items()
+            ))
+        # The snapshot appears only once complete
+        os.replace(temporary_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as snapshot:
+            data = snapshot.read()
+        magic = data[:len(SNAPSHOT_MAGIC)]
+        if magic == SNAPSHOT_V2_MAGIC:
+            raise ValueError(f'{path} has no symbols, take a new snapshot with --from-database')
+        if magic == SNAPSHOT_V1_MAGIC:
+            magic, offset, timestamp, orders, wallets = SNAPSHOT_V1_HEADER.unpack_from(data)
+            balances = 0
+            position = SNAPSHOT_V1_HEADER.size
+            order_struct = SNAPSHOT_V1_ORDER
+        else:
+            magic, offset, timestamp, orders, wallets, balances = SNAPSHOT_HEADER.unpack_from(data)
+            position = SNAPSHOT_HEADER.size
+            order_struct = SNAPSHOT_ORDER
+        if magic != SNAPSHOT_MAGIC and magic != SNAPSHOT_V1_MAGIC:
+            raise ValueError(f'{path} is not a snapshot')
+
+        state = cls(offset)
+        default_index = SYMBOLS.index(DEFAULT_SYMBOL)
+        for order_id, profile_id, price, quantity, filled_quantity, side, *symbol_index in order_struct.iter_unpack(
+                data[position:position + orders * order_struct.size]):
+            symbol = SYMBOLS[symbol_index[0] if symbol_index else default_index]
+            state.orders[symbol][order_id] = [profile_id, side, price, quantity, filled_quantity]
+        position += orders * order_struct.size
+        for profile_id, *wallet_balances in SNAPSHOT_WALLET.iter_unpack(
+                data[position:position + wallets * SNAPSHOT_WALLET.size]):
+            state.wallets[profile_id] = wallet_balances
+        position += wallets * SNAPSHOT_WALLET.size
+        for profile_id, asset_index, *asset_balances in SNAPSHOT_BALANCE.iter_unpack(
+                data[position:position + balances * SNAPSHOT_BALANCE.size]):
+            state.balances[(profile_id, asset_index)] = asset_balances
+        return state
+
+    @classmethod
+    def from_database(cls, offset):
+        """
+        Return the current state of the database, to be used as the first snapshot.
+        The log must not be written while the state is read.
+        """
+
+        state = cls(offset)
+        orders = Order.objects.filter(status=True).values_list(
+            'pk', 'symbol', 'profile_id', 'type', 'price', 'quantity', 'filled_quantity'
+        )
+        for order_id, symbol, profile_id, order_type, price, quantity, filled_quantity in orders.iterator():
+            state.orders[symbol][order_id] = [profile_id, order_type.encode(), price, quantity, filled_quantity]
+        for profile_id, *balances in Wallet.objects.values_list('profile_id', *WALLET_FIELDS).iterator():
+            state.wallets[profile_id] = balances
+        for profile_id, asset, *balances in Balance.objects.values_list('profile_id', 'asset', *BALANCE_FIELDS).iterator():
+            if any(balances):
+                state.balances[(profile_id, ASSETS.index(asset))] = balances
+        return state
+
+
+def get_snapshots(directory):
+    """
+    Return the paths of the snapshots of a directory, sorted by log offset.
+    """
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    names = sorted(name for name in names if name.startswith('snapshot-') and name.endswith('.bin'))
+    return [os.path.join(directory, name) for name in names]
+
+
+def get_latest_snapshot(directory):
+    """
+    Return the path of the snapshot with the highest log offset, None if there is no snapshot.
+    """
+
+    snapshots = get_snapshots(directory)
+    return snapshots[-1] if snapshots else None
+
+
+def remove_old_snapshots(directory, keep):
+    for path in get_snapshots(directory)[:-keep]:
+        os.remove(path)
+
+
+def load_state(log_path, snapshot_directory):
+    """
+    Rebuild the state from the latest snapshot and the tail of the log.
+
+    :return
+    - Tuple ('ExchangeState' object, number of events replayed).
+    """
+
+    snapshot_path = get_latest_snapshot(snapshot_directory)
+    state = ExchangeState.load(snapshot_path) if snapshot_path else ExchangeState()
+    return state, state.replay(log_path)
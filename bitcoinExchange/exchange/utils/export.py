@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+from django.db import connection
+from django.db.models import Q
+from exchange.models import Fill, Order, Transaction
+from exchange.utils.aggregations import profile_fill_documents
+from exchange.utils.amounts import SATOSHI
+from exchange.utils.bulk import get_collection
+from exchange.utils.formatting import format_datetime
+from exchange.utils.instruments import get_price_scale
+
+# Rows fetched from the database at a time, the memory used by an export does not depend on its size
+EXPORT_BATCH_SIZE = 1000
+
+# Rows written in each chunk of the response
+EXPORT_CHUNK_ROWS = 500
+
+ORDER_COLUMNS = ['id', 'symbol', 'type', 'kind', 'time_in_force', 'price', 'stop_price', 'quantity',
+                 'filled_quantity', 'status', 'created_at', 'executed_at']
+FILL_COLUMNS = ['id', 'transaction', 'symbol', 'side', 'price', 'quantity', 'aggressor', 'executed_at']
+
+DATASETS = {
+    'orders': ORDER_COLUMNS,
+    'fills': FILL_COLUMNS,
+}
+FORMATS = ('csv', 'ndjson')
+
+
+def order_rows(profile_id):
+    """
+    Yield the orders of a profile oldest first, with the execution datetime of their transaction
+    joined by the same query, read through a server-side cursor.
+    """
+
+    if connection.vendor == 'djongo':
+        pipeline = [
+            {'$match': {'profile_id': profile_id}},
+            {'$sort': {'created_at': 1, 'id': 1}},
+            {'$lookup': {
+                'from': Transaction._meta.db_table, 'localField': 'transaction_id', 'foreignField': 'id',
+                'as': 'transaction'
+            }},
+            {'$project': {
+                '_id': 0, 'id': 1, 'symbol': 1, 'type': 1, 'kind': 1, 'time_in_force': 1, 'price': 1,
+                'stop_price': 1, 'quantity': 1, 'filled_quantity': 1, 'status': 1, 'created_at': 1,
+                'executed_at': {'$arrayElemAt': ['$transaction.executed_at', 0]},
+            }},
+        ]
+        cursor = get_collection(Order).aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE, allowDiskUse=True)
+        rows = ((order.get(column) for column in ORDER_COLUMNS) for order in cursor)
+    else:
+        rows = Order.objects.filter(profile_id=profile_id).order_by('created_at', 'pk').values_list(
+            'pk', 'symbol', 'type', 'kind', 'time_in_force', 'price', 'stop_price', 'quantity', 'filled_quantity',
+            'status', 'created_at', 'transaction__executed_at'
+        ).iterator(chunk_size=EXPORT_BATCH_SIZE)
+
+    for (order_id, symbol, order_type, kind, time_in_force, price, stop_price, quantity, filled_quantity,
+         order_status, created_at, executed_at) in rows:
+        price_scale = get_price_scale(symbol)
+        yield [
+            order_id, symbol, order_type, kind, time_in_force, price / price_scale,
+            stop_price / price_scale if stop_price is not None else None, quantity / SATOSHI,
+            filled_quantity / SATOSHI, order_status, format_datetime(created_at), format_datetime(executed_at)
+        ]
+
+
+def fill_rows(profile_id):
+    """
+    Yield the fills of the orders of a profile oldest first, one row for each side of the profile,
+    read through server-side cursors.
+    """
+
+    if connection.vendor == 'djongo':
+        fills = profile_fill_documents(
+            profile_id, ['transaction_id', 'symbol', 'price', 'quantity', 'aggressor'], batchSize=EXPORT_BATCH_SIZE
+        )
+        rows = (
+            (fill['id'], fill['transaction_id'], fill['symbol'], fill['price'], fill['quantity'], fill['aggressor'],
+             fill['executed_at'], side)
+            for side, fill in fills
+        )
+    else:
+        fills = Fill.objects.filter(
+            Q(buy_order__profile_id=profile_id) | Q(sell_order__profile_id=profile_id)
+        ).order_by('executed_at', 'pk').values_list(
+            'pk', 'transaction_id', 'symbol', 'price', 'quantity', 'aggressor', 'executed_at',
+            'buy_order__profile_id', 'sell_order__profile_id'
+        )
+        rows = (
+            (*fill[:7], side)
+            for fill in fills.iterator(chunk_size=EXPORT_BATCH_SIZE)
+            for side, order_profile_id in (('B', fill[7]), ('S', fill[8])) if order_profile_id == profile_id
+        )
+
+    for fill_id, transaction_id, symbol, price, quantity, aggressor, executed_at, side in rows:
+        yield [fill_id, transaction_id, symbol, side, price / get_price_scale(symbol), quantity / SATOSHI, aggressor,
+               format_datetime(executed_at)]
+
+
+def csv_chunks(columns, rows):
+    """
+    Yield a CSV document as chunks of 'EXPORT_CHUNK_ROWS' rows, the header first.
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(columns, rows):
+    """
+    Yield one JSON object per line, as chunks of 'EXPORT_CHUNK_ROWS' rows.
+    """
+
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row))))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_history(profile_id, dataset='orders', output='csv'):
+    """
+    Return the order or fill history of a profile as a generator of text chunks.
+    Nothing is read before the first chunk is consumed.
+
+    :argument
+    - dataset: 'orders' or 'fills'.
+    - output: 'csv' or 'ndjson'.
+    """
+
+    rows = order_rows(profile_id) if dataset == 'orders' else fill_rows(profile_id)
+    chunks = csv_chunks if output == 'csv' else ndjson_chunks
+    return chunks(DATASETS[dataset], rows)
@@ -0,0 +1,21 @@
+from functools import lru_cache
+
+# Datetime format of the APIs, e.g. '31/12/2021, 23:59:59'
+DATETIME_FORMAT = "%d/%m/%Y, %H:%M:%S"
+
+
+@lru_cache(maxsize=4096)
+def _format_second(value):
+    return value.strftime(DATETIME_FORMAT)
+
+
+def format_datetime(value):
+    """
+    Format a datetime for the APIs, None if it is None.
+    The format has no fraction of a second: the text of each second is formatted once and cached,
+    the orders and fills of a listing are usually created in a few seconds.
+    """
+
+    if value is None:
+        return None
+    return _format_second(value.replace(microsecond=0))
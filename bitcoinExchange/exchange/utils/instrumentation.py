@@ -0,0 +1,227 @@
+import threading
+import time
+from functools import wraps
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """
+    Metrics of the request handled by the current thread.
+
+    :fields
+    - queries: Number of database round-trips.
+    - timings: Seconds spent in 'db', 'signals' and 'matching'.
+    - depth: Nesting level of each timing, only the outermost block is measured.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.timings = {'db': 0.0, 'signals': 0.0, 'matching': 0.0}
+        self.depth = {'db': 0, 'signals': 0, 'matching': 0}
+
+
+def start_request():
+    _local.metrics = RequestMetrics()
+    return _local.metrics
+
+
+def stop_request():
+    metrics = getattr(_local, 'metrics', None)
+    _local.metrics = None
+    return metrics
+
+
+def get_metrics():
+    """
+    Return the metrics of the current request, None if it is not instrumented.
+    """
+
+    return getattr(_local, 'metrics', None)
+
+
+class timed:
+    """
+    Add the time spent in a block or a function to a timing of the current request.
+    Nothing is measured outside of instrumented requests.
+
+    :argument
+    - name: 'db', 'signals' or 'matching'.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.depth[self.name] += 1
+            if metrics.depth[self.name] == 1:
+                self.start = time.perf_counter()
+        return metrics
+
+    def __exit__(self, *exc_info):
+        metrics = get_metrics()
+        if metrics is not None and metrics.depth[self.name] > 0:
+            metrics.depth[self.name] -= 1
+            if metrics.depth[self.name] == 0:
+                metrics.timings[self.name] += time.perf_counter() - self.start
+
+    def __call__(self, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(self.name):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting the queries sent through the Django cursor, djongo included.
+    """
+
+    metrics = get_metrics()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    metrics.queries += 1
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+try:
+    from pymongo import monitoring
+except ImportError:
+    monitoring = CommandListener = None
+else:
+    class CommandListener(monitoring.CommandListener):
+        """
+        pymongo command listener counting the operations sent directly to the collections,
+        e.g. the bulk writes of 'exchange.utils.bulk'.
+        The commands sent by djongo are already counted by 'query_wrapper()'.
+        """
+
+        def started(self, event):
+            metrics = get_metrics()
+            if metrics is not None and not metrics.depth['db']:
+                metrics.queries += 1
+
+        def succeeded(self, event):
+            metrics = get_metrics()
+            if metrics is not None and not metrics.depth['db']:
+                metrics.timings['db'] += event.duration_micros / 10 ** 6
+
+        def failed(self, event):
+            self.succeeded(event)
+
+
+_command_listener = None
+
+
+def register_command_listener():
+    """
+    Register the pymongo command listener of the process, once.
+    MongoDB clients only notify the listeners registered before they are created.
+    """
+
+    global _command_listener
+    if CommandListener is not None and _command_listener is None:
+        _command_listener = CommandListener()
+        monitoring.register(_command_listener)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus format.
+
+    :argument
+    - buckets: Sorted upper bounds of the buckets.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Registry:
+    """
+    Per-view histograms of the instrumented requests of the current process.
+    """
+
+    METRICS = (
+        ('exchange_request_duration_seconds', 'Duration of the requests.', SECONDS_BUCKETS),
+        ('exchange_request_queries', 'Database round-trips of the requests.', QUERIES_BUCKETS),
+        ('exchange_request_db_seconds', 'Time spent in the database.', SECONDS_BUCKETS),
+        ('exchange_request_signals_seconds', 'Time spent in the signal handlers.', SECONDS_BUCKETS),
+        ('exchange_request_matching_seconds', 'Time spent matching orders.', SECONDS_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (metric name, view name, method) -> Histogram
+
+    def observe(self, view_name, method, duration, metrics):
+        values = (duration, metrics.queries, metrics.timings['db'], metrics.timings['signals'],
+                  metrics.timings['matching'])
+        with self.lock:
+            for (name, _, buckets), value in zip(self.METRICS, values):
+                key = (name, view_name, method)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(buckets)
+                self.histograms[key].observe(value)
+
+    def render(self):
+        """
+        Return the histograms in the Prometheus text exposition format.
+        """
+
+        lines = []
+        with self.lock:
+            for name, description, _ in self.METRICS:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric_name, view_name, method), histogram in sorted(self.histograms.items()):
+                    if metric_name == name:
+                        lines.extend(histogram.render(name, f'view="{view_name}",method="{method}"'))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {}
+
+
+registry = Registry()
+
+
+def get_server_timing(duration, metrics):
+    """
+    Return the value of the Server-Timing header of a request.
+    """
+
+    return ', '.join([
+        f'db;dur={metrics.timings["db"] * 1000:.2f};desc="{metrics.queries} queries"',
+        f'signals;dur={metrics.timings["signals"] * 1000:.2f}',
+        f'matching;dur={metrics.timings["matching"] * 1000:.2f}',
+        f'total;dur={duration * 1000:.2f}',
+    ])
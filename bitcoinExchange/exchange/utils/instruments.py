@@ -0,0 +1,77 @@
+from collections import namedtuple
+from exchange.utils.amounts import CENT, SATOSHI
+
+# Integer units of each asset in one decimal unit.
+# Base assets must have 8 decimals, like bitcoin, so that 'quote_amount()' works for every instrument.
+ASSET_SCALES = {
+    'USD': CENT,
+    'BTC': SATOSHI,
+    'ETH': SATOSHI,
+}
+ASSETS = tuple(ASSET_SCALES)
+
+# Assets of the original BTC/USD market, their balances are columns of the 'Wallet' model:
+# asset -> suffix of the field names, e.g. 'available_dollar' and 'frozen_dollar'.
+# The balances of the other assets are rows of the 'Balance' model.
+WALLET_ASSETS = {
+    'USD': 'dollar',
+    'BTC': 'bitcoin',
+}
+BALANCE_ASSETS = tuple(asset for asset in ASSETS if asset not in WALLET_ASSETS)
+
+Instrument = namedtuple('Instrument', ['symbol', 'base', 'quote'])
+
+# Traded instruments: the quantity of the orders is in base asset units, the price in quote asset
+# units for one base asset
+INSTRUMENTS = {
+    'BTC-USD': Instrument('BTC-USD', 'BTC', 'USD'),
+    'ETH-USD': Instrument('ETH-USD', 'ETH', 'USD'),
+    'ETH-BTC': Instrument('ETH-BTC', 'ETH', 'BTC'),
+}
+SYMBOLS = tuple(INSTRUMENTS)
+DEFAULT_SYMBOL = 'BTC-USD'
+
+
+def get_instrument(symbol):
+    return INSTRUMENTS[symbol]
+
+
+def get_price_scale(symbol):
+    return ASSET_SCALES[INSTRUMENTS[symbol].quote]
+
+
+def balance_field(state, asset):
+    """
+    Return the name used in the balance deltas for the available or frozen balance of an asset,
+    e.g. 'available_dollar' for a wallet column or 'available_eth' for a 'Balance' row.
+
+    :argument
+    - state: 'available' or 'frozen'.
+    - asset: e.g. 'USD'.
+    """
+
+    return f'{state}_{WALLET_ASSETS.get(asset, asset.lower())}'
+
+
+def parse_balance_field(name):
+    """
+    Return the (state, asset) tuple of a balance delta name of a 'Balance' row, None for the
+    fields of the wallet.
+    """
+
+    state, _, suffix = name.partition('_')
+    asset = suffix.upper()
+    if state not in ('available', 'frozen') or asset not in BALANCE_ASSETS:
+        return None
+    return state, asset
+
+
+def get_shard(symbol, shards):
+    """
+    Return the matching engine shard that owns the book of a symbol.
+
+    :argument
+    - shards: Number of matching engine processes.
+    """
+
+    return SYMBOLS.index(symbol) % shards
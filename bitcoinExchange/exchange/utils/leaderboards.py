@@ -0,0 +1,233 @@
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.utils import timezone
+from exchange.models import Fill, Leaderboards, Order, Profile, TraderStatistics, Wallet
+from exchange.utils.aggregations import market_statistics
+from exchange.utils.amounts import SATOSHI, from_cents, quote_amount
+from exchange.utils.bulk import bulk_increment, get_collection
+from exchange.utils.formatting import format_datetime
+from exchange.utils.instruments import SYMBOLS, get_instrument, get_price_scale
+
+LEADERBOARDS_ID = 'leaderboards'
+
+# Fill ids are assigned before the trade commits, so a missing id could still appear after a higher one
+# has been read. A gap is skipped only once the fill after it is older than this: the trade of the missing
+# id has been committed by then, or never will be.
+FILL_SETTLE_DELAY = timedelta(seconds=5)
+
+
+def dollar_volume(symbol, quantity, price):
+    # Only the instruments quoted in dollars count for the volume leaderboard
+    return quote_amount(quantity, price) if get_instrument(symbol).quote == 'USD' else 0
+
+
+def new_fill_deltas(cursor, until):
+    """
+    Sum the fills added after the cursor by profile, both counterparties of each fill included.
+    The fills are read in id order and the cursor only moves past consecutive ids, or past a gap followed by
+    a fill executed before 'until'. On MongoDB the profiles of the orders are joined by the server in one
+    pipeline.
+
+    :argument
+    - cursor: Id of the last fill already counted.
+    - until: Datetime before which a missing id is not waited for anymore.
+
+    :return
+    - Tuple (id of the last fill counted, {profile id: {'trades': n, 'dollar_volume': cents}},
+      {'trades': n, 'dollar_volume': cents} of the exchange).
+    """
+
+    if connection.vendor == 'djongo':
+        # pymongo returns naive UTC datetimes
+        until = timezone.make_naive(until, timezone.utc)
+        orders = Order._meta.db_table
+        pipeline = [
+            {'$match': {'id': {'$gt': cursor}}},
+            {'$sort': {'id': 1}},
+            {'$lookup': {'from': orders, 'localField': 'buy_order_id', 'foreignField': 'id', 'as': 'buy_order'}},
+            {'$lookup': {'from': orders, 'localField': 'sell_order_id', 'foreignField': 'id', 'as': 'sell_order'}},
+            {'$project': {
+                '_id': 0, 'id': 1, 'symbol': 1, 'price': 1, 'quantity': 1, 'executed_at': 1,
+                'buyer_id': {'$arrayElemAt': ['$buy_order.profile_id', 0]},
+                'seller_id': {'$arrayElemAt': ['$sell_order.profile_id', 0]},
+            }},
+        ]
+        rows = (
+            (fill['id'], fill['symbol'], fill['price'], fill['quantity'], fill['executed_at'], fill['buyer_id'],
+             fill['seller_id'])
+            for fill in get_collection(Fill).aggregate(pipeline)
+        )
+    else:
+        rows = Fill.objects.filter(pk__gt=cursor).order_by('pk').values_list(
+            'pk', 'symbol', 'price', 'quantity', 'executed_at', 'buy_order__profile_id', 'sell_order__profile_id'
+        ).iterator()
+
+    deltas = {}
+    totals = {'trades': 0, 'dollar_volume': 0}
+    for fill_id, symbol, price, quantity, executed_at, buyer_id, seller_id in rows:
+        if fill_id != cursor + 1 and executed_at >= until:
+            break
+        cursor = fill_id
+        amount = dollar_volume(symbol, quantity, price)
+        totals['trades'] += 1
+        totals['dollar_volume'] += amount
+        for profile_id in {buyer_id, seller_id}:
+            profile_deltas = deltas.setdefault(profile_id, {'trades': 0, 'dollar_volume': 0})
+            profile_deltas['trades'] += 1
+            profile_deltas['dollar_volume'] += amount
+    return cursor, deltas, totals
+
+
+def update_trader_statistics(deltas):
+    """
+    Add the deltas to the running totals of the profiles, creating the rows of the new traders.
+    """
+
+    existing = set(TraderStatistics.objects.filter(pk__in=list(deltas)).values_list('pk', flat=True))
+    TraderStatistics.objects.bulk_create(
+        [TraderStatistics(profile_id=profile_id) for profile_id in deltas if profile_id not in existing],
+        batch_size=1000
+    )
+    bulk_increment(TraderStatistics, 'profile_id', deltas)
+
+
+def get_usernames(profile_ids):
+    return dict(Profile.objects.filter(pk__in=list(profile_ids)).values_list('pk', 'user__username'))
+
+
+def profit_leaderboard(size):
+    """
+    Rank the profiles by the bitcoin profit percent of 'ProfileSerializer', sorted by the database.
+
+    :return
+    - List of dicts with rank, username and bitcoin_profit_percent, best first.
+    """
+
+    if connection.vendor == 'djongo':
+        pipeline = [
+            {'$match': {'bitcoin_net_balance': {'$gt': 0}}},
+            {'$project': {'_id': 0, 'profile_id': 1, 'profit': {'$divide': [
+                {'$subtract': [{'$add': ['$available_bitcoin', '$frozen_bitcoin']}, '$bitcoin_net_balance']},
+                '$bitcoin_net_balance',
+            ]}}},
+            {'$sort': {'profit': -1, 'profile_id': 1}},
+            {'$limit': size},
+        ]
+        rows = [(row['profile_id'], row['profit']) for row in get_collection(Wallet).aggregate(pipeline)]
+    else:
+        profit = ExpressionWrapper(
+            (F('available_bitcoin') + F('frozen_bitcoin') - F('bitcoin_net_balance')) * 1.0
+            / F('bitcoin_net_balance'),
+            output_field=FloatField()
+        )
+        rows = list(Wallet.objects.filter(bitcoin_net_balance__gt=0).annotate(profit=profit).order_by(
+            '-profit', 'profile_id'
+        ).values_list('profile_id', 'profit')[:size])
+
+    usernames = get_usernames(profile_id for profile_id, profit in rows)
+    return [
+        {'rank': rank, 'username': usernames.get(profile_id), 'bitcoin_profit_percent': round(profit * 100, 2)}
+        for rank, (profile_id, profit) in enumerate(rows, 1)
+    ]
+
+
+def volume_leaderboard(size):
+    """
+    Rank the profiles by the dollars they executed, read from the running totals by index.
+
+    :return
+    - List of dicts with rank, username, trades and dollar_volume, best first.
+    """
+
+    rows = list(TraderStatistics.objects.order_by('-dollar_volume', 'profile_id').values_list(
+        'profile_id', 'trades', 'dollar_volume'
+    )[:size])
+    usernames = get_usernames(profile_id for profile_id, trades, amount in rows)
+    return [
+        {'rank': rank, 'username': usernames.get(profile_id), 'trades': trades, 'dollar_volume': from_cents(amount)}
+        for rank, (profile_id, trades, amount) in enumerate(rows, 1)
+    ]
+
+
+def profile_totals():
+    # Number of profiles and their active orders, from the counters kept by the order signals
+    if connection.vendor == 'djongo':
+        pipeline = [{'$group': {'_id': None, 'users': {'$sum': 1}, 'active_orders': {'$sum': '$active_orders'}}}]
+        totals = next(get_collection(Profile).aggregate(pipeline), {})
+    else:
+        totals = Profile.objects.aggregate(users=Count('pk'), active_orders=Sum('active_orders'))
+    return totals.get('users') or 0, totals.get('active_orders') or 0
+
+
+def market_summaries(since):
+    """
+    Return the statistics of every instrument since a datetime, in the decimal units of the API.
+    """
+
+    markets = {}
+    for symbol in SYMBOLS:
+        statistics = market_statistics(since, symbol)
+        price_scale = get_price_scale(symbol)
+        markets[symbol] = {
+            'trades': statistics['trades'],
+            'volume': statistics['quantity'] / SATOSHI,
+            'amount': statistics['dollar_amount'] / price_scale,
+        }
+        for name in ('last_price', 'best_bid', 'best_ask', 'spread'):
+            markets[symbol][name] = statistics[name] / price_scale if statistics[name] is not None else None
+    return markets
+
+
+def empty_leaderboards():
+    return {'computed_at': None, 'profit': [], 'volume': [], 'exchange': None}
+
+
+def compute_leaderboards():
+    """
+    Add the new fills to the running totals of the traders, then rewrite the leaderboards document.
+    Only the fills executed since the previous run are read, the rankings are read from the database
+    already sorted and limited to 'EXCHANGE_LEADERBOARD_SIZE'.
+
+    :return
+    - Number of fills added.
+    """
+
+    leaderboards = Leaderboards.objects.filter(pk=LEADERBOARDS_ID).first() or Leaderboards(id=LEADERBOARDS_ID)
+    now = timezone.now()
+    cursor, deltas, totals = new_fill_deltas(leaderboards.fill_cursor, now - FILL_SETTLE_DELAY)
+    update_trader_statistics(deltas)
+    leaderboards.fill_cursor = cursor
+    leaderboards.trades += totals['trades']
+    leaderboards.dollar_volume += totals['dollar_volume']
+
+    users, active_orders = profile_totals()
+    size = settings.EXCHANGE_LEADERBOARD_SIZE
+    data = {
+        'computed_at': format_datetime(now),
+        'profit': profit_leaderboard(size),
+        'volume': volume_leaderboard(size),
+        'exchange': {
+            'users': users,
+            'active_orders': active_orders,
+            'trades': leaderboards.trades,
+            'dollar_volume': from_cents(leaderboards.dollar_volume),
+            'markets': market_summaries(now - timedelta(days=1)),
+        },
+    }
+
+    leaderboards.data = json.dumps(data)
+    leaderboards.computed_at = now
+    leaderboards.save()
+    return totals['trades']
+
+
+def get_leaderboards():
+    """
+    Return the last leaderboards document, with one lookup by primary key.
+    """
+
+    data = Leaderboards.objects.filter(pk=LEADERBOARDS_ID).values_list('data', flat=True).first()
+    return json.loads(data) if data is not None else empty_leaderboards()
@@ -0,0 +1,203 @@
+from django.db import connection
+from django.db.models import F
+from exchange.models import Balance, Wallet
+from exchange.utils.amounts import quote_amount
+from exchange.utils.bulk import get_collection
+from exchange.utils.event_log import record_events, wallet_deltas
+from exchange.utils.instruments import balance_field, get_instrument, parse_balance_field
+from exchange.utils.market_data import publish_wallet_deltas
+from exchange.utils.profile_stats import invalidate_profiles
+
+
+class InsufficientBalance(Exception):
+    """
+    The wallet balance is not enough to apply the deltas.
+
+    :fields
+    - profile_id: Primary key of the profile whose balance is not enough, None if unknown.
+    """
+
+    def __init__(self, message='insufficient balance', profile_id=None):
+        super().__init__(message)
+        self.profile_id = profile_id
+
+
+def split_deltas(deltas):
+    """
+    Split the balance deltas of a wallet between the wallet columns and the 'Balance' rows.
+
+    :argument
+    - deltas: Dict {field name: delta}, e.g. {'available_dollar': -1000, 'available_eth': 500}.
+
+    :return
+    - Tuple ({field name: delta} of the wallet, {asset: {'available'/'frozen': delta}} of the balances).
+    """
+
+    wallet_field_deltas = {}
+    asset_deltas = {}
+    for name, delta in deltas.items():
+        parsed = parse_balance_field(name)
+        if parsed is None:
+            wallet_field_deltas[name] = delta
+        else:
+            state, asset = parsed
+            asset_deltas.setdefault(asset, {})[state] = delta
+    return wallet_field_deltas, asset_deltas
+
+
+def increment(model, lookup, deltas, guarded=True, create=False):
+    """
+    Apply deltas to one document as a single atomic update.
+    If guarded, the update is applied only if no balance decreased by the deltas becomes negative.
+    If create, a missing document is created with its default values when the deltas are only credits,
+    then updated: a raw upsert would miss the id that djongo assigns.
+
+    :return
+    - True if the document has been updated.
+    """
+
+    guards = {name: -delta for name, delta in deltas.items() if delta < 0} if guarded else {}
+
+    def update():
+        if connection.vendor == 'djongo':
+            query = dict(lookup)
+            query.update({name: {'$gte': amount} for name, amount in guards.items()})
+            return bool(get_collection(model).update_one(query, {'$inc': dict(deltas)}).matched_count)
+
+        lookups = {f'{name}__gte': amount for name, amount in guards.items()}
+        updates = {name: F(name) + delta for name, delta in deltas.items()}
+        return bool(model.objects.filter(**lookup, **lookups).update(**updates))
+
+    if update():
+        return True
+    if create and not guards:
+        model.objects.get_or_create(**lookup)
+        return update()
+    return False
+
+
+def wallet_updates(profile_id, deltas):
+    """
+    Return the increments that apply balance deltas to one wallet and to its 'Balance' rows.
+
+    :return
+    - List of (model, lookup, {field name: delta}) tuples.
+    """
+
+    wallet_field_deltas, asset_deltas = split_deltas(deltas)
+    updates = [(Wallet, {'profile_id': profile_id}, wallet_field_deltas)] if wallet_field_deltas else []
+    updates.extend(
+        (Balance, {'profile_id': profile_id, 'asset': asset}, state_deltas)
+        for asset, state_deltas in asset_deltas.items()
+    )
+    return updates
+
+
+def apply_updates(updates):
+    """
+    Apply guarded increments one after the other, the increments already applied are reverted if one of
+    them fails. A missing 'Balance' row is created for a credit, e.g. of an asset listed after the wallet.
+
+    :raise
+    - InsufficientBalance: No increment has been applied.
+    """
+
+    for index, (model, lookup, model_deltas) in enumerate(updates):
+        if not increment(model, lookup, model_deltas, create=model is Balance):
+            for applied_model, applied_lookup, applied_deltas in updates[:index]:
+                increment(applied_model, applied_lookup, {name: -delta for name, delta in applied_deltas.items()},
+                          guarded=False)
+            raise InsufficientBalance('insufficient balance', lookup['profile_id'])
+
+
+def update_wallet(profile_id, deltas):
+    """
+    Apply balance deltas to one wallet as a single atomic conditional update.
+    The update is applied only if no balance decreased by the deltas becomes negative.
+    Deltas of the 'Balance' rows are applied with one conditional update for each asset, the
+    updates already applied are reverted if one of them fails.
+
+    :argument
+    - profile_id: Primary key of the 'Profile' object that owns the wallet.
+    - deltas: Dict {field name: delta}, e.g. {'available_dollar': -1000, 'frozen_dollar': 1000}.
+
+    :raise
+    - InsufficientBalance: The wallet has not been updated.
+    """
+
+    apply_updates(wallet_updates(profile_id, deltas))
+    record_events(wallet_deltas({profile_id: deltas}))
+    invalidate_profiles([profile_id])
+    publish_wallet_deltas({profile_id: deltas})
+
+
+def update_wallets(deltas):
+    """
+    Apply the balance deltas of a trade to several wallets, with the same guard of 'update_wallet()'.
+    The amounts spent by a trade have already been frozen by its orders, a frozen balance that would
+    become negative means the trade is not backed by its orders: nothing is written then.
+
+    :argument
+    - deltas: Dict {profile id: {field name: delta}}.
+
+    :raise
+    - InsufficientBalance: No wallet has been updated.
+    """
+
+    apply_updates([
+        update for profile_id, field_deltas in deltas.items() for update in wallet_updates(profile_id, field_deltas)
+    ])
+    record_events(wallet_deltas(deltas))
+    invalidate_profiles(deltas)
+    publish_wallet_deltas(deltas)
+
+
+def frozen_amount(order, quantity):
+    """
+    Return the amount frozen to fulfill a quantity of an order: quote asset units for a buy order,
+    e.g. cents, base asset units for a sell order, e.g. satoshis.
+
+    :argument
+    - order: Must be an 'Order' object.
+    - quantity: Base asset units.
+    """
+
+    if order.type == 'B':
+        return quote_amount(quantity, order.price)
+    return quantity
+
+
+def order_deltas(order, amount):
+    """
+    Return the deltas that freeze an amount for an order.
+    The opposite deltas unfreeze it.
+
+    :argument
+    - order: Must be an 'Order' object.
+    - amount: Amount returned by 'frozen_amount()'.
+    """
+
+    instrument = get_instrument(order.symbol)
+    asset = instrument.quote if order.type == 'B' else instrument.base
+    return {balance_field('available', asset): -amount, balance_field('frozen', asset): amount}
+
+
+def freeze_order(order):
+    """
+    Freeze the amount needed to fulfill a new order.
+
+    :raise
+    - InsufficientBalance: The available balance is not enough.
+    """
+
+    update_wallet(order.profile_id, order_deltas(order, frozen_amount(order, order.quantity)))
+
+
+def unfreeze_order(order):
+    """
+    Unfreeze the amount needed to fulfill the remaining quantity of an order.
+    """
+
+    amount = frozen_amount(order, order.quantity) - frozen_amount(order, order.filled_quantity)
+    deltas = order_deltas(order, amount)
+    update_wallet(order.profile_id, {name: -delta for name, delta in deltas.items()})
@@ -0,0 +1,86 @@
+from exchange.utils.amounts import from_cents, from_satoshi
+from exchange.utils.broker import broker
+from exchange.utils.instruments import get_price_scale
+
+# Broker channels
+BOOK_CHANNEL = 'book'
+TRADES_CHANNEL = 'trades'
+
+
+def get_profile_channel(profile_id):
+    return f'profile:{profile_id}'
+
+
+def publish_book_levels(book, levels):
+    """
+    Publish the aggregated quantity of the changed price levels, 0 if a level is now empty.
+
+    :argument
+    - book: The 'OrderBook' object.
+    - levels: Iterable of (order type, price) tuples.
+    """
+
+    if not broker.has_subscribers():
+        return
+    price_scale = get_price_scale(book.symbol)
+    for order_type, price in set(levels):
+        broker.publish(BOOK_CHANNEL, {
+            'type': 'book',
+            'symbol': book.symbol,
+            'side': 'bids' if order_type == 'B' else 'asks',
+            'price': price / price_scale,
+            'quantity': from_satoshi(book.side(order_type).level_quantity(price)),
+        })
+
+
+def publish_fills(fills):
+    """
+    Publish the trade prints and the updated orders to their owners.
+
+    :argument
+    - fills: Iterable of 'Fill' objects.
+    """
+
+    if not broker.has_subscribers():
+        return
+    for fill in fills:
+        broker.publish(TRADES_CHANNEL, {
+            'type': 'trade',
+            'symbol': fill.symbol,
+            'price': fill.price / get_price_scale(fill.symbol),
+            'quantity': from_satoshi(fill.quantity),
+            'aggressor': fill.aggressor,
+        })
+        for order in (fill.buy_order, fill.sell_order):
+            publish_order(order)
+
+
+def publish_order(order):
+    if not broker.has_subscribers():
+        return
+    broker.publish(get_profile_channel(order.profile_id), {
+        'type': 'order',
+        'id': order.pk,
+        'status': order.status,
+        'filled_quantity': from_satoshi(order.filled_quantity),
+    })
+
+
+def publish_wallet_deltas(deltas):
+    """
+    Publish the balance deltas applied to the wallets to their owners.
+
+    :argument
+    - deltas: Dict {profile id: {field name: delta}}.
+    """
+
+    if not broker.has_subscribers():
+        return
+    for profile_id, field_deltas in deltas.items():
+        broker.publish(get_profile_channel(profile_id), {
+            'type': 'wallet',
+            'deltas': {
+                name: from_cents(delta) if name.endswith('_dollar') else from_satoshi(delta)
+                for name, delta in field_deltas.items()
+            },
+        })
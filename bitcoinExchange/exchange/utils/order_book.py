@@ -0,0 +1,224 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict
+from exchange.utils.aggregations import get_book_orders
+from exchange.utils.instruments import DEFAULT_SYMBOL, SYMBOLS
+
+
+class BookSide:
+    """
+    One side of the order book.
+    Price levels are kept sorted by priority and each level is a FIFO queue of orders.
+
+    :argument
+    - descending: True for the buy side (best price is the highest), False for the sell side.
+    - price_field: Order field the levels are indexed by.
+    """
+
+    def __init__(self, descending, price_field='price'):
+        self.descending = descending
+        self.price_field = price_field
+        self.keys = []  # Sorted priority keys, the best price level first
+        self.levels = {}  # Priority key -> OrderedDict(order pk -> order)
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels.values())
+
+    def __iter__(self):
+        for key in self.keys:
+            yield from self.levels[key].values()
+
+    def _key(self, price):
+        return -price if self.descending else price
+
+    def price(self, key):
+        return -key if self.descending else key
+
+    def add(self, order):
+        key = self._key(getattr(order, self.price_field))
+        level = self.levels.get(key)
+        if level is None:
+            level = self.levels[key] = OrderedDict()
+            insort(self.keys, key)
+        level[order.pk] = order
+
+    def remove(self, order):
+        key = self._key(getattr(order, self.price_field))
+        level = self.levels.get(key)
+        if level is None or level.pop(order.pk, None) is None:
+            return False
+        if not level:
+            del self.levels[key]
+            del self.keys[bisect_left(self.keys, key)]
+        return True
+
+    def level(self, price):
+        # Orders of a price level, oldest first
+        return list(self.levels.get(self._key(price), {}).values())
+
+    def level_quantity(self, price):
+        level = self.levels.get(self._key(price), {})
+        return sum(order.remaining_quantity for order in level.values())
+
+    def crossing(self, price):
+        """
+        Iterate the orders that can be matched with an opposite order at the given price,
+        following price-time priority.
+        """
+
+        limit = self._key(price)
+        for key in self.keys:
+            if key > limit:
+                break
+            yield from self.levels[key].values()
+
+    def clear(self):
+        self.keys = []
+        self.levels = {}
+
+
+class OrderBook:
+    """
+    In-memory price-time priority order book of the active orders of one instrument.
+
+    :fields
+    - symbol: Instrument of the orders, e.g. 'BTC-USD'.
+    - bids: Buy side, best (highest) price first.
+    - asks: Sell side, best (lowest) price first.
+    - loaded: True once the book has been rebuilt from the active 'Order' objects.
+    """
+
+    def __init__(self, symbol=DEFAULT_SYMBOL):
+        self.symbol = symbol
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.loaded = False
+
+    def side(self, order_type):
+        return self.bids if order_type == 'B' else self.asks
+
+    def opposite(self, order_type):
+        return self.asks if order_type == 'B' else self.bids
+
+    def load(self, orders):
+        """
+        Rebuild the book from an iterable of active orders sorted by creation date.
+        """
+
+        self.clear()
+        for order in orders:
+            self.add(order)
+        self.loaded = True
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+
+    def reset(self):
+        # Discard the book, it will be rebuilt from the database on the next access
+        self.clear()
+        self.loaded = False
+
+    def add(self, order):
+        self.side(order.type).add(order)
+
+    def remove(self, order):
+        return self.side(order.type).remove(order)
+
+    def reload_level(self, order_type, price):
+        """
+        Replace a price level with the active orders of the database, once another process has
+        executed or canceled some of its orders.
+        """
+
+        side = self.side(order_type)
+        for order in side.level(price):
+            side.remove(order)
+        orders = get_book_orders().filter(symbol=self.symbol, type=order_type, price=price)
+        for order in orders.order_by('created_at', 'pk'):
+            side.add(order)
+
+    def sync_crossing(self, order):
+        """
+        Reload the price levels that can be matched with an order and differ from the active orders of
+        the database, e.g. with the orders created by another process since the book was loaded.
+        Only the ids and prices of the crossing orders are read.
+        """
+
+        opposite_type = 'S' if order.type == 'B' else 'B'
+        side = self.opposite(order.type)
+        price_lookup = 'price__lte' if order.type == 'B' else 'price__gte'
+        database_levels = defaultdict(set)
+        orders = get_book_orders().filter(symbol=self.symbol, type=opposite_type, **{price_lookup: order.price})
+        for order_id, price in orders.values_list('pk', 'price').iterator():
+            database_levels[price].add(order_id)
+        book_levels = defaultdict(set)
+        for resting_order in side.crossing(order.price):
+            book_levels[resting_order.price].add(resting_order.pk)
+        for price in database_levels.keys() | book_levels.keys():
+            if database_levels[price] != book_levels[price]:
+                self.reload_level(opposite_type, price)
+
+    def best_match(self, order):
+        """
+        Return the resting order with the best price-time priority that can be matched with
+        the given order, or None.
+        Orders of the same profile are skipped and quantities must be equal.
+        """
+
+        for resting_order in self.opposite(order.type).crossing(order.price):
+            if resting_order.profile_id != order.profile_id and resting_order.quantity == order.quantity:
+                return resting_order
+        return None
+
+    def can_fill(self, order):
+        """
+        Return True if the whole remaining quantity of the order can be matched right now.
+        """
+
+        return sum(quantity for resting_order, quantity in self.sweep(order)) >= order.remaining_quantity
+
+    def sweep(self, order):
+        """
+        Return the resting orders that can be matched with the given order, across as many
+        price levels as needed to fill its remaining quantity.
+        Orders of the same profile are skipped.
+
+        :return
+        - List of ('Order' object, quantity to execute) tuples, following price-time priority.
+        """
+
+        fills = []
+        remaining_quantity = order.remaining_quantity
+        for resting_order in self.opposite(order.type).crossing(order.price):
+            if remaining_quantity <= 0:
+                break
+            if resting_order.profile_id != order.profile_id:
+                quantity = min(remaining_quantity, resting_order.remaining_quantity)
+                fills.append((resting_order, quantity))
+                remaining_quantity -= quantity
+        return fills
+
+
+# One book for each instrument, a matching engine shard only loads the books of its symbols
+order_books = {symbol: OrderBook(symbol) for symbol in SYMBOLS}
+order_book = order_books[DEFAULT_SYMBOL]
+
+
+def get_order_book(symbol=DEFAULT_SYMBOL):
+    """
+    Return the order book of an instrument in the current process.
+    The book is rebuilt from the active orders of the instrument the first time it is accessed. Other
+    web workers can create, execute or cancel its orders afterwards: the levels crossed by a new order
+    are synchronized with the database before it is matched, see 'OrderBook.sync_crossing()', and the
+    trades write an order only if it is still active in the database, reloading its price level otherwise.
+    """
+
+    book = order_books[symbol]
+    if not book.loaded:
+        book.load(get_book_orders().filter(symbol=symbol).order_by('created_at', 'pk'))
+    return book
+
+
+def reset_order_books():
+    for book in order_books.values():
+        book.reset()
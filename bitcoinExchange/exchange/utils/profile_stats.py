@@ -0,0 +1,41 @@
+from django.core.cache import cache
+from exchange.models import Profile
+from exchange.utils.bulk import bulk_increment
+
+
+def get_cache_key(profile_id):
+    return f'exchange:profile:{profile_id}'
+
+
+def invalidate_profiles(profile_ids):
+    """
+    Discard the cached statistics of the given profiles.
+    """
+
+    cache.delete_many([get_cache_key(profile_id) for profile_id in set(profile_ids)])
+
+
+def update_order_counters(deltas):
+    """
+    Update the order counters of several profiles in one batched operation.
+
+    :argument
+    - deltas: Dict {profile id: {'active_orders': delta, 'executed_orders': delta}}.
+    """
+
+    bulk_increment(Profile, 'id', deltas)
+    invalidate_profiles(deltas)
+
+
+def executed_order_deltas(orders):
+    """
+    Return the counter deltas of the orders that have just been executed.
+    """
+
+    deltas = {}
+    for order in orders:
+        if not order.status:
+            profile_deltas = deltas.setdefault(order.profile_id, {'active_orders': 0, 'executed_orders': 0})
+            profile_deltas['active_orders'] -= 1
+            profile_deltas['executed_orders'] += 1
+    return deltas
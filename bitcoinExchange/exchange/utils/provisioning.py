@@ -0,0 +1,77 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from exchange.models import Balance, Profile, Wallet, get_initial_bitcoin
+from exchange.utils.event_log import WALLET_FIELDS, record_events, wallet_deltas
+from exchange.utils.instruments import BALANCE_ASSETS
+
+
+def new_wallet(profile_id, available_bitcoin=None):
+    """
+    Return a new unsaved wallet, with the net balance already set to the initial bitcoin amount.
+    """
+
+    if available_bitcoin is None:
+        available_bitcoin = get_initial_bitcoin()
+    return Wallet(profile_id=profile_id, available_bitcoin=available_bitcoin, bitcoin_net_balance=available_bitcoin)
+
+
+def new_balances(profile_ids):
+    # Empty balances of the assets that are not wallet columns, trades only increment existing rows
+    return [Balance(profile_id=profile_id, asset=asset) for profile_id in profile_ids for asset in BALANCE_ASSETS]
+
+
+def get_balances(wallets):
+    # Initial balances of new wallets as deltas for the event log
+    return {wallet.profile_id: {name: getattr(wallet, name) for name in WALLET_FIELDS} for wallet in wallets}
+
+
+def create_account(user):
+    """
+    Create the profile, the wallet and the asset balances of a new user, with one write each.
+
+    :argument
+    - user: Must be a saved 'User' object.
+
+    :return
+    - The 'Profile' object created.
+    """
+
+    profile = Profile.objects.create(user=user)
+    wallet = new_wallet(profile.pk)
+    wallet.save(force_insert=True)
+    Balance.objects.bulk_create(new_balances([profile.pk]))
+    record_events(wallet_deltas(get_balances([wallet])))
+    return profile
+
+
+def bulk_create_users(usernames, password, batch_size=1000):
+    """
+    Create several users with their profiles, wallets and asset balances.
+    Each batch costs one insert for the users, one for the profiles, one for the wallets and one for the balances,
+    plus one read for each of the first two because bulk inserts do not return the primary keys.
+    The password is hashed once and shared by all the users.
+
+    :argument
+    - usernames: Iterable of new usernames.
+    - password: Raw password of every user.
+    - batch_size: Users created at once.
+
+    :return
+    - Number of users created.
+    """
+
+    password = make_password(password)
+    usernames = list(usernames)
+    for start in range(0, len(usernames), batch_size):
+        batch = usernames[start:start + batch_size]
+        User.objects.bulk_create([User(username=username, password=password) for username in batch])
+
+        user_ids = list(User.objects.filter(username__in=batch).values_list('pk', flat=True))
+        Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in user_ids])
+
+        profile_ids = list(Profile.objects.filter(user_id__in=user_ids).values_list('pk', flat=True))
+        wallets = [new_wallet(profile_id) for profile_id in profile_ids]
+        Wallet.objects.bulk_create(wallets)
+        Balance.objects.bulk_create(new_balances(profile_ids))
+        record_events(wallet_deltas(get_balances(wallets)))
+    return len(usernames)
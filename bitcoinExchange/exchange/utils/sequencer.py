@@ -0,0 +1,206 @@
+import os
+import sqlite3
+from django.conf import settings
+from exchange.models import Order
+from exchange.utils.instruments import SYMBOLS, get_shard
+from exchange.utils.trade import cancel_order, submit_order
+
+# Event kinds
+NEW_ORDER = 'new'
+CANCEL_ORDER = 'cancel'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    order_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fills (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_seq INTEGER NOT NULL,
+    transaction_id INTEGER NOT NULL,
+    buy_order_id INTEGER NOT NULL,
+    sell_order_id INTEGER NOT NULL,
+    price INTEGER NOT NULL,
+    quantity INTEGER NOT NULL
+);
+"""
+
+
+class OrderQueue:
+    """
+    File-backed FIFO queue between the web workers and the matching engine process.
+    Web workers append order events, the matching engine consumes them in strict sequence
+    and publishes the resulting fills back in the same file.
+    Only the last published fills are kept, so the file does not grow with the trading history.
+
+    :argument
+    - path: Path of the SQLite file, shared by every process on the host.
+    - fills_kept: Number of fills kept, by sequence number.
+    """
+
+    def __init__(self, path, fills_kept=10000):
+        self.path = path
+        self.fills_kept = fills_kept
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        # Each process, e.g. each gunicorn worker, needs its own connection
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def put(self, kind, order_id):
+        """
+        Append an event and return its sequence number.
+        """
+
+        cursor = self.connection.execute('INSERT INTO events (kind, order_id) VALUES (?, ?)', (kind, order_id))
+        return cursor.lastrowid
+
+    def put_many(self, kind, order_ids):
+        """
+        Append several events of the same kind in one SQLite transaction.
+        """
+
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany(
+                'INSERT INTO events (kind, order_id) VALUES (?, ?)', [(kind, order_id) for order_id in order_ids]
+            )
+
+    def pending(self, limit=100):
+        """
+        Return the oldest events not consumed yet as (seq, kind, order_id) tuples.
+        """
+
+        return self.connection.execute(
+            'SELECT seq, kind, order_id FROM events ORDER BY seq LIMIT ?', (limit,)
+        ).fetchall()
+
+    def ack(self, seq, fills=()):
+        """
+        Consume an event and publish its fills in the same SQLite transaction, pruning the fills
+        older than the last 'fills_kept' ones.
+
+        :argument
+        - seq: Sequence number of the event.
+        - fills: Iterable of the 'Fill' objects created by the event.
+        """
+
+        rows = [
+            (seq, fill.transaction_id, fill.buy_order_id, fill.sell_order_id, fill.price, fill.quantity)
+            for fill in fills
+        ]
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany(
+                'INSERT INTO fills (event_seq, transaction_id, buy_order_id, sell_order_id, price, quantity) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self.connection.execute('DELETE FROM events WHERE seq = ?', (seq,))
+            if rows:
+                self.connection.execute(
+                    'DELETE FROM fills WHERE seq <= (SELECT MAX(seq) FROM fills) - ?', (self.fills_kept,)
+                )
+
+    def fills(self, after=0, limit=100):
+        """
+        Return the fills published after the given sequence number as dicts.
+        Fills pruned before they are read are skipped.
+        """
+
+        cursor = self.connection.execute(
+            'SELECT seq, event_seq, transaction_id, buy_order_id, sell_order_id, price, quantity '
+            'FROM fills WHERE seq > ? ORDER BY seq LIMIT ?',
+            (after, limit)
+        )
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_order_queues = {}  # Shard -> OrderQueue
+
+
+def get_queue_path(shard):
+    # The first shard keeps the path of the single matching engine
+    if shard == 0:
+        return settings.EXCHANGE_QUEUE_PATH
+    root, extension = os.path.splitext(settings.EXCHANGE_QUEUE_PATH)
+    return f'{root}-{shard}{extension}'
+
+
+def get_order_queue(shard=0):
+    """
+    Return the order queue of a matching engine shard in the current process.
+    """
+
+    queue = _order_queues.get(shard)
+    if queue is None or queue.path != get_queue_path(shard):
+        queue = _order_queues[shard] = OrderQueue(get_queue_path(shard), settings.EXCHANGE_QUEUE_FILLS_KEPT)
+    return queue
+
+
+def get_symbol_queue(symbol):
+    """
+    Return the order queue of the matching engine shard that owns the book of a symbol.
+    """
+
+    return get_order_queue(get_shard(symbol, settings.EXCHANGE_MATCHING_SHARDS))
+
+
+def get_shard_symbols(shard):
+    return [symbol for symbol in SYMBOLS if get_shard(symbol, settings.EXCHANGE_MATCHING_SHARDS) == shard]
+
+
+def put_orders(kind, orders):
+    """
+    Append the events of several orders to the queues of their shards, one transaction for each queue.
+    """
+
+    order_ids = {}
+    for order in orders:
+        order_ids.setdefault(get_shard(order.symbol, settings.EXCHANGE_MATCHING_SHARDS), []).append(order.pk)
+    for shard, shard_order_ids in order_ids.items():
+        get_order_queue(shard).put_many(kind, shard_order_ids)
+
+
+def process_event(kind, order_id):
+    """
+    Apply an order event to the book of the matching engine.
+
+    :argument
+    - kind: NEW_ORDER or CANCEL_ORDER.
+    - order_id: Primary key of the 'Order' object.
+
+    :return
+    - List of the 'Fill' objects created.
+
+    :raise
+    - Any error of the matching, the funds of a new order that can not be placed are released first.
+    """
+
+    order = Order.objects.filter(pk=order_id, status=True).first()
+    if order is None:
+        # Already executed or canceled
+        return []
+
+    if kind == NEW_ORDER:
+        try:
+            return submit_order(order)
+        except Exception:
+            # The order would stay active with its funds frozen, outside of the book
+            order = Order.objects.filter(pk=order_id, status=True).first()
+            if order is not None:
+                cancel_order(order)
+            raise
+
+    if kind == CANCEL_ORDER:
+        cancel_order(order)
+    return []
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.core.cache import cache
+
+# Cached authentication of a token: the user field values and the ids of its profile and wallet
+TokenEntry = namedtuple('TokenEntry', [
+    'user_id', 'user_fields', 'user_values', 'profile_id', 'wallet_id', 'cached_at', 'expires_at'
+])
+
+
+def get_token_revoked_key(key):
+    return f'exchange:revoked-token:{key}'
+
+
+def get_user_revoked_key(user_id):
+    return f'exchange:revoked-user:{user_id}'
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of the token authentications of the current process.
+    A deleted token or a changed user is also marked as revoked, with the time of the revocation, in the
+    Django cache shared by the processes: each hit reads the markers of its token and user, and the entries
+    cached before a revocation are discarded, so a logout is effective in every process at once.
+    Entries expire after a timeout, which also bounds how long the markers are kept.
+
+    :argument
+    - max_size: Maximum number of tokens, the least recently used is discarded first.
+    - timeout: Seconds an entry is valid.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # Token key -> TokenEntry
+
+    def get(self, key):
+        """
+        Return the 'TokenEntry' of a token, None if it is not cached, expired or revoked.
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+
+        revoked = cache.get_many([get_token_revoked_key(key), get_user_revoked_key(entry.user_id)])
+        if any(revoked_at >= entry.cached_at for revoked_at in revoked.values()):
+            with self.lock:
+                self.entries.pop(key, None)
+            return None
+        return entry
+
+    def set(self, key, user, profile_id, wallet_id):
+        fields = tuple(field.attname for field in user._meta.concrete_fields)
+        entry = TokenEntry(user.pk, fields, tuple(getattr(user, name) for name in fields), profile_id, wallet_id,
+                           time.time(), time.monotonic() + self.timeout)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        cache.set(get_token_revoked_key(key), time.time(), self.timeout)
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_user(self, user_id):
+        cache.set(get_user_revoked_key(user_id), time.time(), self.timeout)
+        # Users have few tokens, the cache is bounded: a scan is cheaper than an index to maintain
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry.user_id == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(settings.EXCHANGE_TOKEN_CACHE_SIZE, settings.EXCHANGE_TOKEN_CACHE_TIMEOUT)
+    return _token_cache
@@ -1,40 +1,431 @@
+from collections import defaultdict
 from datetime import datetime
-from exchange.models import Transaction
+from django.conf import settings
+from exchange.models import Fill, Order, Transaction
+from exchange.utils.bulk import bulk_delete, update_where
+from exchange.utils.candles import update_candles
+from exchange.utils.amounts import quote_amount
+from exchange.utils.depth import touch_book
+from exchange.utils.event_log import order_cancelled, order_filled, record_events
+from exchange.utils.instruments import balance_field, get_instrument
+from exchange.utils.instrumentation import timed
+from exchange.utils.ledger import InsufficientBalance, frozen_amount, unfreeze_order, update_wallets
+from exchange.utils.market_data import publish_book_levels, publish_fills, publish_order
+from exchange.utils.order_book import get_order_book
+from exchange.utils.profile_stats import executed_order_deltas, update_order_counters
+from exchange.utils.triggers import get_trigger_book
 
+# Order fields written by a trade
+TRADE_FIELDS = ('price', 'filled_quantity', 'status', 'transaction')
 
-def perform_trade(buy_order, buy_order_wallet, sell_order, sell_order_wallet):
+
+class StaleOrder(Exception):
+    """
+    An order matched by the in-memory book, or being canceled, has been filled or canceled by another process.
+
+    :fields
+    - order: The 'Order' object, its fields are restored to the values seen by this process.
+    """
+
+    def __init__(self, order):
+        super().__init__(f'order {order.pk} has been filled or canceled meanwhile')
+        self.order = order
+
+
+def get_trade_assets(order):
+    """
+    Return the balance delta names of the base and the quote asset of the instrument of an order,
+    as two dicts {'available': name, 'frozen': name}.
+    """
+
+    instrument = get_instrument(order.symbol)
+    return tuple(
+        {state: balance_field(state, asset) for state in ('available', 'frozen')}
+        for asset in (instrument.base, instrument.quote)
+    )
+
+
+def trade_states(orders):
+    # Values of the trade fields of the orders before a trade, by order primary key
+    return {order.pk: {name: getattr(order, name) for name in TRADE_FIELDS} for order in orders}
+
+
+def execute_orders(transaction, orders, states, deltas):
+    """
+    Write the orders executed by a trade, then apply its balance deltas.
+    Each order is written only if it is still active with the filled quantity matched by the book,
+    so an order filled or canceled by another worker is never executed twice. If the trade can not be
+    executed, the orders already written and the in-memory orders are restored and the transaction
+    is deleted.
+
+    :argument
+    - transaction: 'Transaction' object of the trade.
+    - orders: List of the executed 'Order' objects.
+    - states: Values of the trade fields of the orders before the trade, returned by 'trade_states()'.
+    - deltas: Dict {profile id: {field name: delta}} of the trade.
+
+    :raise
+    - StaleOrder: An order is no longer active with the filled quantity matched by the book.
+    - InsufficientBalance: A frozen balance would become negative.
+    """
+
+    written = []
+    try:
+        for order in orders:
+            lookup = {'id': order.pk, 'status': True, 'filled_quantity': states[order.pk]['filled_quantity']}
+            if not update_where(Order, lookup, {name: getattr(order, name) for name in TRADE_FIELDS}):
+                raise StaleOrder(order)
+            written.append(order)
+        update_wallets(deltas)
+    except (StaleOrder, InsufficientBalance):
+        for order in written:
+            update_where(Order, {'id': order.pk}, states[order.pk])
+        for order in orders:
+            for name, value in states[order.pk].items():
+                setattr(order, name, value)
+        bulk_delete(Transaction, [transaction.pk])
+        raise
+
+
+def perform_trade(buy_order, sell_order, aggressor):
     """
     Performs a simple operation in which the field 'quantity' of the two orders are equal and
     the final price is equal to the buy order price.
 
     :argument
     - buy_order: Must be an 'Order' object.
-    - buy_order_wallet: Must be a 'Wallet' object.
     - sell_order: Must be an 'Order' object.
-    - sell_order_wallet: Must be a 'Wallet' object.
+    - aggressor: Type of the incoming order, 'B' or 'S'.
+
+    :return
+    - The 'Fill' object of the trade.
+
+    :raise
+    - StaleOrder: Nothing has been executed.
     """
 
-    dollar_amount = buy_order.quantity * buy_order.price
+    amount = quote_amount(buy_order.quantity, buy_order.price)
+    base, quote = get_trade_assets(buy_order)
+    states = trade_states([buy_order, sell_order])
     time_execution = datetime.now()
     transaction = Transaction.objects.create()
 
     # Execution of buy order
     buy_order.executed_at = time_execution
+    buy_order.filled_quantity = buy_order.quantity
     buy_order.status = False
     buy_order.transaction = transaction
-    buy_order.save()
-    buy_order_wallet.frozen_dollar -= dollar_amount
-    buy_order_wallet.available_bitcoin += buy_order.quantity
-    buy_order_wallet.save()
 
     # Execution of sell order
     sell_order.price = buy_order.price
     sell_order.executed_at = time_execution
+    sell_order.filled_quantity = sell_order.quantity
     sell_order.status = False
     sell_order.transaction = transaction
-    sell_order.save()
-    sell_order_wallet.frozen_bitcoin -= buy_order.quantity
-    sell_order_wallet.available_dollar += dollar_amount
-    sell_order_wallet.save()
 
+    execute_orders(transaction, [buy_order, sell_order], states, {
+        buy_order.profile_id: {quote['frozen']: -amount, base['available']: buy_order.quantity},
+        sell_order.profile_id: {base['frozen']: -sell_order.quantity, quote['available']: amount},
+    })
+    update_order_counters(executed_order_deltas([buy_order, sell_order]))
+
+    fill = Fill.objects.create(
+        transaction=transaction,
+        buy_order=buy_order,
+        sell_order=sell_order,
+        symbol=buy_order.symbol,
+        price=buy_order.price,
+        quantity=buy_order.quantity,
+        aggressor=aggressor
+    )
+    record_events([order_filled(fill)])
+    update_candles([fill])
+    return fill
+
+
+def perform_sweep(order, fills):
+    """
+    Execute an incoming order against one or more resting orders, partially filling them if needed.
+    Each fill is executed at the resting order price, the buyer gets back the quote asset frozen
+    in excess. The orders and wallets are written by 'execute_orders()', then the fills in one batch.
+
+    :argument
+    - order: Must be an 'Order' object.
+    - fills: List of ('Order' object, quantity) tuples returned by 'OrderBook.sweep()'.
+
+    :return
+    - List of the 'Fill' objects created, grouped by the same 'Transaction' object.
+
+    :raise
+    - StaleOrder: Nothing has been executed.
+    """
+
+    filled_orders = [order] + [resting_order for resting_order, quantity in fills]
+    states = trade_states(filled_orders)
+    transaction = Transaction.objects.create()
+    fill_objects = []
+    wallet_deltas = defaultdict(lambda: defaultdict(int))
+    base, quote = get_trade_assets(order)
+
+    for resting_order, quantity in fills:
+        if order.type == 'B':
+            buy_order, sell_order = order, resting_order
+        else:
+            buy_order, sell_order = resting_order, order
+        price = resting_order.price
+        fill_objects.append(
+            Fill(
+                transaction=transaction,
+                buy_order=buy_order,
+                sell_order=sell_order,
+                symbol=order.symbol,
+                price=price,
+                quantity=quantity,
+                aggressor=order.type
+            )
+        )
+
+        # Quote asset frozen by the buy order for this quantity, at the buy order price
+        released_amount = (
+            frozen_amount(buy_order, buy_order.filled_quantity + quantity)
+            - frozen_amount(buy_order, buy_order.filled_quantity)
+        )
+        # Rounded up, but never above the amount released: the frozen amount is rounded up on the whole filled
+        # quantity of the buy order, so its previous fills may already have paid the rounding of this one
+        amount = min(quote_amount(quantity, price), released_amount)
+
+        for filled_order in (buy_order, sell_order):
+            filled_order.filled_quantity += quantity
+            if filled_order.remaining_quantity <= 0:
+                filled_order.status = False
+                filled_order.transaction = transaction
+
+        # Buyer: spend the frozen quote asset and get back the difference with the execution price
+        buyer_deltas = wallet_deltas[buy_order.profile_id]
+        buyer_deltas[quote['frozen']] -= released_amount
+        buyer_deltas[quote['available']] += released_amount - amount
+        buyer_deltas[base['available']] += quantity
+
+        # Seller: spend the frozen base asset
+        seller_deltas = wallet_deltas[sell_order.profile_id]
+        seller_deltas[base['frozen']] -= quantity
+        seller_deltas[quote['available']] += amount
+
+    execute_orders(transaction, filled_orders, states, wallet_deltas)
+    Fill.objects.bulk_create(fill_objects)
+    record_events([order_filled(fill) for fill in fill_objects])
+    update_candles(fill_objects)
+    update_order_counters(executed_order_deltas(filled_orders))
+    return fill_objects
+
+
+def submit_order(order):
+    """
+    Match a new order, or keep a stop order waiting for the trade print that triggers it.
+
+    :argument
+    - order: Must be an 'Order' object whose amount has already been frozen.
+
+    :return
+    - List of the 'Fill' objects created.
+    """
+
+    if order.kind in Order.STOP_KINDS:
+        get_trigger_book(order.symbol).add(order)
+        publish_order(order)
+        return []
+    return match_order(order)
+
+
+@timed('matching')
+def match_order(order):
+    """
+    Match a new order against the book, the remaining quantity is left resting in the book.
+    The remaining quantity of market, IOC and FOK orders is canceled instead, and a FOK order is
+    not matched at all if it can not be filled entirely.
+    A trade whose frozen balances do not back it is not executed: the resting orders of the profile at
+    fault are skipped, or the new order is canceled if it is at fault.
+
+    :argument
+    - order: Must be an 'Order' object whose amount has already been frozen.
+
+    :return
+    - List of the 'Fill' objects created.
+    """
+
+    book = get_order_book(order.symbol)
+    # The new order is already in the book if the book has just been rebuilt
+    book.remove(order)
+    if not settings.EXCHANGE_MATCHING_ENGINE:
+        # Other web workers may have added orders this book does not have
+        book.sync_crossing(order)
+    immediate = order.kind == Order.MARKET or order.time_in_force in (Order.IMMEDIATE_OR_CANCEL, Order.FILL_OR_KILL)
+    # Market orders are never restricted to resting orders with the same quantity
+    sweep = settings.EXCHANGE_PARTIAL_FILLS or order.kind == Order.MARKET
+
+    while True:
+        try:
+            resting_orders, fill_objects = execute_match(book, order, sweep)
+            break
+        except StaleOrder as error:
+            # Another worker has executed or canceled an order since this book was loaded
+            if error.order is not order:
+                book.reload_level(error.order.type, error.order.price)
+                continue
+            order = Order.objects.filter(pk=order.pk, status=True).first()
+            if order is None:
+                return []
+        except InsufficientBalance as error:
+            # A frozen balance does not back the trade, nothing has been executed
+            if error.profile_id in (None, order.profile_id):
+                # The new order can not be executed, its remaining quantity is canceled
+                cancel_order(order)
+                return []
+            # Skip the resting orders of the profile for this match, the new order is matched with the others
+            for resting_order in list(book.opposite(order.type).crossing(order.price)):
+                if resting_order.profile_id == error.profile_id:
+                    book.remove(resting_order)
+
+    changed_levels = [(o.type, o.price) for o in resting_orders]
+    for resting_order in resting_orders:
+        if not resting_order.status:
+            book.remove(resting_order)
+    if order.status and not immediate:
+        book.add(order)
+        changed_levels.append((order.type, order.price))
+
+    touch_book()
+    publish_book_levels(book, changed_levels)
+    if fill_objects:
+        publish_fills(fill_objects)
+    else:
+        publish_order(order)
+
+    if order.status and immediate:
+        # The remaining quantity does not rest in the book
+        cancel_order(order)
+    if fill_objects:
+        process_triggers(fill_objects)
+    return fill_objects
+
+
+def execute_match(book, order, sweep):
+    """
+    Match an order against the book once.
+
+    :argument
+    - book: 'OrderBook' object of the instrument of the order.
+    - order: Must be an 'Order' object whose amount has already been frozen.
+    - sweep: True to sweep several resting orders, False to match one order with the same quantity.
+
+    :return
+    - Tuple (list of the resting 'Order' objects matched, list of the 'Fill' objects created).
+
+    :raise
+    - StaleOrder: Nothing has been executed.
+    """
+
+    if order.time_in_force == Order.FILL_OR_KILL and not (
+            book.can_fill(order) if sweep else book.best_match(order) is not None):
+        # Kill the order without any fill
+        return [], []
+
+    if sweep:
+        # Sweep the book and leave the remaining quantity resting
+        fills = book.sweep(order)
+        return [resting_order for resting_order, quantity in fills], perform_sweep(order, fills) if fills else []
+
+    # Match the best order with the same quantity or leave the new order resting
+    resting_order = book.best_match(order)
+    if resting_order is None:
+        return [], []
+    book.remove(resting_order)
+    if order.type == 'B':
+        return [resting_order], [perform_trade(order, resting_order, order.type)]
+    return [resting_order], [perform_trade(resting_order, order, order.type)]
+
+
+def process_triggers(fills):
+    """
+    Activate and match the stop orders triggered by the prints of a trade.
+    Stop orders become market orders and stop-limit orders become limit orders, their own prints
+    can trigger more stop orders in turn.
+
+    :argument
+    - fills: List of the 'Fill' objects of the trade.
+    """
+
+    prices = [fill.price for fill in fills]
+    for stop_order in get_trigger_book(fills[0].symbol).pop_triggered(min(prices), max(prices)):
+        stop_order.kind = Order.MARKET if stop_order.kind == Order.STOP else Order.LIMIT
+        stop_order.save(update_fields=['kind'])
+        match_order(stop_order)
+
+
+def release_order(order):
+    """
+    Remove an order from the book and unfreeze the amount needed to fulfill its remaining quantity.
+    The order is first marked inactive in the database, only if it is still active with the filled
+    quantity of the object, so the amount of an order filled by another worker meanwhile is not unfrozen.
+
+    :argument
+    - order: Must be an 'Order' object.
+
+    :raise
+    - StaleOrder: Nothing has been released.
+    - InsufficientBalance: Nothing has been released, the order is active again.
+    """
+
+    lookup = {'id': order.pk, 'status': True, 'filled_quantity': order.filled_quantity}
+    if not update_where(Order, lookup, {'status': False}):
+        raise StaleOrder(order)
+    try:
+        unfreeze_order(order)
+    except InsufficientBalance:
+        update_where(Order, {'id': order.pk}, {'status': True})
+        raise
+
+    book = get_order_book(order.symbol)
+    book.remove(order)
+    get_trigger_book(order.symbol).remove(order)
+    record_events([order_cancelled(order)])
+    publish_book_levels(book, [(order.type, order.price)])
+
+
+def close_order(order):
+    """
+    Cancel the remaining quantity of a partially filled order.
+    The order is kept with the executed quantity only, so its fills are not lost.
+
+    :argument
+    - order: Must be an 'Order' object.
+    """
+
+    release_order(order)
+    order.quantity = order.filled_quantity
+    order.status = False
+    order.save()
+    update_order_counters(executed_order_deltas([order]))
+    touch_book()
+
+
+def cancel_order(order):
+    """
+    Cancel an active order: partially filled orders are closed, the others are deleted.
+
+    :argument
+    - order: Must be an 'Order' object.
+
+    :raise
+    - StaleOrder: The order has been filled or canceled by another worker, nothing has been canceled.
+    - InsufficientBalance: Nothing has been canceled.
+    """
 
+    if order.filled_quantity:
+        # Keep the executed part of a partially filled order
+        close_order(order)
+    else:
+        # Released before the deletion, so a stale order is not deleted at all
+        release_order(order)
+        order._released = True
+        order.delete()
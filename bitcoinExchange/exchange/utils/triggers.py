@@ -0,0 +1,78 @@
+from exchange.models import Order
+from exchange.utils.instruments import DEFAULT_SYMBOL, SYMBOLS
+from exchange.utils.order_book import BookSide
+
+
+class TriggerBook:
+    """
+    In-memory index of the stop orders of one instrument waiting for a trade print, by stop price.
+    A print only visits the stop orders it triggers.
+
+    :fields
+    - buys: Buy stops, triggered by a print at or above the stop price, lowest stop price first.
+    - sells: Sell stops, triggered by a print at or below the stop price, highest stop price first.
+    - loaded: True once the index has been rebuilt from the active stop orders.
+    """
+
+    def __init__(self, symbol=DEFAULT_SYMBOL):
+        self.symbol = symbol
+        self.buys = BookSide(descending=False, price_field='stop_price')
+        self.sells = BookSide(descending=True, price_field='stop_price')
+        self.loaded = False
+
+    def side(self, order_type):
+        return self.buys if order_type == 'B' else self.sells
+
+    def load(self, orders):
+        self.clear()
+        for order in orders:
+            self.add(order)
+        self.loaded = True
+
+    def clear(self):
+        self.buys.clear()
+        self.sells.clear()
+
+    def reset(self):
+        # Discard the index, it will be rebuilt from the database on the next access
+        self.clear()
+        self.loaded = False
+
+    def add(self, order):
+        self.side(order.type).add(order)
+
+    def remove(self, order):
+        if order.stop_price is None:
+            return False
+        return self.side(order.type).remove(order)
+
+    def pop_triggered(self, low_price, high_price):
+        """
+        Remove and return the stop orders triggered by trade prints between two prices.
+
+        :argument
+        - low_price: Lowest price printed, cents.
+        - high_price: Highest price printed, cents.
+        """
+
+        triggered = list(self.buys.crossing(high_price)) + list(self.sells.crossing(low_price))
+        for order in triggered:
+            self.remove(order)
+        return triggered
+
+
+trigger_books = {symbol: TriggerBook(symbol) for symbol in SYMBOLS}
+trigger_book = trigger_books[DEFAULT_SYMBOL]
+
+
+def get_trigger_book(symbol=DEFAULT_SYMBOL):
+    """
+    Return the stop order index of an instrument in the current process.
+    The index is rebuilt from the active stop orders of the instrument the first time it is accessed.
+    """
+
+    book = trigger_books[symbol]
+    if not book.loaded:
+        stop_orders = Order.objects.filter(status=True, kind__in=Order.STOP_KINDS, symbol=symbol)
+        book.load(stop_orders.order_by('created_at', 'pk'))
+    return book
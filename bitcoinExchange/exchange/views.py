@@ -1,3 +1,16 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from exchange.utils.instrumentation import registry
 
-# Create your views here.
+
+def metrics(request):
+    """
+    Per-view histograms of the instrumented requests in the Prometheus text format.
+    Each worker process exposes its own requests.
+
+    * Only available if 'EXCHANGE_INSTRUMENTATION' is enabled.
+    """
+
+    if not settings.EXCHANGE_INSTRUMENTATION:
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
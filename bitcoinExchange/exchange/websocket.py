@@ -0,0 +1,71 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from exchange.utils.broker import broker
+from exchange.utils.market_data import BOOK_CHANNEL, TRADES_CHANNEL, get_profile_channel
+from exchange.utils.token_cache import get_token_cache
+from rest_framework.authtoken.models import Token
+
+
+@sync_to_async
+def get_profile_id(token_key):
+    """
+    Return the primary key of the profile authenticated by a token, None if the token is not valid or the
+    user is inactive. The authentication is cached like by 'CachedTokenAuthentication'.
+    """
+
+    token_cache = get_token_cache()
+    entry = token_cache.get(token_key)
+    if entry is not None:
+        return entry.profile_id
+    token = Token.objects.select_related('user__profile__wallet').filter(key=token_key).first()
+    if token is None or not token.user.is_active:
+        return None
+    profile = token.user.profile
+    token_cache.set(token_key, token.user, profile.pk, profile.wallet.pk)
+    return profile.pk
+
+
+async def market_data_application(scope, receive, send):
+    """
+    WebSocket ASGI application.
+    Push the order book deltas and the trade prints to every client, and the order and wallet
+    updates to the authenticated user.
+
+    :params
+    - token: Authentication token, the connection is rejected if it is not valid.
+
+    :messages
+    - {"type": "book", "symbol": ..., "side": "bids"/"asks", "price": ..., "quantity": ...}: 0 if the level is empty.
+    - {"type": "trade", "symbol": ..., "price": ..., "quantity": ..., "aggressor": "B"/"S"}
+    - {"type": "order", "id": ..., "status": ..., "filled_quantity": ...}
+    - {"type": "wallet", "deltas": {field: delta}}
+    """
+
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    token_key = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    profile_id = await get_profile_id(token_key) if token_key else None
+    if profile_id is None:
+        await send({'type': 'websocket.close', 'code': 4001})
+        return
+
+    await send({'type': 'websocket.accept'})
+    subscription = broker.subscribe([BOOK_CHANNEL, TRADES_CHANNEL, get_profile_channel(profile_id)])
+
+    async def push():
+        while True:
+            message = await subscription.get()
+            await send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    push_task = asyncio.ensure_future(push())
+    try:
+        # Client messages are ignored, wait for the disconnection
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+    finally:
+        push_task.cancel()
+        broker.unsubscribe(subscription)